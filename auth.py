@@ -1,20 +1,257 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
 from database import DatabaseManager
-from typing import Optional
+from tracing import traced, annotate
+from typing import Optional, Dict, Any, Tuple
 
 
 
 class User:
+    __slots__ = ('id', 'first_name', 'last_name', 'username', 'email', 'department_id', 'position',
+                 'is_manager', 'is_active')
+
     def __init__(self, user_data: dict):
+        self.id = user_data.get('id')
         self.first_name = user_data['first_name']
         self.last_name = user_data['last_name']
         self.username = user_data['username']
         self.email = user_data['email']
+        self.department_id = user_data.get('department_id')
+        self.position = user_data.get('position')
+        self.is_manager = bool(user_data.get('is_manager', False))
         self.is_active = user_data.get('is_active', True)
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
     def __str__(self):
+        # Идентификаторы нужны модели, чтобы фильтровать по assigned_user_id = <id> без поиска по имени
         return (f"{self.first_name} {self.last_name}\n"
+                f"id: {self.id}\n"
                 f"username: {self.username}\n"
-                f"email: {self.email}\n")
+                f"email: {self.email}\n"
+                f"department_id: {self.department_id}\n"
+                f"position: {self.position}\n"
+                f"is_manager: {self.is_manager}\n")
+
+
+# Состояние users: правки строк видны по updated_at, вставки и удаления - по числу строк и сумме id
+USER_STATE_QUERY = "SELECT max(updated_at) AS updated_at, count(*) AS n, coalesce(sum(id), 0) AS id_sum FROM users"
+
+USER_COLUMNS = "id, first_name, last_name, username, email, department_id, position, is_manager, is_active, updated_at"
+
+
+class UserDirectory:
+    """
+    Справочник пользователей в памяти процесса
+
+    Все пользователи загружаются одним запросом; дальше не чаще раза в ttl секунд
+    дочитываются строки с updated_at не старше сохраненного max(updated_at) минус
+    window: триггер ставит updated_at = now(), то есть время начала транзакции, и
+    долгая транзакция может закоммитить строку с меткой раньше уже прочитанного
+    максимума. Если изменился набор id (число строк или сумма id - удаление
+    и вставка за один ttl меняют сумму, потому что новые id больше старых), справочник
+    перезагружается целиком, чтобы удаленные пользователи из него пропали. Вход
+    и проверка токена - поиск в словаре.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, ttl: float = 30.0, miss_refresh_interval: float = 1.0,
+                 window: float = 300.0):
+        """
+        Args:
+            db_manager: Менеджер БД с таблицей users
+            ttl: Как часто сверять справочник с users, сек
+            miss_refresh_interval: Не чаще раза в столько секунд перечитывать users, если пользователь не найден
+            window: На сколько секунд назад от сохраненного max(updated_at) перечитывать строки -
+                    дольше этого транзакции, меняющие users, идти не должны
+        """
+        self.db_manager = db_manager
+        self.ttl = ttl
+        self.miss_refresh_interval = miss_refresh_interval
+        self.window = window
+
+        self._by_id: Dict[int, User] = {}
+        self._by_username: Dict[str, User] = {}
+        self._state: Optional[Tuple[Any, int, int]] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def find(self, first_name: str, last_name: str, email: str, username: str) -> Optional[User]:
+        """Активный пользователь с точно такими данными или None"""
+        user = self._match(username, first_name, last_name, email)
+        if user is None:
+            # Пользователя могли добавить после последней сверки
+            self.refresh(min_interval=self.miss_refresh_interval)
+            user = self._match(username, first_name, last_name, email)
+        return user
+
+    def get(self, user_id: int) -> Optional[User]:
+        """Активный пользователь по id или None"""
+        self.refresh()
+        user = self._by_id.get(user_id)
+        return user if user is not None and user.is_active else None
+
+    def invalidate(self):
+        """Сброс справочника: при следующем обращении users перечитается целиком"""
+        with self._lock:
+            self._state = None
+
+    def refresh(self, min_interval: Optional[float] = None):
+        with self._lock:
+            now = time.monotonic()
+            if self._state is not None and now - self._checked_at < (self.ttl if min_interval is None else min_interval):
+                return
+            self._checked_at = now
+
+            row = self.db_manager.execute_query(USER_STATE_QUERY)[0]
+            state = (row['updated_at'], row['n'], row['id_sum'])
+
+            reload = self._state is None or self._state[0] is None or state[1:] != self._state[1:]
+            if reload:
+                rows = self.db_manager.execute_query(f"SELECT {USER_COLUMNS} FROM users")
+                self._by_id.clear()
+                self._by_username.clear()
+            else:
+                # Окно перечитывается и при неизменном состоянии: поздний коммит не сдвигает max(updated_at)
+                rows = self.db_manager.execute_query(
+                    f"SELECT {USER_COLUMNS} FROM users WHERE updated_at >= %s - make_interval(secs => %s)",
+                    (self._state[0], self.window))
+            for user_row in rows:
+                self._store(User(user_row))
+            self._state = state
+            if reload:
+                self.logger.info(f"User directory reloaded: {len(self._by_id)} users")
+            else:
+                self.logger.debug(f"User directory refreshed: {len(rows)} rows read, {len(self._by_id)} users")
+
+    def _store(self, user: User):
+        previous = self._by_id.get(user.id)
+        if previous is not None and previous.username != user.username:
+            self._by_username.pop(previous.username, None)
+        self._by_id[user.id] = user
+        self._by_username[user.username] = user
+
+    def _match(self, username: str, first_name: str, last_name: str, email: str) -> Optional[User]:
+        self.refresh()
+        user = self._by_username.get(username)
+        if user is None or not user.is_active:
+            return None
+        if (user.first_name, user.last_name, user.email) != (first_name, last_name, email):
+            return None
+        return user
+
+    def __len__(self):
+        return len(self._by_id)
+
+
+# Справочники общие на процесс, как и пулы подключений: ключ - параметры подключения
+_directories: Dict[tuple, UserDirectory] = {}
+_directories_lock = threading.Lock()
+
+
+def get_user_directory(db_config: dict) -> UserDirectory:
+    key = tuple(sorted(db_config.items()))
+    with _directories_lock:
+        if key not in _directories:
+            # Справочник читает users с основной БД, без реплик: сверка состояния и дочитывание строк
+            # должны видеть одни и те же данные, а отключенный пользователь - терять доступ без отставания
+            _directories[key] = UserDirectory(
+                DatabaseManager(db_config, use_sqlalchemy=False, pooled=True),
+                ttl=float(os.environ.get('USER_DIRECTORY_TTL', 30)),
+                window=float(os.environ.get('USER_DIRECTORY_WINDOW', 300))
+            )
+        return _directories[key]
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+class SessionTokens:
+    """
+    Подписанные токены сессии: base64(JSON {uid, exp, jti}).base64(HMAC-SHA256)
+
+    Сервер не хранит выданные токены: проверка - пересчет подписи и срока. С общим
+    секретом (SESSION_SECRET) токены переживают перезапуск и подходят любому
+    экземпляру сервиса; отозванные до истечения срока токены помнятся в памяти.
+    """
+
+    def __init__(self, secret: Optional[bytes] = None, ttl: float = 900.0):
+        """
+        Args:
+            secret: Ключ подписи (по умолчанию SESSION_SECRET, иначе случайный на процесс)
+            ttl: Время жизни токена, сек
+        """
+        self.logger = logging.getLogger(__name__)
+        if secret is None:
+            configured = os.environ.get('SESSION_SECRET')
+            if configured:
+                secret = configured.encode('utf-8')
+            else:
+                secret = secrets.token_bytes(32)
+                self.logger.warning("SESSION_SECRET is not set, session tokens will not survive a restart")
+        self.secret = secret
+        self.ttl = ttl
+
+        self._revoked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def issue(self, user: User) -> str:
+        payload = json.dumps({'uid': user.id, 'exp': int(time.time() + self.ttl), 'jti': secrets.token_hex(8)},
+                             separators=(',', ':')).encode('utf-8')
+        body = _b64encode(payload)
+        return f"{body}.{self._sign(body)}"
+
+    def verify(self, token: str) -> Optional[int]:
+        """id пользователя из действующего токена или None"""
+        claims = self._claims(token)
+        if claims is None:
+            return None
+        with self._lock:
+            if claims['jti'] in self._revoked:
+                return None
+        return claims['uid']
+
+    def revoke(self, token: str):
+        claims = self._claims(token)
+        if claims is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._revoked[claims['jti']] = claims['exp']
+            # Истекшие токены и так не пройдут проверку - из списка отозванных их можно убрать
+            for jti in [jti for jti, expires in self._revoked.items() if expires <= now]:
+                del self._revoked[jti]
+
+    def _claims(self, token: str) -> Optional[Dict[str, Any]]:
+        # Токен - только base64url и точка; иначе сравнение подписи и кодирование в ASCII упали бы
+        if not token.isascii():
+            return None
+        body, _, signature = token.partition('.')
+        if not body or not hmac.compare_digest(signature, self._sign(body)):
+            return None
+        try:
+            claims = json.loads(_b64decode(body))
+        except ValueError:
+            return None
+        if not isinstance(claims, dict) or claims.get('exp', 0) <= time.time():
+            return None
+        return claims
+
+    def _sign(self, body: str) -> str:
+        return _b64encode(hmac.new(self.secret, body.encode('ascii'), hashlib.sha256).digest())
 
 
 class UserAuthenticator:
@@ -26,41 +263,24 @@ class UserAuthenticator:
             'user': 'postgres',
             'password': 'postgres'
         }
-        # Используем DatabaseManager с psycopg2 (use_sqlalchemy=False)
-        self.db_manager = DatabaseManager(self.db_config, use_sqlalchemy=False)
+        # Пользователи берутся из общего на процесс справочника в памяти:
+        # вход не ходит в Postgres, пока справочник свежий
+        self.directory = get_user_directory(self.db_config)
 
+    @traced('authenticate')
     def authenticate(self, first_name: str, last_name: str, email: str, username: str) -> Optional[User]:
         try:
-            # Создаем подключение через DatabaseManager
-            self.db_manager.create_connect()
-
-            # Выполняем запрос через execute_query
-            query = '''
-                SELECT * FROM users 
-                WHERE first_name = %s AND last_name = %s AND email = %s AND username = %s
-                AND is_active = TRUE
-            '''
-            params = (first_name, last_name, email, username)
-
-            result = self.db_manager.execute_query(query, params)
-
-            if result:
-                # result уже содержит словарь благодаря RealDictCursor
-                user_data = result[0]  # Берем первую запись
-                user = User(user_data)
-                print(f"Пользователь найден: {first_name} {last_name} ({username})")
-                return user
-            else:
-                print(f"Пользователь не найден: {first_name} {last_name} ({username})")
-                return None
-
+            user = self.directory.find(first_name, last_name, email, username)
         except Exception as e:
             print(f"Ошибка подключения к базе данных: {e}")
             return None
-        finally:
-            # Закрываем подключение
-            if hasattr(self, 'db_manager'):
-                self.db_manager.close_connect()
+
+        annotate(found=user is not None)
+        if user is not None:
+            print(f"Пользователь найден: {first_name} {last_name} ({username})")
+        else:
+            print(f"Пользователь не найден: {first_name} {last_name} ({username})")
+        return user
 
 def authentication(db_config=None):
     print("Идентифицируйте себя, введя: имя, фамилию, email и username")
@@ -95,4 +315,4 @@ if __name__ == "__main__":
     user = authentication(db_config)
 
     if user:
-        print(f"Добро пожаловать, {user}!")
\ No newline at end of file
+        print(f"Добро пожаловать, {user}!")
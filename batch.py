@@ -0,0 +1,149 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any
+
+from dotenv import load_dotenv
+
+from auth import UserAuthenticator, User, authentication
+from database import close_all_pools
+from llm_client import configure_llm_client
+from smart_line import generate_sql, execute_sql, cache_sql, log_executed_sql, db_config, LLM_PATHS
+from tracing import span
+
+
+def read_prompts(path: str) -> list:
+    '''
+        читает JSONL с промптами: {"id": ..., "prompt": ..., "output": ...};
+        id и output необязательны
+    '''
+    items = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            item.setdefault('id', str(line_number))
+            items.append(item)
+    return items
+
+
+async def process_prompt(item: Dict[str, Any], user: User, output_dir: str,
+                         llm_slots: asyncio.Semaphore, db_slots: asyncio.Semaphore,
+                         output_format: str = 'csv') -> Dict[str, Any]:
+    '''
+        план -> SQL -> выполнение для одного промпта; LLM и БД ограничены отдельными семафорами,
+        поэтому пока одни промпты ждут модель, другие уже выполняются в базе
+    '''
+    prompt = item['prompt']
+    # Формат файла execute_sql определяет по расширению: .csv, .parquet или .arrow
+    output = item.get('output') or os.path.join(output_dir, f"{item['id']}.{output_format}")
+    status = {'id': item['id'], 'prompt': prompt, 'output': output}
+    started = time.monotonic()
+
+    # Корневой span промпта: этапы из asyncio.to_thread наследуют его через contextvars
+    with span('batch_prompt') as prompt_span:
+        try:
+            async with llm_slots:
+                sql_query, info = await asyncio.to_thread(generate_sql, prompt, user)
+            status['sql'] = sql_query
+            status['path'] = info['path']
+            status['llm_timings'] = {stage: round(seconds, 3) for stage, seconds in info['timings'].items()}
+            status['llm_seconds'] = round(time.monotonic() - started, 3)
+
+            if not sql_query:
+                status['status'] = 'no_sql'
+                return status
+
+            db_started = time.monotonic()
+            async with db_slots:
+                row_count, _, _ = await asyncio.to_thread(execute_sql, sql_query, output, info['params'])
+            status['db_seconds'] = round(time.monotonic() - db_started, 3)
+            log_executed_sql(sql_query, info['params'], info['path'], time.monotonic() - db_started)
+
+            if info['path'] in LLM_PATHS:
+                cache_sql(prompt, user, sql_query)
+
+            status['rows'] = row_count
+            status['status'] = 'ok' if row_count else 'empty'
+        except Exception as e:
+            status['status'] = 'error'
+            status['error'] = f"{type(e).__name__}: {e}"
+        finally:
+            status['seconds'] = round(time.monotonic() - started, 3)
+            prompt_span.set(id=item['id'], status=status.get('status'), rows=status.get('rows'))
+
+    return status
+
+
+async def run_batch(items: list, user: User, output_dir: str, status_path: str,
+                    llm_concurrency: int, db_concurrency: int, output_format: str = 'csv') -> Dict[str, int]:
+    '''
+        обрабатывает все промпты конкурентно и пишет статус каждого в JSONL по мере готовности
+    '''
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=llm_concurrency + db_concurrency))
+
+    llm_slots = asyncio.Semaphore(llm_concurrency)
+    db_slots = asyncio.Semaphore(db_concurrency)
+    summary = {}
+
+    tasks = [process_prompt(item, user, output_dir, llm_slots, db_slots, output_format) for item in items]
+    with open(status_path, 'w', encoding='utf-8') as status_file:
+        for done in asyncio.as_completed(tasks):
+            status = await done
+            status_file.write(json.dumps(status, ensure_ascii=False) + '\n')
+            status_file.flush()
+
+            summary[status['status']] = summary.get(status['status'], 0) + 1
+            print(f"[{sum(summary.values())}/{len(items)}] {status['id']}: {status['status']}")
+
+    return summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Пакетное выполнение промптов из JSONL-файла")
+    parser.add_argument('input', help="JSONL с промптами: {\"id\", \"prompt\", \"output\"}")
+    parser.add_argument('--output-dir', default='results', help="Куда сохранять результаты без явного output")
+    parser.add_argument('--format', choices=('csv', 'parquet', 'arrow'), default='csv',
+                        help="Формат результатов без явного output (parquet и arrow требуют pyarrow)")
+    parser.add_argument('--status', default='batch_status.jsonl', help="Файл со статусами промптов")
+    parser.add_argument('--llm-concurrency', type=int, default=4, help="Одновременных запросов к LLM")
+    parser.add_argument('--db-concurrency', type=int, default=4, help="Одновременных запросов к БД")
+    parser.add_argument('--first-name')
+    parser.add_argument('--last-name')
+    parser.add_argument('--email')
+    parser.add_argument('--username')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_args()
+
+    # Аутентификация один раз на весь пакет
+    if args.first_name and args.last_name and args.email and args.username:
+        user = UserAuthenticator(db_config).authenticate(args.first_name, args.last_name,
+                                                         args.email, args.username)
+    else:
+        user = authentication(db_config)
+
+    if user is None:
+        raise SystemExit(1)
+
+    configure_llm_client(max_concurrency=args.llm_concurrency)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    items = read_prompts(args.input)
+    started = time.monotonic()
+    try:
+        summary = asyncio.run(run_batch(items, user, args.output_dir, args.status,
+                                        args.llm_concurrency, args.db_concurrency, args.format))
+    finally:
+        close_all_pools()
+
+    print(f"Готово за {time.monotonic() - started:.1f} с: {summary}")
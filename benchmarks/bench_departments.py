@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+from typing import Dict, Any, List
+
+from dotenv import load_dotenv
+
+from benchmarks.datagen import bench_db_config, autocommit_connection
+from database import DatabaseManager
+
+
+MIGRATION_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'migrations', '003_department_closure.sql')
+
+SUBTREE_CTE = '''
+    WITH RECURSIVE subtree AS (
+        SELECT id FROM departments WHERE id = %(department)s
+        UNION ALL
+        SELECT d.id FROM departments d JOIN subtree s ON d.parent_department_id = s.id
+    )
+'''
+
+# Одни и те же вопросы двумя способами: (название, рекурсивный CTE, таблица замыкания)
+QUERIES = [
+    ('subtree_departments',
+     SUBTREE_CTE + "SELECT count(*) FROM subtree",
+     "SELECT count(*) FROM department_closure WHERE ancestor_id = %(department)s"),
+    ('subtree_tasks',
+     SUBTREE_CTE + "SELECT count(*) FROM tasks t JOIN subtree s ON t.assigned_department_id = s.id",
+     "SELECT count(*) FROM tasks t JOIN department_closure dc ON dc.descendant_id = t.assigned_department_id "
+     "WHERE dc.ancestor_id = %(department)s"),
+    ('subtree_open_tasks_by_status',
+     SUBTREE_CTE + "SELECT t.status, count(*) FROM tasks t JOIN subtree s ON t.assigned_department_id = s.id "
+                   "WHERE t.status NOT IN ('completed', 'cancelled') GROUP BY t.status",
+     "SELECT t.status, count(*) FROM tasks t JOIN department_closure dc ON dc.descendant_id = t.assigned_department_id "
+     "WHERE dc.ancestor_id = %(department)s AND t.status NOT IN ('completed', 'cancelled') GROUP BY t.status"),
+    ('path_to_root',
+     "WITH RECURSIVE path AS ("
+     "    SELECT id, parent_department_id, 0 AS depth FROM departments WHERE id = %(leaf)s"
+     "    UNION ALL"
+     "    SELECT d.id, d.parent_department_id, p.depth + 1 FROM departments d JOIN path p ON d.id = p.parent_department_id"
+     ") SELECT id FROM path ORDER BY depth",
+     "SELECT ancestor_id FROM department_closure WHERE descendant_id = %(leaf)s ORDER BY depth"),
+]
+
+
+def apply_migration(db_config: Dict[str, Any], path: str = MIGRATION_PATH) -> None:
+    connection = autocommit_connection(db_config)
+    try:
+        with connection.cursor() as cursor, open(path, 'r', encoding='utf-8') as f:
+            cursor.execute(f.read())
+    finally:
+        connection.close()
+
+
+def hierarchy_stats(db_manager: DatabaseManager) -> Dict[str, Any]:
+    return db_manager.execute_query(
+        "SELECT (SELECT count(*) FROM departments) AS departments, "
+        "(SELECT max(depth) FROM department_closure) AS max_depth, "
+        "(SELECT count(*) FROM department_closure) AS closure_rows"
+    )[0]
+
+
+def timed(db_manager: DatabaseManager, sql: str, params_list: List[Dict[str, Any]]) -> Dict[str, float]:
+    timings = []
+    for params in params_list:
+        started = time.perf_counter()
+        db_manager.execute_query(sql, params)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+    }
+
+
+def measure_queries(db_manager: DatabaseManager, repeats: int,
+                    seed: int) -> Dict[str, Dict[str, Dict[str, Dict[str, float]]]]:
+    '''
+        рекурсивный CTE против таблицы замыкания на одних и тех же отделах, две выборки:
+        upper_levels - отделы первых уровней (большие поддеревья), any_level - любые отделы с подотделами;
+        путь к корню считается от случайных листьев
+    '''
+    generator = random.Random(seed)
+    samples = {
+        'upper_levels': "SELECT descendant_id AS id FROM department_closure GROUP BY descendant_id "
+                        "HAVING max(depth) BETWEEN 1 AND 3",
+        'any_level': "SELECT DISTINCT parent_department_id AS id FROM departments "
+                     "WHERE parent_department_id IS NOT NULL",
+    }
+    leaves = [row['id'] for row in db_manager.execute_query(
+        "SELECT id FROM departments d WHERE NOT EXISTS "
+        "(SELECT 1 FROM departments c WHERE c.parent_department_id = d.id)"
+    )]
+
+    results = {}
+    for sample, sample_sql in samples.items():
+        departments = [row['id'] for row in db_manager.execute_query(sample_sql)]
+        params_list = [{'department': generator.choice(departments), 'leaf': generator.choice(leaves)}
+                       for _ in range(repeats)]
+        results[sample] = {}
+        for name, recursive_sql, closure_sql in QUERIES:
+            results[sample][name] = {
+                'recursive_cte': timed(db_manager, recursive_sql, params_list),
+                'closure': timed(db_manager, closure_sql, params_list),
+            }
+    return results
+
+
+def measure_maintenance(db_config: Dict[str, Any], inserts: int, seed: int) -> Dict[str, float]:
+    '''
+        цена поддержки таблицы: вставка отделов с триггером и без, перенос большого поддерева;
+        все изменения откатываются
+    '''
+    generator = random.Random(seed)
+    connection = autocommit_connection(db_config)
+    connection.autocommit = False
+    results = {}
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT max(id) FROM departments")
+            max_id = cursor.fetchone()[0]
+            parents = [generator.randint(1, max_id) for _ in range(inserts)]
+
+            def insert_departments() -> float:
+                started = time.perf_counter()
+                cursor.execute(
+                    "INSERT INTO departments (company_id, parent_department_id, name) "
+                    "SELECT 1, parent, 'bench' FROM unnest(%s::int[]) AS parent", (parents,)
+                )
+                return (time.perf_counter() - started) * 1000
+
+            cursor.execute("ALTER TABLE departments DISABLE TRIGGER department_closure_insert")
+            results['insert_without_trigger_ms'] = round(insert_departments(), 2)
+            connection.rollback()
+
+            results['insert_with_trigger_ms'] = round(insert_departments(), 2)
+            connection.rollback()
+
+            # Самый большой некорневой отдел переезжает под корень другого дерева
+            cursor.execute(
+                "SELECT c.ancestor_id, count(*) FROM department_closure c "
+                "JOIN departments d ON d.id = c.ancestor_id WHERE d.parent_department_id IS NOT NULL "
+                "GROUP BY c.ancestor_id ORDER BY count(*) DESC LIMIT 1"
+            )
+            department, subtree_size = cursor.fetchone()
+            cursor.execute("SELECT id FROM departments WHERE parent_department_id IS NULL AND id <> "
+                           "(SELECT ancestor_id FROM department_closure WHERE descendant_id = %s "
+                           "ORDER BY depth DESC LIMIT 1) LIMIT 1", (department,))
+            target = cursor.fetchone()
+            if target is not None:
+                started = time.perf_counter()
+                cursor.execute("UPDATE departments SET parent_department_id = %s WHERE id = %s",
+                               (target[0], department))
+                results['move_subtree_ms'] = round((time.perf_counter() - started) * 1000, 2)
+                results['moved_subtree_size'] = subtree_size
+            connection.rollback()
+    finally:
+        connection.close()
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Поддеревья отделов: рекурсивный CTE против migrations/003_department_closure.sql. "
+                    "Глубокая иерархия готовится заранее, например: python -m benchmarks.datagen "
+                    "--reset --companies 2 --departments 20000 --branching 2"
+    )
+    parser.add_argument('--database', help="База стенда (заполняется benchmarks/datagen.py)")
+    parser.add_argument('--repeats', type=int, default=30, help="Повторов каждого запроса")
+    parser.add_argument('--inserts', type=int, default=1000, help="Отделов во вставке при замере триггера")
+    parser.add_argument('--seed', type=int, default=1, help="Seed случайных отделов")
+    parser.add_argument('--json', help="Сохранить результаты в JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_args()
+
+    config = bench_db_config(args.database)
+    db_manager = DatabaseManager(config, use_sqlalchemy=False, pooled=True)
+
+    print("Применение migrations/003_department_closure.sql...")
+    started = time.monotonic()
+    apply_migration(config)
+    print(f"Готово за {time.monotonic() - started:.1f} с")
+
+    stats = hierarchy_stats(db_manager)
+    print(f"Отделов: {stats['departments']}, максимальная глубина: {stats['max_depth']}, "
+          f"строк в таблице замыкания: {stats['closure_rows']}\n")
+
+    queries = measure_queries(db_manager, args.repeats, args.seed)
+    print(f"{'отделы / запрос':<44} {'CTE, p50 мс':>12} {'замыкание, p50 мс':>18} {'ускорение':>10}")
+    for sample, sample_results in queries.items():
+        for name, result in sample_results.items():
+            speedup = result['recursive_cte']['p50_ms'] / max(result['closure']['p50_ms'], 0.001)
+            print(f"{sample + ' / ' + name:<44} {result['recursive_cte']['p50_ms']:>12.2f} "
+                  f"{result['closure']['p50_ms']:>18.2f} {speedup:>9.1f}x")
+
+    maintenance = measure_maintenance(config, args.inserts, args.seed)
+    print(f"\nВставка {args.inserts} отделов: {maintenance['insert_without_trigger_ms']:.1f} мс без триггера, "
+          f"{maintenance['insert_with_trigger_ms']:.1f} мс с триггером")
+    if 'move_subtree_ms' in maintenance:
+        print(f"Перенос поддерева из {maintenance['moved_subtree_size']} отделов: "
+              f"{maintenance['move_subtree_ms']:.1f} мс")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'database': config['database'], 'hierarchy': stats, 'repeats': args.repeats,
+                       'seed': args.seed, 'queries': queries, 'maintenance': maintenance},
+                      f, ensure_ascii=False, indent=2, default=str)
@@ -0,0 +1,374 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+from dotenv import load_dotenv
+
+# smart_line читает настройки при импорте: на стенде по умолчанию нет кэша результатов,
+# журнала SQL и файла кэша SQL, чтобы прогоны мерили один и тот же путь (переопределяется окружением)
+os.environ.setdefault('RESULT_CACHE', '0')
+os.environ.setdefault('GENERATED_SQL_LOG', '')
+os.environ.setdefault('SQL_CACHE_PATH', '')
+
+import batch  # noqa: E402
+import smart_line  # noqa: E402
+from auth import User, UserAuthenticator  # noqa: E402
+from benchmarks.datagen import bench_db_config  # noqa: E402
+from benchmarks.stub_llm import StubLLMServer  # noqa: E402
+from database import DatabaseManager, close_all_pools  # noqa: E402
+from llm_client import configure_llm_client, DEFAULT_MODEL  # noqa: E402
+from model_router import configure_model_router  # noqa: E402
+
+
+# Вопросы на все пути генерации: шаблоны, граф зависимостей, один вызов LLM и план + SQL
+PROMPTS = [
+    "Покажи мои задачи в работе",
+    "Мои просроченные задачи",
+    "Что блокирует задачу 150",
+    "Покажи последние задачи",
+    "Какие сотрудники заняты больше всего",
+    "История изменений за неделю",
+    "Сравни количество задач в каждом отделе по статусам",
+    "Сколько отделов в каждой компании",
+]
+
+EXPORT_SQL = '''
+    SELECT t.id, t.title, t.status, t.priority, t.due_date, t.created_at, u.username, d.name AS department
+    FROM tasks t
+    JOIN users u ON u.id = t.assigned_user_id
+    JOIN departments d ON d.id = t.assigned_department_id
+    ORDER BY t.id
+    LIMIT %s
+'''
+
+SCENARIOS = ('single_prompt', 'batch', 'csv_export', 'auth_storm')
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    '''
+        перцентиль по ближайшему рангу; список уже отсортирован
+    '''
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    '''
+        сводка по замерам в секундах: число, среднее, p50/p95/p99 и максимум в мс
+    '''
+    if not samples:
+        return {'count': 0}
+    values = sorted(seconds * 1000 for seconds in samples)
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values), 3),
+        'p50_ms': round(percentile(values, 50), 3),
+        'p95_ms': round(percentile(values, 95), 3),
+        'p99_ms': round(percentile(values, 99), 3),
+        'max_ms': round(values[-1], 3),
+    }
+
+
+class StageRecorder:
+    """Замеры по этапам сценария: этап -> список длительностей в секундах"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def error(self, name: str):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def result(self, **extra) -> Dict[str, Any]:
+        return {'stages': {stage: summarize(samples) for stage, samples in self.samples.items()},
+                'errors': self.errors, **extra}
+
+
+def bench_user(db_manager: DatabaseManager, user_id: int = 1) -> User:
+    return User(db_manager.execute_query("SELECT * FROM users WHERE id = %s", (user_id,))[0])
+
+
+def single_prompt(user: User, prompts: List[str], repeats: int, warmup: int, warm_cache: bool) -> Dict[str, Any]:
+    '''
+        промпты по одному: генерация SQL по этапам (generate.*), выполнение первой страницы и итог;
+        без warm_cache кэш SQL очищается перед каждым промптом, чтобы каждый раз доходить до LLM
+    '''
+    recorder = StageRecorder()
+    paths: Dict[str, int] = {}
+
+    for iteration in range(warmup + repeats):
+        for prompt in prompts:
+            if not warm_cache:
+                smart_line.sql_cache.clear()
+            started = time.perf_counter()
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    sql_query, info = smart_line.generate_sql(prompt, user)
+                generated = time.perf_counter()
+                if sql_query:
+                    smart_line.execute_sql(sql_query, params=info['params'])
+                    if warm_cache and info['path'] in smart_line.LLM_PATHS:
+                        smart_line.cache_sql(prompt, user, sql_query)
+            except Exception as e:
+                if iteration >= warmup:
+                    recorder.error(type(e).__name__)
+                continue
+            finished = time.perf_counter()
+
+            if iteration < warmup:
+                continue
+            paths[info['path']] = paths.get(info['path'], 0) + 1
+            for stage, seconds in info['timings'].items():
+                recorder.add(f"generate.{stage}", seconds)
+            recorder.add('generate', generated - started)
+            recorder.add('execute', finished - generated)
+            recorder.add('total', finished - started)
+
+    return recorder.result(paths=paths)
+
+
+def batch_throughput(user: User, prompts: List[str], count: int, llm_concurrency: int,
+                     db_concurrency: int) -> Dict[str, Any]:
+    '''
+        count промптов через batch.run_batch с выгрузкой в CSV: пропускная способность и задержки
+        этапов из статусов (llm - генерация SQL вместе с ожиданием слота, db - выполнение)
+    '''
+    smart_line.sql_cache.clear()
+    recorder = StageRecorder()
+
+    with tempfile.TemporaryDirectory(prefix='bench_batch_') as output_dir:
+        items = [{'id': str(i), 'prompt': prompts[i % len(prompts)]} for i in range(count)]
+        status_path = os.path.join(output_dir, 'status.jsonl')
+
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = asyncio.run(batch.run_batch(items, user, output_dir, status_path,
+                                                  llm_concurrency, db_concurrency))
+        elapsed = time.perf_counter() - started
+
+        with open(status_path, 'r', encoding='utf-8') as f:
+            statuses = [json.loads(line) for line in f]
+
+    for status in statuses:
+        if status['status'] == 'error':
+            recorder.error(status['error'].split(':')[0])
+            continue
+        for stage, key in (('llm', 'llm_seconds'), ('db', 'db_seconds'), ('total', 'seconds')):
+            if key in status:
+                recorder.add(stage, status[key])
+
+    return recorder.result(prompts=count, seconds=round(elapsed, 3),
+                           throughput_per_s=round(count / elapsed, 3), statuses=summary,
+                           llm_concurrency=llm_concurrency, db_concurrency=db_concurrency)
+
+
+def csv_export(rows: int, repeats: int) -> Dict[str, Any]:
+    '''
+        выгрузка большого результата в CSV через execute_sql (с проверкой плана), как при ответе в файл
+    '''
+    recorder = StageRecorder()
+    exported = 0
+    size = 0
+
+    with tempfile.TemporaryDirectory(prefix='bench_csv_') as output_dir:
+        path = os.path.join(output_dir, 'export.csv')
+        for _ in range(repeats):
+            started = time.perf_counter()
+            try:
+                exported, _, _ = smart_line.execute_sql(EXPORT_SQL, path, (rows,))
+            except Exception as e:
+                recorder.error(type(e).__name__)
+                continue
+            recorder.add('export', time.perf_counter() - started)
+            size = os.path.getsize(path)
+
+    result = recorder.result(rows=exported, bytes=size)
+    export = result['stages'].get('export')
+    if export and export['p50_ms']:
+        result['rows_per_s'] = round(exported / (export['p50_ms'] / 1000))
+        result['mb_per_s'] = round(size / 1024 / 1024 / (export['p50_ms'] / 1000), 2)
+    return result
+
+
+def auth_storm(db_manager: DatabaseManager, db_config: Dict[str, Any], logins: int, threads: int,
+               seed: int) -> Dict[str, Any]:
+    '''
+        много одновременных входов случайных пользователей: каждый вход - новый UserAuthenticator,
+        как в main.py; заодно видно, хватает ли пула подключений
+    '''
+    users = db_manager.execute_query(
+        "SELECT first_name, last_name, email, username FROM users WHERE is_active ORDER BY id LIMIT 10000"
+    )
+    generator = random.Random(seed)
+    attempts = [generator.choice(users) for _ in range(logins)]
+    recorder = StageRecorder()
+
+    def login(row: Dict[str, Any]) -> None:
+        started = time.perf_counter()
+        user = UserAuthenticator(db_config).authenticate(row['first_name'], row['last_name'],
+                                                         row['email'], row['username'])
+        if user is None:
+            recorder.error('not_found')
+            return
+        recorder.add('authenticate', time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(login, attempts))
+    elapsed = time.perf_counter() - started
+
+    return recorder.result(logins=logins, threads=threads, seconds=round(elapsed, 3),
+                           throughput_per_s=round(logins / elapsed, 3), pool=db_manager.pool_stats())
+
+
+def run_metadata(db_manager: DatabaseManager, db_config: Dict[str, Any], args) -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    rows = db_manager.execute_query(
+        "SELECT (SELECT count(*) FROM companies) AS companies, (SELECT count(*) FROM departments) AS departments, "
+        "(SELECT count(*) FROM users) AS users, (SELECT count(*) FROM tasks) AS tasks, "
+        "(SELECT count(*) FROM task_dependencies) AS dependencies, (SELECT count(*) FROM task_history) AS history"
+    )[0]
+    return {
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'database': db_config['database'],
+        'rows': dict(rows),
+        'args': vars(args),
+    }
+
+
+def read_prompt_file(path: Optional[str]) -> List[str]:
+    if not path:
+        return PROMPTS
+    return [item['prompt'] for item in batch.read_prompts(path)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Сквозные бенчмарки smart_line на стенде из benchmarks/datagen.py с заглушкой LLM; "
+                    "результаты сравниваются через python -m benchmarks.compare"
+    )
+    parser.add_argument('--database', help="База стенда (по умолчанию BENCH_DB_NAME или task_db_bench)")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS),
+                        help="Какие сценарии запускать")
+    parser.add_argument('--prompts', help="JSONL с промптами в формате batch.py вместо встроенных")
+    parser.add_argument('--user-id', type=int, default=1, help="От имени какого пользователя задаются вопросы")
+    parser.add_argument('--repeats', type=int, default=5, help="Повторов набора промптов в single_prompt")
+    parser.add_argument('--warmup', type=int, default=1, help="Прогревочных повторов (не входят в результат)")
+    parser.add_argument('--warm-cache', action='store_true', help="Не очищать кэш SQL между промптами")
+    parser.add_argument('--batch-size', type=int, default=64, help="Промптов в сценарии batch")
+    parser.add_argument('--llm-concurrency', type=int, default=4, help="Одновременных запросов к LLM в batch")
+    parser.add_argument('--db-concurrency', type=int, default=4, help="Одновременных запросов к БД в batch")
+    parser.add_argument('--export-rows', type=int, default=1_000_000, help="Строк в сценарии csv_export")
+    parser.add_argument('--export-repeats', type=int, default=3, help="Повторов выгрузки")
+    parser.add_argument('--logins', type=int, default=2000, help="Входов в сценарии auth_storm")
+    parser.add_argument('--login-threads', type=int, default=32, help="Одновременных входов")
+    parser.add_argument('--llm-url', help="Настоящий chat-completions API вместо заглушки")
+    parser.add_argument('--llm-latency', type=float, default=0.3, help="Задержка заглушки LLM, сек")
+    parser.add_argument('--llm-jitter', type=float, default=0.05, help="Разброс задержки заглушки, сек")
+    parser.add_argument('--llm-error-rate', type=float, default=0.0, help="Доля ответов 429 от заглушки")
+    parser.add_argument('--llm-token-delay', type=float, default=0.01,
+                        help="Пауза между токенами потокового ответа заглушки, сек")
+    parser.add_argument('--llm-tail-rate', type=float, default=0.0, help="Доля медленных ответов заглушки")
+    parser.add_argument('--llm-tail-latency', type=float, default=10.0, help="Задержка медленных ответов, сек")
+    parser.add_argument('--llm-fallback-latency', type=float,
+                        help="Поднять вторую заглушку с такой задержкой и хеджировать запросы на нее")
+    parser.add_argument('--seed', type=int, default=1, help="Seed случайных данных сценариев")
+    parser.add_argument('--output', default='bench_results.json', help="Куда сохранить результаты (JSON)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_args()
+
+    # Все объекты smart_line (пулы, кэши, граф) держат ссылку на этот словарь и подключаются лениво,
+    # поэтому подмена до первого запроса переводит приложение на базу стенда
+    config = bench_db_config(args.database)
+    smart_line.db_config.update(config)
+    db_manager = DatabaseManager(smart_line.db_config, use_sqlalchemy=False, pooled=True)
+
+    stub = None
+    if args.llm_url:
+        llm_url, llm_key = args.llm_url, None
+    else:
+        stub = StubLLMServer(latency=args.llm_latency, jitter=args.llm_jitter, error_rate=args.llm_error_rate,
+                             seed=args.seed, token_delay=args.llm_token_delay, tail_rate=args.llm_tail_rate,
+                             tail_latency=args.llm_tail_latency)
+        llm_url, llm_key = stub.start(), 'bench'
+
+    # Вторая модель на своей заглушке: основная идет через общий клиент, запасная - по своему URL
+    fallback_stub = None
+    models = [(os.environ.get('LLM_MODEL', DEFAULT_MODEL), None)]
+    if args.llm_fallback_latency is not None:
+        fallback_stub = StubLLMServer(latency=args.llm_fallback_latency, jitter=args.llm_jitter,
+                                      seed=args.seed + 1, token_delay=args.llm_token_delay)
+        models.append(('fallback', fallback_stub.start()))
+    # Пока замеров мало, хеджирование срабатывает после двойной обычной задержки заглушки
+    router = configure_model_router(models, hedge_delay=args.llm_latency * 2)
+
+    prompts = read_prompt_file(args.prompts)
+    user = bench_user(db_manager, args.user_id)
+    results = {'meta': run_metadata(db_manager, smart_line.db_config, args), 'scenarios': {}}
+
+    try:
+        for scenario in args.scenarios:
+            print(f"Сценарий {scenario}...")
+            started = time.monotonic()
+            if scenario == 'single_prompt':
+                configure_llm_client(api_url=llm_url, api_key=llm_key)
+                result = single_prompt(user, prompts, args.repeats, args.warmup, args.warm_cache)
+            elif scenario == 'batch':
+                configure_llm_client(api_url=llm_url, api_key=llm_key, max_concurrency=args.llm_concurrency)
+                result = batch_throughput(user, prompts, args.batch_size, args.llm_concurrency, args.db_concurrency)
+            elif scenario == 'csv_export':
+                result = csv_export(args.export_rows, args.export_repeats)
+            else:
+                result = auth_storm(db_manager, smart_line.db_config, args.logins, args.login_threads, args.seed)
+            results['scenarios'][scenario] = result
+
+            print(f"  готово за {time.monotonic() - started:.1f} с")
+            for stage, summary in result['stages'].items():
+                if summary['count']:
+                    print(f"  {stage:<20} p50 {summary['p50_ms']:>10.2f} мс  p95 {summary['p95_ms']:>10.2f} мс  "
+                          f"p99 {summary['p99_ms']:>10.2f} мс  (n={summary['count']})")
+            if result['errors']:
+                print(f"  ошибки: {result['errors']}")
+    finally:
+        if stub is not None:
+            results['meta']['stub_llm'] = {'latency': args.llm_latency, 'jitter': args.llm_jitter,
+                                           'error_rate': args.llm_error_rate, 'token_delay': args.llm_token_delay,
+                                           'tail_rate': args.llm_tail_rate, 'tail_latency': args.llm_tail_latency,
+                                           'requests': stub.requests, 'cancelled_streams': stub.cancelled}
+            stub.stop()
+        if fallback_stub is not None:
+            results['meta']['fallback_llm'] = {'latency': args.llm_fallback_latency, 'requests': fallback_stub.requests,
+                                               'cancelled_streams': fallback_stub.cancelled}
+            fallback_stub.stop()
+        results['meta']['models'] = router.stats()
+        close_all_pools()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2, default=str)
+    print(f"Результаты: {args.output}")
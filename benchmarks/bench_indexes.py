@@ -0,0 +1,149 @@
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import time
+from typing import Dict, Any, List
+
+from dotenv import load_dotenv
+
+from benchmarks.datagen import bench_db_config, autocommit_connection
+from database import DatabaseManager
+
+
+MIGRATION_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'migrations', '002_fk_indexes.sql')
+
+# Типичные запросы, которые получаются из шаблонов и от модели: (название, SQL, параметры)
+QUERIES = [
+    ('my_tasks_in_progress',
+     "SELECT t.id, t.title, t.due_date FROM tasks t "
+     "WHERE t.assigned_user_id = %(user)s AND t.status = 'in_progress' ORDER BY t.due_date",
+     ('user',)),
+    ('my_overdue_tasks',
+     "SELECT t.id, t.title, t.due_date FROM tasks t WHERE t.assigned_user_id = %(user)s "
+     "AND t.due_date < CURRENT_DATE AND t.status NOT IN ('completed', 'cancelled')",
+     ('user',)),
+    ('department_tasks_by_status',
+     "SELECT t.status, count(*) FROM tasks t WHERE t.assigned_department_id = %(department)s GROUP BY t.status",
+     ('department',)),
+    ('created_by_me_this_month',
+     "SELECT t.id, t.title FROM tasks t WHERE t.created_by_user_id = %(user)s "
+     "AND t.created_at >= date_trunc('month', CURRENT_DATE)",
+     ('user',)),
+    ('task_history',
+     "SELECT h.field_name, h.old_value, h.new_value, h.changed_at FROM task_history h "
+     "WHERE h.task_id = %(task)s ORDER BY h.changed_at",
+     ('task',)),
+    ('blocked_by_task',
+     "SELECT t.id, t.title, t.status FROM task_dependencies d JOIN tasks t ON t.id = d.task_id_1 "
+     "WHERE d.task_id_2 = %(task)s",
+     ('task',)),
+    ('colleagues',
+     "SELECT u.id, u.username FROM users u "
+     "WHERE u.department_id = (SELECT department_id FROM users WHERE id = %(user)s)",
+     ('user',)),
+    ('subdepartments',
+     "SELECT d.id, d.name FROM departments d WHERE d.parent_department_id = %(department)s",
+     ('department',)),
+    ('department_workload',
+     "SELECT u.username, count(*) FROM users u JOIN tasks t ON t.assigned_user_id = u.id "
+     "WHERE u.department_id = %(department)s AND t.status = 'in_progress' GROUP BY u.username",
+     ('department',)),
+]
+
+
+def migration_statements(path: str = MIGRATION_PATH) -> List[str]:
+    '''
+        команды миграции без комментариев
+    '''
+    with open(path, 'r', encoding='utf-8') as f:
+        text = '\n'.join(line for line in f.read().splitlines() if not line.strip().startswith('--'))
+    return [statement.strip() for statement in text.split(';') if statement.strip()]
+
+
+def migration_indexes(path: str = MIGRATION_PATH) -> List[str]:
+    return [match.group(1) for statement in migration_statements(path)
+            if (match := re.search(r'CREATE INDEX CONCURRENTLY IF NOT EXISTS (\w+)', statement))]
+
+
+def run_ddl(db_config: Dict[str, Any], statements: List[str]) -> None:
+    connection = autocommit_connection(db_config)
+    try:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+    finally:
+        connection.close()
+
+
+def measure(db_manager: DatabaseManager, repeats: int, seed: int) -> Dict[str, Dict[str, float]]:
+    '''
+        время каждого запроса на одних и тех же случайных параметрах (seed): медиана и p95 в мс
+    '''
+    bounds = db_manager.execute_query(
+        "SELECT (SELECT max(id) FROM users) AS \"user\", (SELECT max(id) FROM departments) AS department, "
+        "(SELECT max(id) FROM tasks) AS task"
+    )[0]
+
+    results = {}
+    for name, sql, keys in QUERIES:
+        generator = random.Random(f"{seed}:{name}")
+        timings = []
+        for _ in range(repeats):
+            params = {key: generator.randint(1, bounds[key]) for key in keys}
+            started = time.perf_counter()
+            db_manager.execute_query(sql, params)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        results[name] = {
+            'p50_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        }
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Время типичных запросов до и после migrations/002_fk_indexes.sql")
+    parser.add_argument('--database', help="База стенда (заполняется benchmarks/datagen.py)")
+    parser.add_argument('--repeats', type=int, default=50, help="Повторов каждого запроса")
+    parser.add_argument('--seed', type=int, default=1, help="Seed случайных параметров")
+    parser.add_argument('--drop-after', action='store_true', help="Удалить индексы миграции после замера")
+    parser.add_argument('--json', help="Сохранить результаты в JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_args()
+
+    config = bench_db_config(args.database)
+    db_manager = DatabaseManager(config, use_sqlalchemy=False, pooled=True)
+    drop = [f"DROP INDEX CONCURRENTLY IF EXISTS {name}" for name in migration_indexes()]
+
+    print("Без индексов миграции...")
+    run_ddl(config, drop + ['ANALYZE'])
+    before = measure(db_manager, args.repeats, args.seed)
+
+    print("Применение migrations/002_fk_indexes.sql...")
+    started = time.monotonic()
+    run_ddl(config, migration_statements())
+    build_seconds = time.monotonic() - started
+    after = measure(db_manager, args.repeats, args.seed)
+
+    if args.drop_after:
+        run_ddl(config, drop)
+
+    print(f"\nИндексы построены за {build_seconds:.1f} с\n")
+    print(f"{'запрос':<28} {'до, p50 мс':>12} {'после, p50 мс':>14} {'ускорение':>10}")
+    for name, _, _ in QUERIES:
+        speedup = before[name]['p50_ms'] / max(after[name]['p50_ms'], 0.001)
+        print(f"{name:<28} {before[name]['p50_ms']:>12.2f} {after[name]['p50_ms']:>14.2f} {speedup:>9.1f}x")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'database': config['database'], 'repeats': args.repeats, 'seed': args.seed,
+                       'index_build_seconds': round(build_seconds, 2), 'before': before, 'after': after},
+                      f, ensure_ascii=False, indent=2)
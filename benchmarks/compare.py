@@ -0,0 +1,86 @@
+import argparse
+import json
+import sys
+from typing import Dict, Any, List, Tuple
+
+from dotenv import load_dotenv
+
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+# Больше - лучше: для них ухудшение - это падение
+THROUGHPUT_KEYS = ('throughput_per_s', 'rows_per_s', 'mb_per_s')
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], threshold: float,
+            min_delta_ms: float) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    '''
+        сравнивает два прогона benchmarks/bench_e2e.py по общим сценариям и этапам;
+        возвращает все строки сравнения и те из них, что ухудшились больше чем на threshold
+        (для задержек еще и больше чем на min_delta_ms, чтобы не ловить шум на быстрых этапах)
+    '''
+    rows = []
+    for scenario, new_result in new['scenarios'].items():
+        base_result = base['scenarios'].get(scenario)
+        if base_result is None:
+            continue
+
+        for stage, new_stage in new_result['stages'].items():
+            base_stage = base_result['stages'].get(stage)
+            if not base_stage or not base_stage.get('count') or not new_stage.get('count'):
+                continue
+            for metric in METRICS:
+                before, after = base_stage[metric], new_stage[metric]
+                change = (after - before) / before if before else 0.0
+                rows.append({'scenario': scenario, 'stage': stage, 'metric': metric, 'base': before, 'new': after,
+                             'change': change,
+                             'regression': change > threshold and after - before > min_delta_ms})
+
+        for key in THROUGHPUT_KEYS:
+            if key in base_result and key in new_result:
+                before, after = base_result[key], new_result[key]
+                change = (after - before) / before if before else 0.0
+                rows.append({'scenario': scenario, 'stage': '-', 'metric': key, 'base': before, 'new': after,
+                             'change': change, 'regression': -change > threshold})
+
+    return rows, [row for row in rows if row['regression']]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Сравнение двух прогонов benchmarks/bench_e2e.py")
+    parser.add_argument('base', help="JSON базового прогона")
+    parser.add_argument('new', help="JSON нового прогона")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Допустимое ухудшение, доля (0.10 = 10%%)")
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help="Ухудшение задержки меньше этого - шум")
+    parser.add_argument('--fail-on-regression', action='store_true', help="Код возврата 1 при ухудшениях")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_args()
+
+    base, new = load_results(args.base), load_results(args.new)
+    for run, label in ((base, 'база'), (new, 'новый')):
+        meta = run.get('meta', {})
+        print(f"{label}: {meta.get('started_at')} commit {meta.get('commit')} на {meta.get('database')} {meta.get('rows')}")
+    if base.get('meta', {}).get('rows') != new.get('meta', {}).get('rows'):
+        print("Внимание: прогоны сделаны на разных данных")
+    if base.get('meta', {}).get('stub_llm', {}).get('latency') != new.get('meta', {}).get('stub_llm', {}).get('latency'):
+        print("Внимание: у прогонов разная задержка LLM")
+
+    rows, regressions = compare(base, new, args.threshold, args.min_delta_ms)
+    print(f"\n{'сценарий / этап':<36} {'метрика':<17} {'база':>12} {'новый':>12} {'изменение':>10}")
+    for row in rows:
+        mark = '  <- хуже' if row['regression'] else ''
+        print(f"{row['scenario'] + ' / ' + row['stage']:<36} {row['metric']:<17} {row['base']:>12.2f} "
+              f"{row['new']:>12.2f} {row['change']:>+9.1%}{mark}")
+
+    print(f"\nУхудшений больше {args.threshold:.0%}: {len(regressions)}")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
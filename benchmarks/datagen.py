@@ -0,0 +1,213 @@
+import argparse
+import os
+import time
+from typing import Dict, Any
+
+import psycopg2
+from dotenv import load_dotenv
+
+from database import DatabaseManager
+
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+# Размеры стенда: число строк в каждой таблице
+SCALES = {
+    'tiny': {'companies': 2, 'departments': 50, 'users': 500, 'tasks': 20_000,
+             'dependencies': 10_000, 'history': 40_000},
+    'small': {'companies': 5, 'departments': 500, 'users': 5_000, 'tasks': 200_000,
+              'dependencies': 100_000, 'history': 400_000},
+    'medium': {'companies': 20, 'departments': 2_000, 'users': 20_000, 'tasks': 1_000_000,
+               'dependencies': 500_000, 'history': 2_000_000},
+    'large': {'companies': 50, 'departments': 10_000, 'users': 100_000, 'tasks': 5_000_000,
+              'dependencies': 2_500_000, 'history': 10_000_000},
+}
+
+# Вставка большими кусками: одна транзакция на кусок, без длинных блокировок
+CHUNK_SIZE = 500_000
+
+STATUS_CASE = '''CASE WHEN r.s < 0.20 THEN 'new' WHEN r.s < 0.45 THEN 'in_progress'
+                      WHEN r.s < 0.85 THEN 'completed' WHEN r.s < 0.92 THEN 'cancelled' ELSE 'on_hold' END'''
+
+PRIORITY_CASE = '''CASE WHEN r.p < 0.10 THEN 'urgent' WHEN r.p < 0.35 THEN 'high'
+                        WHEN r.p < 0.80 THEN 'medium' ELSE 'low' END'''
+
+# Дерево отделов внутри компании: k-й отдел компании подчинен отделу (k - 1) / branching,
+# поэтому глубина растет как log(branching) от числа отделов
+DEPARTMENTS_SQL = '''
+    INSERT INTO departments (company_id, parent_department_id, name, description)
+    SELECT (g - 1) %% %(companies)s + 1,
+           CASE WHEN g <= %(companies)s THEN NULL
+                ELSE ((g - 1) / %(companies)s - 1) / %(branching)s * %(companies)s + (g - 1) %% %(companies)s + 1
+           END,
+           'Отдел ' || g, 'Сгенерированный отдел'
+    FROM generate_series(%(start)s, %(stop)s) AS g
+'''
+
+USERS_SQL = '''
+    INSERT INTO users (department_id, username, email, first_name, last_name, position, is_manager)
+    SELECT 1 + floor(random() * %(departments)s)::int, 'user' || g, 'user' || g || '@example.com',
+           'Имя' || g, 'Фамилия' || g, (ARRAY['developer', 'analyst', 'tester', 'designer', 'manager'])[1 + g %% 5],
+           g %% 10 = 0
+    FROM generate_series(%(start)s, %(stop)s) AS g
+'''
+
+TASKS_SQL = f'''
+    INSERT INTO tasks (title, description, status, priority, assigned_user_id, assigned_department_id,
+                       created_by_user_id, due_date, start_date, completed_date, created_at, updated_at)
+    SELECT 'Задача ' || r.g, 'Описание задачи ' || r.g, {STATUS_CASE}, {PRIORITY_CASE},
+           u.id, u.department_id, r.author,
+           (r.created_at + r.duration * interval '1 day')::date,
+           (r.created_at + interval '1 day')::date,
+           CASE WHEN r.s >= 0.45 AND r.s < 0.85
+                THEN (r.created_at + r.duration * random() * interval '1 day')::date END,
+           r.created_at, LEAST(now(), r.created_at + random() * interval '30 days')
+    FROM (
+        SELECT g, random() AS s, random() AS p, 1 + floor(random() * %(users)s)::int AS assignee,
+               1 + floor(random() * %(users)s)::int AS author, 1 + floor(random() * 60)::int AS duration,
+               now() - random() * interval '730 days' AS created_at
+        FROM generate_series(%(start)s, %(stop)s) AS g
+    ) AS r
+    JOIN users u ON u.id = r.assignee
+'''
+
+# Зависимость всегда ведет от более новой задачи к одной из ~100 предыдущих: граф без циклов
+DEPENDENCIES_SQL = '''
+    INSERT INTO task_dependencies (task_id_1, task_id_2, created_by_user_id)
+    SELECT r.task_id, GREATEST(1, r.task_id - 1 - floor(random() * 100)::int), 1 + floor(random() * %(users)s)::int
+    FROM (
+        SELECT 2 + floor(random() * (%(tasks)s - 1))::int AS task_id
+        FROM generate_series(%(start)s, %(stop)s)
+    ) AS r
+    ON CONFLICT (task_id_1, task_id_2) DO NOTHING
+'''
+
+HISTORY_SQL = '''
+    INSERT INTO task_history (task_id, changed_by_user_id, field_name, old_value, new_value, changed_at)
+    SELECT 1 + floor(random() * %(tasks)s)::int, 1 + floor(random() * %(users)s)::int,
+           (ARRAY['status', 'status', 'status', 'priority', 'assigned_user_id'])[1 + floor(random() * 5)::int],
+           (ARRAY['new', 'in_progress', 'on_hold'])[1 + floor(random() * 3)::int],
+           (ARRAY['in_progress', 'completed', 'cancelled'])[1 + floor(random() * 3)::int],
+           now() - random() * interval '730 days'
+    FROM generate_series(%(start)s, %(stop)s)
+'''
+
+TABLES = ('task_history', 'task_dependencies', 'tasks', 'users', 'departments', 'companies')
+
+
+def bench_db_config(database: str = None) -> Dict[str, Any]:
+    '''
+        параметры подключения к базе стенда; по умолчанию отдельная база task_db_bench,
+        чтобы генерация не трогала рабочие данные
+    '''
+    return {
+        'host': os.environ.get('BENCH_DB_HOST', 'localhost'),
+        'port': int(os.environ.get('BENCH_DB_PORT', 5434)),
+        'database': database or os.environ.get('BENCH_DB_NAME', 'task_db_bench'),
+        'user': os.environ.get('BENCH_DB_USER', 'postgres'),
+        'password': os.environ.get('BENCH_DB_PASSWORD', 'postgres'),
+    }
+
+
+def autocommit_connection(db_config: Dict[str, Any], database: str = None):
+    '''
+        подключение вне транзакции: нужно для CREATE DATABASE и CREATE INDEX CONCURRENTLY
+    '''
+    connection = psycopg2.connect(
+        host=db_config['host'],
+        port=db_config['port'],
+        database=database or db_config['database'],
+        user=db_config['user'],
+        password=db_config['password']
+    )
+    connection.autocommit = True
+    return connection
+
+
+def ensure_database(db_config: Dict[str, Any]) -> None:
+    '''
+        создает базу стенда (в UTF8) и таблицы, если их еще нет
+    '''
+    connection = autocommit_connection(db_config, database='postgres')
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (db_config['database'],))
+            if cursor.fetchone() is None:
+                cursor.execute(f"CREATE DATABASE {db_config['database']} ENCODING 'UTF8' TEMPLATE template0")
+    finally:
+        connection.close()
+
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        schema = f.read()
+    connection = autocommit_connection(db_config)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(schema)
+    finally:
+        connection.close()
+
+
+def _insert_chunks(db_manager: DatabaseManager, table: str, sql: str, total: int, params: Dict[str, Any]) -> None:
+    started = time.monotonic()
+    for start in range(1, total + 1, CHUNK_SIZE):
+        stop = min(start + CHUNK_SIZE - 1, total)
+        db_manager.execute_query(sql, {**params, 'start': start, 'stop': stop})
+        print(f"  {table}: {stop}/{total}", end='\r')
+    print(f"  {table}: {total} строк за {time.monotonic() - started:.1f} с")
+
+
+def generate(db_manager: DatabaseManager, sizes: Dict[str, int], branching: int = 4, reset: bool = False) -> None:
+    '''
+        заполняет базу стенда: компании, дерево отделов, пользователи, задачи, зависимости и история;
+        без reset отказывается писать в непустую базу
+    '''
+    existing = db_manager.execute_query("SELECT count(*) AS n FROM (SELECT 1 FROM tasks LIMIT 1) AS t")[0]['n']
+    if existing and not reset:
+        raise RuntimeError("Benchmark database is not empty, use reset=True to regenerate it")
+    if reset:
+        db_manager.execute_query(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE")
+
+    params = {**sizes, 'branching': branching}
+
+    db_manager.execute_query(
+        "INSERT INTO companies (name, description) "
+        "SELECT 'Компания ' || g, 'Сгенерированная компания' FROM generate_series(1, %(companies)s) AS g",
+        params
+    )
+    _insert_chunks(db_manager, 'departments', DEPARTMENTS_SQL, sizes['departments'], params)
+    _insert_chunks(db_manager, 'users', USERS_SQL, sizes['users'], params)
+    _insert_chunks(db_manager, 'tasks', TASKS_SQL, sizes['tasks'], params)
+    _insert_chunks(db_manager, 'task_dependencies', DEPENDENCIES_SQL, sizes['dependencies'], params)
+    _insert_chunks(db_manager, 'task_history', HISTORY_SQL, sizes['history'], params)
+
+    for table in TABLES:
+        db_manager.execute_query(f"ANALYZE {table}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Генерация данных для стенда бенчмарков")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small', help="Размер стенда")
+    parser.add_argument('--database', help="База стенда (по умолчанию BENCH_DB_NAME или task_db_bench)")
+    parser.add_argument('--branching', type=int, default=4, help="Число дочерних отделов у отдела")
+    parser.add_argument('--reset', action='store_true', help="Очистить таблицы перед генерацией")
+    for table in SCALES['small']:
+        parser.add_argument(f'--{table}', type=int, help=f"Переопределить число строк: {table}")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_args()
+
+    sizes = dict(SCALES[args.scale])
+    for table in sizes:
+        if getattr(args, table) is not None:
+            sizes[table] = getattr(args, table)
+
+    config = bench_db_config(args.database)
+    ensure_database(config)
+
+    started = time.monotonic()
+    print(f"Генерация стенда {args.scale} в {config['database']}: {sizes}")
+    generate(DatabaseManager(config, use_sqlalchemy=False), sizes, branching=args.branching, reset=args.reset)
+    print(f"Готово за {time.monotonic() - started:.1f} с")
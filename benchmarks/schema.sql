@@ -0,0 +1,68 @@
+-- Схема task_db для стенда бенчмарков (по db_structure/task_db_structure.txt):
+-- только первичные ключи, UNIQUE и внешние ключи, как в исходной базе.
+CREATE TABLE IF NOT EXISTS companies (
+    id          serial PRIMARY KEY,
+    name        varchar(200) NOT NULL,
+    description text,
+    created_at  timestamp DEFAULT now(),
+    updated_at  timestamp DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS departments (
+    id                   serial PRIMARY KEY,
+    company_id           integer REFERENCES companies (id),
+    parent_department_id integer REFERENCES departments (id),
+    name                 varchar(200),
+    description          text,
+    created_at           timestamp DEFAULT now(),
+    updated_at           timestamp DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    id            serial PRIMARY KEY,
+    department_id integer REFERENCES departments (id),
+    username      varchar(100) UNIQUE,
+    email         varchar(200) UNIQUE,
+    first_name    varchar(100),
+    last_name     varchar(100),
+    position      varchar(100),
+    is_manager    boolean DEFAULT false,
+    is_active     boolean DEFAULT true,
+    created_at    timestamp DEFAULT now(),
+    updated_at    timestamp DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS tasks (
+    id                     serial PRIMARY KEY,
+    title                  varchar(300),
+    description            text,
+    status                 varchar(30) DEFAULT 'new',
+    priority               varchar(20) DEFAULT 'medium',
+    assigned_user_id       integer REFERENCES users (id),
+    assigned_department_id integer REFERENCES departments (id),
+    created_by_user_id     integer REFERENCES users (id),
+    due_date               date,
+    start_date             date,
+    completed_date         date,
+    created_at             timestamp DEFAULT now(),
+    updated_at             timestamp DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS task_dependencies (
+    id                 serial PRIMARY KEY,
+    task_id_1          integer REFERENCES tasks (id),
+    task_id_2          integer REFERENCES tasks (id),
+    created_at         timestamp DEFAULT now(),
+    created_by_user_id integer REFERENCES users (id),
+    UNIQUE (task_id_1, task_id_2)
+);
+
+CREATE TABLE IF NOT EXISTS task_history (
+    id                 serial PRIMARY KEY,
+    task_id            integer REFERENCES tasks (id),
+    changed_by_user_id integer REFERENCES users (id),
+    field_name         varchar(100),
+    old_value          text,
+    new_value          text,
+    changed_at         timestamp DEFAULT now()
+);
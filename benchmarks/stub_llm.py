@@ -0,0 +1,254 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, List, Tuple
+
+from dotenv import load_dotenv
+
+
+# Ответы по умолчанию: (регулярка по тексту вопроса, SQL); первая подходящая выигрывает
+CANNED_SQL = [
+    (r'отдел|department',
+     "SELECT d.name, count(t.id) AS tasks FROM departments d "
+     "LEFT JOIN tasks t ON t.assigned_department_id = d.id GROUP BY d.name ORDER BY tasks DESC LIMIT 50"),
+    (r'сотрудник|пользовател|user|employee',
+     "SELECT u.username, count(t.id) AS tasks FROM users u "
+     "JOIN tasks t ON t.assigned_user_id = u.id WHERE t.status = 'in_progress' "
+     "GROUP BY u.username ORDER BY tasks DESC LIMIT 50"),
+    (r'истори|изменени|history',
+     "SELECT h.task_id, h.field_name, h.old_value, h.new_value, h.changed_at FROM task_history h "
+     "WHERE h.changed_at >= CURRENT_DATE - INTERVAL '7 days' ORDER BY h.changed_at DESC LIMIT 100"),
+    (r'компани|company',
+     "SELECT c.name, count(d.id) AS departments FROM companies c "
+     "LEFT JOIN departments d ON d.company_id = c.id GROUP BY c.name"),
+]
+
+DEFAULT_SQL = "SELECT t.id, t.title, t.status, t.due_date FROM tasks t ORDER BY t.created_at DESC LIMIT 100"
+
+# Ответ на запрос плана (create_sql_plan просит подзапросы "без SQL")
+CANNED_PLAN = '''Подзапрос 1:
+    Получить задачи из таблицы tasks
+    Применить фильтры из вопроса
+Порядок выполнения:
+    Выполнить Подзапрос 1'''
+
+# Пояснение после SQL, как у настоящих моделей: при потоковом ответе клиент его не дочитывает
+SQL_EXPLANATION = "Запрос выбирает нужные строки и сортирует их; при необходимости добавьте фильтры."
+
+# Примерно столько символов в одном токене потокового ответа
+CHARS_PER_TOKEN = 4
+
+PROMPT_LINE = re.compile(r'Найти:\s*(.+)')
+
+
+class StubLLMServer:
+    """
+    Локальная замена chat-completions API openrouter для бенчмарков
+
+    Отвечает заготовленным SQL (по регуляркам на строку "Найти: ..." из промпта)
+    с настраиваемой задержкой, разбросом и долей ответов 429, чтобы замеры
+    smart_line не зависели от сети и лимитов настоящего API. На запросы со
+    stream: true отвечает потоком SSE по токену раз в token_delay секунд.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.5, jitter: float = 0.1,
+                 error_rate: float = 0.0, canned: Optional[List[Tuple[str, str]]] = None, seed: int = 1,
+                 token_delay: float = 0.0, tail_rate: float = 0.0, tail_latency: float = 10.0,
+                 fail_first: int = 0, retry_after: Optional[str] = '0.1'):
+        """
+        Args:
+            host: Адрес, на котором слушает сервер
+            port: Порт (0 - любой свободный)
+            latency: Средняя задержка ответа, сек
+            jitter: Разброс задержки (равномерный, +-), сек
+            error_rate: Доля запросов, на которые отвечаем 429
+            canned: Свои пары (регулярка, SQL) вместо CANNED_SQL
+            seed: Seed генератора задержек и ошибок
+            token_delay: Пауза между токенами потокового ответа, сек
+            tail_rate: Доля запросов с задержкой tail_latency вместо обычной (хвост бесплатного тарифа)
+            tail_latency: Задержка медленных запросов, сек
+            fail_first: Сколько первых запросов получают 429 независимо от error_rate
+            retry_after: Заголовок Retry-After ответов 429 (None - без заголовка)
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.token_delay = token_delay
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.fail_first = fail_first
+        self.retry_after = retry_after
+        self.canned = [(re.compile(pattern, re.IGNORECASE), sql) for pattern, sql in (canned or CANNED_SQL)]
+
+        self.requests = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.request_times: List[float] = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self) -> str:
+        """Запуск в фоновом потоке, возвращает URL для LLMClient"""
+        self._thread = threading.Thread(target=self.server.serve_forever, name='stub-llm', daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def answer(self, content: str) -> str:
+        """Текст ответа модели на промпт"""
+        if 'без SQL' in content:
+            return CANNED_PLAN
+
+        match = PROMPT_LINE.search(content)
+        question = match.group(1) if match else content
+        sql = next((sql for pattern, sql in self.canned if pattern.search(question)), DEFAULT_SQL)
+        return f"```sql\n{sql}\n```\n{SQL_EXPLANATION}"
+
+    def _next_reply(self) -> Tuple[float, bool]:
+        with self._lock:
+            self.requests += 1
+            self.request_times.append(time.monotonic())
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            if self._random.random() < self.tail_rate:
+                delay = self.tail_latency
+            failed = self._random.random() < self.error_rate or self.requests <= self.fail_first
+            if failed:
+                self.errors += 1
+            return delay, failed
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                with stub._lock:
+                    stub.in_flight += 1
+                    stub.peak_in_flight = max(stub.peak_in_flight, stub.in_flight)
+                try:
+                    self._reply(payload)
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+            def _reply(self, payload: dict):
+                delay, failed = stub._next_reply()
+                time.sleep(delay)
+
+                if failed:
+                    headers = {'Retry-After': stub.retry_after} if stub.retry_after is not None else None
+                    self._send(429, b'{"error": {"message": "rate limited", "code": 429}}', headers)
+                    return
+
+                content = ''.join(message.get('content', '') for message in payload.get('messages', []))
+                answer = stub.answer(content)
+                if payload.get('stream'):
+                    self._stream(answer)
+                    return
+                # Без потока ответ приходит целиком, когда сгенерирован последний токен
+                time.sleep(stub.token_delay * (len(answer) // CHARS_PER_TOKEN))
+                body = json.dumps({
+                    'model': payload.get('model'),
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answer},
+                                 'finish_reason': 'stop'}],
+                    'usage': {'prompt_tokens': len(content) // 4, 'completion_tokens': len(answer) // 4},
+                }, ensure_ascii=False).encode('utf-8')
+                self._send(200, body)
+
+            def _stream(self, answer: str):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                try:
+                    for i in range(0, len(answer), CHARS_PER_TOKEN):
+                        if i:
+                            time.sleep(stub.token_delay)
+                        chunk = {'choices': [{'index': 0, 'delta': {'content': answer[i:i + CHARS_PER_TOKEN]}}]}
+                        self._event(chunk)
+                    self._event({'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+                                 'usage': {'prompt_tokens': 0, 'completion_tokens': len(answer) // CHARS_PER_TOKEN}})
+                    self._chunk(b'data: [DONE]\n\n')
+                    self._chunk(b'')
+                except (BrokenPipeError, ConnectionResetError):
+                    # Клиент получил что хотел и закрыл соединение
+                    self.close_connection = True
+                    with stub._lock:
+                        stub.cancelled += 1
+
+            def _event(self, event: dict):
+                self._chunk(b'data: ' + json.dumps(event, ensure_ascii=False).encode('utf-8') + b'\n\n')
+
+            def _chunk(self, data: bytes):
+                self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+                self.wfile.flush()
+
+            def _send(self, status: int, body: bytes, headers: Optional[dict] = None):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def load_canned(path: str) -> List[Tuple[str, str]]:
+    '''
+        заготовленные ответы из JSON: [["регулярка", "SQL"], ...]
+    '''
+    with open(path, 'r', encoding='utf-8') as f:
+        return [(pattern, sql) for pattern, sql in json.load(f)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Заглушка chat-completions API для бенчмарков")
+    parser.add_argument('--host', default='127.0.0.1', help="Адрес сервера")
+    parser.add_argument('--port', type=int, default=8765, help="Порт сервера")
+    parser.add_argument('--latency', type=float, default=0.5, help="Средняя задержка ответа, сек")
+    parser.add_argument('--jitter', type=float, default=0.1, help="Разброс задержки, сек")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument('--token-delay', type=float, default=0.0, help="Пауза между токенами потока, сек")
+    parser.add_argument('--tail-rate', type=float, default=0.0, help="Доля медленных ответов")
+    parser.add_argument('--tail-latency', type=float, default=10.0, help="Задержка медленных ответов, сек")
+    parser.add_argument('--canned', help="JSON с парами [регулярка, SQL] вместо встроенных ответов")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_args()
+
+    stub = StubLLMServer(args.host, args.port, args.latency, args.jitter, args.error_rate,
+                         load_canned(args.canned) if args.canned else None, token_delay=args.token_delay,
+                         tail_rate=args.tail_rate, tail_latency=args.tail_latency)
+    print(f"Заглушка LLM: {stub.url} (LLM_API_URL), задержка {args.latency}±{args.jitter} с")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,97 @@
+import os
+import time
+from typing import Optional, Dict, Any
+
+import requests
+
+
+DEFAULT_SERVICE_URL = 'http://127.0.0.1:8080'
+
+# Статусы, на которые сервис отвечает при перегрузке: запрос стоит повторить
+BUSY_STATUSES = {429, 503}
+
+
+class ServiceError(Exception):
+    """Сервис вернул ошибку"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ServiceClient:
+    """
+    Тонкий клиент HTTP-сервиса service.py
+
+    Не импортирует ни драйверы БД, ни smart_line: вся работа на стороне
+    сервиса. При 429/503 повторяет запрос после Retry-After.
+    """
+
+    def __init__(self, base_url: Optional[str] = None, timeout: float = 300.0, max_retries: int = 5):
+        """
+        Args:
+            base_url: Адрес сервиса (по умолчанию SMART_LINE_URL или http://127.0.0.1:8080)
+            timeout: Таймаут ответа на один запрос, сек
+            max_retries: Сколько раз повторять запрос, пока сервис перегружен
+        """
+        self.base_url = (base_url or os.environ.get('SMART_LINE_URL', DEFAULT_SERVICE_URL)).rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.token = None
+        self.session = requests.Session()
+
+    def authenticate(self, first_name: str, last_name: str, email: str, username: str) -> Dict[str, Any]:
+        """Вход: сохраняет токен сессии, возвращает данные пользователя"""
+        result = self._post('/auth', {'first_name': first_name, 'last_name': last_name,
+                                       'email': email, 'username': username}).json()
+        self.token = result['token']
+        return result['user']
+
+    def ask(self, prompt: str) -> Dict[str, Any]:
+        """Первая страница ответа: {path, sql, row_count, rows, next}"""
+        return self._post('/ask', {'prompt': prompt, 'format': 'json'}).json()
+
+    def ask_csv(self, prompt: str, path: str) -> int:
+        """Ответ в CSV-файл; возвращает число записанных байт"""
+        return self.ask_file(prompt, path, 'csv')
+
+    def ask_file(self, prompt: str, path: str, output_format: str) -> int:
+        """Ответ в файл формата 'csv', 'parquet' или 'arrow'; возвращает число записанных байт"""
+        response = self._post('/ask', {'prompt': prompt, 'format': output_format}, stream=True)
+        if response.headers.get('Content-Type', '').startswith('application/json'):
+            # SQL не получился - сервис вернул пустой ответ, а не файл
+            return 0
+        written = 0
+        with open(path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                f.write(chunk)
+                written += len(chunk)
+        return written
+
+    def next_page(self, next_token: str) -> Dict[str, Any]:
+        return self._post('/next', {'next': next_token}).json()
+
+    def logout(self):
+        if self.token:
+            self._post('/logout', {})
+            self.token = None
+
+    def _post(self, path: str, payload: Dict[str, Any], stream: bool = False) -> requests.Response:
+        headers = {'Authorization': f"Bearer {self.token}"} if self.token else {}
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(self.base_url + path, json=payload, headers=headers,
+                                             timeout=self.timeout, stream=stream)
+            except requests.RequestException as e:
+                raise ServiceError(f"Service is unavailable: {e}")
+
+            if response.status_code in BUSY_STATUSES and attempt < self.max_retries:
+                time.sleep(float(response.headers.get('Retry-After', 1)))
+                continue
+            if response.status_code != 200:
+                try:
+                    message = response.json().get('error', response.text)
+                except ValueError:
+                    message = response.text
+                raise ServiceError(message, response.status_code)
+            return response
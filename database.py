@@ -1,24 +1,498 @@
 import psycopg2
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
-from sqlalchemy import create_engine
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy.pool import NullPool
-from contextlib import contextmanager
+from sqlalchemy.pool import NullPool, QueuePool
+from contextlib import contextmanager, closing
+import csv
 import logging
-from typing import Union, Optional, List, Dict, Any
+import re
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Union, Optional, List, Dict, Any, IO, Iterator
+
+from result_set import ResultSet, write_batches
+from tracing import span, annotate
+
+
+DEFAULT_POOL_CONFIG = {
+    'min_size': 1,           # сколько подключений держать открытыми постоянно
+    'max_size': 10,          # максимум одновременных подключений
+    'max_lifetime': 1800,    # через сколько секунд подключение пересоздается
+    'health_check': True,    # проверять подключение при выдаче из пула
+    'timeout': 30,           # сколько ждать свободное подключение
+    'readonly': False,       # транзакции только на чтение (пулы реплик и сгенерированного SQL)
+    'connect_timeout': None, # сколько ждать установления подключения, None - без ограничения
+}
+
+DEFAULT_REPLICA_CONFIG = {
+    'balance': 'least_connections',  # или 'round_robin'
+    'max_lag_seconds': 10.0,         # реплика с большим отставанием не получает запросы
+    'check_interval': 5.0,           # как часто проверять доступность и отставание реплики
+    'connect_timeout': 3,            # недоступная реплика не должна надолго задерживать запрос
+}
+
+# Сколько строк серверный курсор забирает с сервера за один раз
+DEFAULT_ITERSIZE = 2000
+
+# Пулы общие на весь процесс: ключ - параметры подключения и тип драйвера
+_pools: Dict[tuple, Any] = {}
+_pools_lock = threading.Lock()
+
+# Подготовленные запросы живут в сеансе Postgres: кэш у каждого подключения свой
+# и исчезает вместе с подключением (пересоздание пулом, закрытие)
+_prepared: 'weakref.WeakKeyDictionary[Any, PreparedStatements]' = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+_prepared_stats = {'hits': 0, 'prepared': 0, 'evicted': 0, 'failed': 0}
+
+# Формы запросов, которые Postgres не смог подготовить: для них сразу обычное выполнение
+MAX_UNPREPARABLE = 1000
+_unpreparable: 'OrderedDict[str, None]' = OrderedDict()
+
+PLACEHOLDER = re.compile(r'%%|%s')
+
+# Реплики тоже общие на процесс: ключ - параметры подключения всех реплик
+_replica_sets: Dict[tuple, 'ReplicaSet'] = {}
+
+# Строки, идентификаторы в кавычках и комментарии: их содержимое не влияет на то, пишет ли запрос
+SQL_NOISE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/|\$(\w*)\$.*?\$\1\$", re.S)
+READ_ONLY_START = re.compile(r'(select|with|explain|show|values|table)\b', re.I)
+# Слова, которые что-то меняют или блокируют строки: такой запрос нельзя отправить на реплику
+WRITE_WORDS = re.compile(
+    r'\b(insert|update|delete|merge|truncate|drop|alter|create|grant|revoke|comment|copy|vacuum|reindex|cluster|'
+    r'refresh|call|do|into|lock|nextval|setval|listen|notify|pg_advisory\w*)\b|\bfor\s+(key\s+)?share\b',
+    re.I
+)
+
+# Таблицы, которые читаются сразу после записи (и UNLOGGED, недоступные на репликах):
+# запросы к ним всегда идут на основную БД
+PRIMARY_ONLY_TABLES = re.compile(r'\btask_graph_orders\b', re.I)
+
+REPLICA_STATUS_QUERY = '''
+    SELECT pg_is_in_recovery() AS in_recovery,
+           CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+           END AS lag_seconds
+'''
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул psycopg2-подключений поверх ThreadedConnectionPool
+
+    В отличие от ThreadedConnectionPool не падает с PoolError при исчерпании,
+    а ждет освобождения подключения; проверяет подключение при выдаче и
+    пересоздает подключения старше max_lifetime.
+    """
+
+    def __init__(self, db_config: Dict[str, Any], pool_config: Dict[str, Any]):
+        self.pool_config = pool_config
+        self._pool = ThreadedConnectionPool(
+            pool_config['min_size'],
+            pool_config['max_size'],
+            host=db_config['host'],
+            port=db_config['port'],
+            database=db_config['database'],
+            user=db_config['user'],
+            password=db_config['password'],
+            connect_timeout=pool_config.get('connect_timeout'),
+            cursor_factory=RealDictCursor
+        )
+        self._slots = threading.BoundedSemaphore(pool_config['max_size'])
+        self._lock = threading.Lock()
+        self._created_at: Dict[int, float] = {}
+        self._stats = {
+            'checkouts': 0,
+            'in_use': 0,
+            'recycled': 0,
+            'health_check_failures': 0,
+            'wait_time_total': 0.0,
+        }
+
+    def getconn(self):
+        """Выдача подключения из пула"""
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.pool_config['timeout']):
+            raise PoolError("Timed out waiting for a pooled connection")
+
+        try:
+            connection = self._checkout_healthy()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            self._stats['wait_time_total'] += time.monotonic() - started
+        return connection
+
+    def putconn(self, connection):
+        """Возврат подключения в пул"""
+        try:
+            self._pool.putconn(connection, close=connection.closed)
+            if connection.closed:
+                self._forget(connection)
+        finally:
+            with self._lock:
+                self._stats['in_use'] -= 1
+            self._slots.release()
+
+    def _checkout_healthy(self):
+        max_lifetime = self.pool_config['max_lifetime']
+
+        # Одна лишняя попытка на каждое подключение пула: все могли устареть одновременно
+        for _ in range(self.pool_config['max_size'] + 1):
+            connection = self._pool.getconn()
+            created_at = self._created_at.setdefault(id(connection), time.monotonic())
+
+            if max_lifetime and time.monotonic() - created_at > max_lifetime:
+                with self._lock:
+                    self._stats['recycled'] += 1
+                self._discard(connection)
+                continue
+
+            if self.pool_config['health_check'] and not self._is_alive(connection):
+                with self._lock:
+                    self._stats['health_check_failures'] += 1
+                self._discard(connection)
+                continue
+
+            if self.pool_config.get('readonly') and not connection.readonly:
+                # psycopg2 сам начинает каждую транзакцию с BEGIN READ ONLY - без лишнего запроса
+                connection.readonly = True
+            return connection
+
+        raise psycopg2.OperationalError("Could not obtain a healthy pooled connection")
+
+    @staticmethod
+    def _is_alive(connection) -> bool:
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, connection):
+        self._forget(connection)
+        self._pool.putconn(connection, close=True)
+
+    def _forget(self, connection):
+        self._created_at.pop(id(connection), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['idle'] = len(self._pool._pool)
+        stats['open'] = len(self._pool._used) + stats['idle']
+        stats['min_size'] = self.pool_config['min_size']
+        stats['max_size'] = self.pool_config['max_size']
+        return stats
+
+    def close(self):
+        self._pool.closeall()
+        self._created_at.clear()
+
+
+def close_all_pools():
+    """Закрытие всех общих пулов процесса (при завершении работы)"""
+    with _pools_lock:
+        for pool in _pools.values():
+            if isinstance(pool, ConnectionPool):
+                pool.close()
+            else:
+                pool.dispose()
+        _pools.clear()
+        for replica_set in _replica_sets.values():
+            replica_set.close()
+        _replica_sets.clear()
+
+
+def is_read_only(query: str) -> bool:
+    '''
+        запрос только читает данные и может уйти на реплику: начинается с SELECT, WITH, EXPLAIN,
+        SHOW, VALUES или TABLE, и вне строк и комментариев нет слов, которые что-то меняют
+        или блокируют строки (SELECT ... FOR UPDATE, SELECT INTO, nextval)
+    '''
+    text = SQL_NOISE.sub(' ', query).strip().lstrip('(').strip()
+    return READ_ONLY_START.match(text) is not None and WRITE_WORDS.search(text) is None
+
+
+def parse_replicas(value: str, db_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    '''
+        реплики из строки "host:port,host:port": база, пользователь и пароль - как у основной БД
+    '''
+    replicas = []
+    for item in value.split(','):
+        host, _, port = item.strip().rpartition(':')
+        if not item.strip():
+            continue
+        if not host:
+            host, port = port, db_config['port']
+        replicas.append({**db_config, 'host': host, 'port': int(port)})
+    return replicas
+
+
+class ReplicaUnavailable(psycopg2.OperationalError):
+    """Запрос не выполнился на реплике из-за самой реплики: его можно повторить на основной БД"""
+
+
+class Replica:
+    """Одна реплика: пул подключений и последнее известное состояние"""
+
+    __slots__ = ('name', 'db_config', 'pool', 'healthy', 'lag_seconds', 'checked_at', 'error',
+                 'active', 'queries', 'failures', 'check_lock')
+
+    def __init__(self, db_config: Dict[str, Any]):
+        self.name = f"{db_config['host']}:{db_config['port']}"
+        self.db_config = db_config
+        self.pool: Optional[ConnectionPool] = None
+        self.healthy = False
+        self.lag_seconds: Optional[float] = None
+        self.checked_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.active = 0
+        self.queries = 0
+        self.failures = 0
+        self.check_lock = threading.Lock()
+
+
+class ReplicaSet:
+    """
+    Реплики для запросов на чтение с балансировкой и проверкой состояния
+
+    Реплика получает запросы, только если последняя проверка (не старше
+    check_interval) прошла, сервер в режиме восстановления (то есть это
+    действительно реплика) и отставание не больше max_lag_seconds. Из годных
+    выбирается реплика с наименьшим числом занятых подключений
+    (least_connections) или следующая по кругу (round_robin). Если годных нет,
+    acquire возвращает None, и запрос идет на основную БД. Подключения реплик
+    открывают транзакции только на чтение.
+    """
+
+    def __init__(self, replicas: List[Dict[str, Any]], pool_config: Dict[str, Any],
+                 replica_config: Dict[str, Any]):
+        """
+        Args:
+            replicas: Параметры подключения к каждой реплике (как db_config)
+            pool_config: Параметры пула для каждой реплики (см. DEFAULT_POOL_CONFIG)
+            replica_config: Балансировка и пороги (см. DEFAULT_REPLICA_CONFIG)
+        """
+        if replica_config['balance'] not in ('least_connections', 'round_robin'):
+            raise ValueError(f"Unknown replica balancing: {replica_config['balance']}")
+        self.replicas = [Replica(db_config) for db_config in replicas]
+        self.pool_config = {**pool_config, 'readonly': True, 'connect_timeout': replica_config['connect_timeout']}
+        self.balance = replica_config['balance']
+        self.max_lag_seconds = replica_config['max_lag_seconds']
+        self.check_interval = replica_config['check_interval']
+
+        self._next = 0
+        self._primary_fallbacks = 0
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def acquire(self):
+        """(реплика, подключение) или None, если ни одна реплика сейчас не годится"""
+        for replica in self._candidates():
+            try:
+                connection = replica.pool.getconn()
+            except (psycopg2.Error, PoolError) as e:
+                self._mark_down(replica, e)
+                continue
+            with self._lock:
+                replica.active += 1
+                replica.queries += 1
+            return replica, connection
+
+        with self._lock:
+            self._primary_fallbacks += 1
+        return None
+
+    def release(self, replica: Replica, connection, failed: bool = False):
+        try:
+            replica.pool.putconn(connection)
+        finally:
+            with self._lock:
+                replica.active -= 1
+        if failed:
+            self._mark_down(replica, "query failed on a broken connection")
+
+    def _candidates(self) -> List[Replica]:
+        now = time.monotonic()
+        for replica in self.replicas:
+            if replica.checked_at is None or now - replica.checked_at >= self.check_interval:
+                self._check(replica)
+
+        with self._lock:
+            usable = [replica for replica in self.replicas if replica.healthy
+                      and (replica.lag_seconds is None or replica.lag_seconds <= self.max_lag_seconds)]
+            if not usable:
+                return []
+            # Сдвиг по кругу: при round_robin это и есть порядок, при least_connections - выбор среди равных
+            start = self._next % len(usable)
+            self._next += 1
+            ordered = usable[start:] + usable[:start]
+            if self.balance == 'least_connections':
+                ordered.sort(key=lambda replica: replica.active)
+            return ordered
+
+    def _check(self, replica: Replica):
+        '''
+            проверка доступности и отставания; пока один поток проверяет реплику,
+            остальные пользуются прошлым результатом
+        '''
+        if not replica.check_lock.acquire(blocking=False):
+            return
+        try:
+            if replica.pool is None:
+                replica.pool = ConnectionPool(replica.db_config, self.pool_config)
+            connection = replica.pool.getconn()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(REPLICA_STATUS_QUERY)
+                    row = cursor.fetchone()
+                connection.rollback()
+            finally:
+                replica.pool.putconn(connection)
+
+            if not row['in_recovery']:
+                # Не реплика: основная БД по ошибке в списке или реплика, которую повысили до основной
+                self._mark_down(replica, "server is not in recovery (a primary, not a replica)")
+                return
+
+            lag = float(row['lag_seconds']) if row['lag_seconds'] is not None else None
+            with self._lock:
+                if not replica.healthy:
+                    self.logger.info(f"Replica {replica.name} is available, lag {lag}s")
+                replica.healthy, replica.lag_seconds, replica.error = True, lag, None
+            if lag is not None and lag > self.max_lag_seconds:
+                self.logger.warning(f"Replica {replica.name} lags {lag:.1f}s behind the primary, skipping it")
+        except (psycopg2.Error, PoolError) as e:
+            self._mark_down(replica, e)
+        finally:
+            replica.checked_at = time.monotonic()
+            replica.check_lock.release()
+
+    def _mark_down(self, replica: Replica, error):
+        with self._lock:
+            if replica.healthy:
+                self.logger.warning(f"Replica {replica.name} is unavailable: {error}")
+            replica.healthy = False
+            replica.failures += 1
+            replica.error = str(error).strip()
+            # До следующей проверки не меньше check_interval
+            replica.checked_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'balance': self.balance,
+                'primary_fallbacks': self._primary_fallbacks,
+                'replicas': {replica.name: {'healthy': replica.healthy, 'lag_seconds': replica.lag_seconds,
+                                            'active': replica.active, 'queries': replica.queries,
+                                            'failures': replica.failures, 'error': replica.error}
+                             for replica in self.replicas},
+            }
+
+    def close(self):
+        for replica in self.replicas:
+            if replica.pool is not None:
+                replica.pool.close()
+                replica.pool = None
+
+
+class PreparedStatements:
+    """
+    LRU подготовленных запросов (PREPARE) одного подключения
+
+    Ключ - текст запроса-шаблона (после sql_fingerprint.fingerprint он одинаков
+    у запросов одной формы), значение - имя подготовленного запроса в сеансе.
+    Подключение в каждый момент используется одним потоком, блокировка не нужна.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._names: 'OrderedDict[str, str]' = OrderedDict()
+        self._counter = 0
+
+    def get(self, query: str) -> Optional[str]:
+        name = self._names.get(query)
+        if name is not None:
+            self._names.move_to_end(query)
+        return name
+
+    def next_name(self) -> str:
+        self._counter += 1
+        return f"sl_{self._counter}"
+
+    def add(self, query: str, name: str) -> List[str]:
+        """Запоминает запрос и возвращает имена вытесненных, которые нужно освободить (DEALLOCATE)"""
+        self._names[query] = name
+        evicted = []
+        while len(self._names) > self.max_size:
+            evicted.append(self._names.popitem(last=False)[1])
+        return evicted
+
+    def discard(self, query: str):
+        self._names.pop(query, None)
+
+    def __len__(self):
+        return len(self._names)
+
+
+def prepared_statement_stats() -> Dict[str, Any]:
+    """Статистика подготовленных запросов всех подключений процесса"""
+    with _prepared_lock:
+        stats = dict(_prepared_stats)
+        stats['connections'] = len(_prepared)
+        stats['statements'] = sum(len(statements) for statements in _prepared.values())
+        stats['unpreparable'] = len(_unpreparable)
+    executed = stats['hits'] + stats['prepared']
+    stats['hit_rate'] = round(stats['hits'] / executed, 4) if executed else 0.0
+    return stats
+
+
+def _count_prepared(name: str):
+    with _prepared_lock:
+        _prepared_stats[name] += 1
 
 
 class DatabaseManager:
-    def __init__(self, db_config: Dict[str, Any], use_sqlalchemy: bool = True):
+    def __init__(self, db_config: Dict[str, Any], use_sqlalchemy: bool = True,
+                 pooled: bool = False, pool_config: Optional[Dict[str, Any]] = None,
+                 result_cache=None, prepared_cache_size: int = 100,
+                 replicas: Optional[List[Dict[str, Any]]] = None, replica_config: Optional[Dict[str, Any]] = None):
         """
         Инициализация менеджера базы данных
 
         Args:
             db_config: Словарь с параметрами подключения
             use_sqlalchemy: Если True - использует SQLAlchemy, False - psycopg2
+            pooled: Если True - берет подключения из общего на процесс пула
+            pool_config: Параметры пула (см. DEFAULT_POOL_CONFIG)
+            result_cache: Кэш результатов SELECT (result_cache.ResultCache) или None
+            prepared_cache_size: Сколько подготовленных запросов держать на подключение (0 - не готовить)
+            replicas: Параметры подключения к репликам для запросов на чтение (см. is_read_only);
+                запросы execute_query через SQLAlchemy всегда идут на основную БД
+            replica_config: Балансировка и пороги реплик (см. DEFAULT_REPLICA_CONFIG)
         """
         self.db_config = db_config
         self.use_sqlalchemy = use_sqlalchemy
+        self.pooled = pooled
+        self.pool_config = {**DEFAULT_POOL_CONFIG, **(pool_config or {})}
+        self.result_cache = result_cache
+        self.prepared_cache_size = prepared_cache_size
+        self.replicas = replicas or []
+        self.replica_config = {**DEFAULT_REPLICA_CONFIG, **(replica_config or {})}
 
         # Атрибуты для SQLAlchemy
         self.engine = None
@@ -27,6 +501,7 @@ class DatabaseManager:
 
         # Атрибуты для psycopg2
         self.connection = None
+        self.pool = None
 
         self._setup_logging()
 
@@ -54,14 +529,15 @@ class DatabaseManager:
 
     def _create_sqlalchemy_connection(self):
         """Создание подключения через SQLAlchemy"""
-        connection_string = self._create_connection_string()
-
-        self.engine = create_engine(
-            connection_string,
-            poolclass=NullPool,
-            echo=False,
-            future=True
-        )
+        if self.pooled:
+            self.engine = self._get_shared_pool(self._create_pooled_engine)
+        else:
+            self.engine = create_engine(
+                self._create_connection_string(),
+                poolclass=NullPool,
+                echo=False,
+                future=True
+            )
 
         self.SessionLocal = sessionmaker(
             autocommit=False,
@@ -69,8 +545,35 @@ class DatabaseManager:
             bind=self.engine
         )
 
+    def _create_pooled_engine(self):
+        """Создание движка SQLAlchemy с QueuePool"""
+        return create_engine(
+            self._create_connection_string(),
+            poolclass=QueuePool,
+            pool_size=self.pool_config['min_size'],
+            max_overflow=self.pool_config['max_size'] - self.pool_config['min_size'],
+            pool_timeout=self.pool_config['timeout'],
+            pool_recycle=self.pool_config['max_lifetime'] or -1,
+            pool_pre_ping=self.pool_config['health_check'],
+            echo=False,
+            future=True
+        )
+
+    def _get_shared_pool(self, factory):
+        """Получение общего пула процесса для текущих параметров подключения"""
+        # Пул транзакций только на чтение - отдельный: подключения основного пула должны уметь писать
+        key = (self.use_sqlalchemy, tuple(sorted(self.db_config.items())), bool(self.pool_config['readonly']))
+        with _pools_lock:
+            if key not in _pools:
+                _pools[key] = factory()
+            return _pools[key]
+
     def _create_psycopg2_connection(self):
         """Создание подключения через psycopg2"""
+        if self.pooled:
+            self.pool = self._get_shared_pool(lambda: ConnectionPool(self.db_config, self.pool_config))
+            return
+
         self.connection = psycopg2.connect(
             host=self.db_config['host'],
             port=self.db_config['port'],
@@ -80,6 +583,20 @@ class DatabaseManager:
             cursor_factory=RealDictCursor
         )
 
+    def _get_replica_set(self) -> Optional[ReplicaSet]:
+        """Общий на процесс набор реплик для текущих параметров (None, если реплик нет)"""
+        if not self.replicas:
+            return None
+        key = tuple(tuple(sorted(replica.items())) for replica in self.replicas)
+        with _pools_lock:
+            if key not in _replica_sets:
+                _replica_sets[key] = ReplicaSet(self.replicas, self.pool_config, self.replica_config)
+            return _replica_sets[key]
+
+    def _routable(self, query: str) -> bool:
+        """Можно ли отправить запрос на реплику"""
+        return bool(self.replicas) and is_read_only(query) and not PRIMARY_ONLY_TABLES.search(query)
+
     def _create_connection_string(self) -> str:
         """Создание строки подключения"""
         return (f"postgresql://{self.db_config['user']}:{self.db_config['password']}"
@@ -87,10 +604,13 @@ class DatabaseManager:
                 f"/{self.db_config['database']}")
 
     @contextmanager
-    def get_cursor(self):
+    def get_cursor(self, read_only: bool = False):
         """
         Контекстный менеджер для работы с курсором
 
+        Args:
+            read_only: Курсор для запросов только на чтение: psycopg2 берет подключение реплики, если она есть
+
         Returns:
             Для SQLAlchemy: SQLAlchemy session
             Для psycopg2: psycopg2 cursor
@@ -98,7 +618,7 @@ class DatabaseManager:
         if self.use_sqlalchemy:
             yield from self._get_sqlalchemy_session()
         else:
-            yield from self._get_psycopg2_cursor()
+            yield from self._get_psycopg2_cursor(read_only=read_only)
 
     def _get_sqlalchemy_session(self):
         """Контекстный менеджер для SQLAlchemy сессии"""
@@ -116,45 +636,148 @@ class DatabaseManager:
         finally:
             session.close()
 
-    def _get_psycopg2_cursor(self):
-        """Контекстный менеджер для psycopg2 курсора"""
-        if not self.connection or self.connection.closed:
+    def _get_psycopg2_cursor(self, name: Optional[str] = None, cursor_factory=None, read_only: bool = False):
+        """
+        Контекстный менеджер для psycopg2 курсора
+
+        Args:
+            name: Имя серверного (named) курсора, None - обычный курсор
+            cursor_factory: Класс курсора вместо RealDictCursor по умолчанию
+            read_only: Взять подключение реплики; если годных реплик нет - основной БД
+        """
+        acquired = self._acquire_replica() if read_only else None
+        if acquired is not None:
+            yield from self._use_replica_connection(*acquired, name, cursor_factory)
+            return
+
+        if self.pooled:
+            if not self.pool:
+                self.create_connect()
+            connection = self.pool.getconn()
+        else:
+            if not self.connection or self.connection.closed:
+                self.create_connect()
+            connection = self.connection
+
+        try:
+            yield from self._use_dbapi_connection(connection, name, cursor_factory)
+        finally:
+            if self.pooled:
+                self.pool.putconn(connection)
+
+    @contextmanager
+    def get_raw_cursor(self, name: Optional[str] = None, cursor_factory=None, read_only: bool = False):
+        """
+        Контекстный менеджер для курсора драйвера psycopg2 в обоих режимах
+
+        Нужен для COPY и серверных курсоров, которых нет в API сессии SQLAlchemy.
+        С read_only курсор открывается на реплике, если она есть (в обоих режимах).
+        """
+        if not self.use_sqlalchemy:
+            yield from self._get_psycopg2_cursor(name, cursor_factory, read_only)
+            return
+
+        acquired = self._acquire_replica() if read_only else None
+        if acquired is not None:
+            yield from self._use_replica_connection(*acquired, name, cursor_factory)
+            return
+
+        if not self.engine:
             self.create_connect()
 
-        cursor = self.connection.cursor()
+        connection = self.engine.raw_connection()
+        try:
+            yield from self._use_dbapi_connection(connection, name, cursor_factory)
+        finally:
+            connection.close()
+
+    def _use_dbapi_connection(self, connection, name: Optional[str] = None, cursor_factory=None):
+        """Выдача курсора с фиксацией транзакции при успехе и откатом при ошибке"""
+        kwargs = {'cursor_factory': cursor_factory} if cursor_factory else {}
+        cursor = connection.cursor(name, **kwargs) if name else connection.cursor(**kwargs)
         try:
-            yield cursor
-            self.connection.commit()
+            # Серверный курсор надо закрыть до commit: после него он уже недействителен
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+            connection.commit()
         except Exception as e:
-            self.connection.rollback()
+            connection.rollback()
             self.logger.error(f"Psycopg2 cursor error: {e}")
             raise
+
+    def _acquire_replica(self):
+        replica_set = self._get_replica_set()
+        acquired = replica_set.acquire() if replica_set is not None else None
+        return (replica_set, *acquired) if acquired is not None else None
+
+    def _use_replica_connection(self, replica_set: ReplicaSet, replica: Replica, connection,
+                                name: Optional[str] = None, cursor_factory=None):
+        '''
+            курсор на подключении реплики; сбой из-за самой реплики (обрыв связи, конфликт
+            с восстановлением, попытка записи) превращается в ReplicaUnavailable
+        '''
+        annotate(replica=replica.name)
+        failed = False
+        try:
+            yield from self._use_dbapi_connection(connection, name, cursor_factory)
+        except psycopg2.extensions.QueryCanceledError:
+            # statement_timeout - свойство запроса, а не реплики: на основной БД будет то же
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError, psycopg2.errors.ReadOnlySqlTransaction) as e:
+            failed = bool(connection.closed)
+            raise ReplicaUnavailable(f"Replica {replica.name} failed: {str(e).strip()}") from e
         finally:
-            cursor.close()
+            replica_set.release(replica, connection, failed)
 
-    def execute_query(self, query: str, params: Optional[tuple] = None) -> Union[List[Dict], int]:
+    def execute_query(self, query: str, params: Optional[tuple] = None,
+                      timeout_ms: Optional[int] = None, prepare: bool = False) -> Union[List[Dict], int]:
         """
         Выполнение SQL запроса
 
         Args:
             query: SQL запрос
             params: Параметры для запроса
+            timeout_ms: Ограничение времени выполнения (statement_timeout) только для этого запроса
+            prepare: Выполнять через PREPARE/EXECUTE с кэшем на подключение (только psycopg2,
+                позиционные параметры): повторная форма запроса не планируется заново
 
         Returns:
             Для SELECT: список результатов
             Для других запросов: количество затронутых строк
         """
+        with span('execute_query') as query_span:
+            # В кэш идут только запросы, которые ничего не меняют (не WITH ... DELETE, не nextval)
+            if self.result_cache is not None and is_read_only(query):
+                # Свежесть кэш сверяет по основной БД, поэтому и заполняется с нее: реплика может отставать
+                # от этой сверки. Некэшируемые запросы по-прежнему идут на реплики
+                result = self.result_cache.fetch(
+                    query, params,
+                    lambda: self._execute_query(query, params, timeout_ms, prepare, primary=True),
+                    uncached=lambda: self._execute_query(query, params, timeout_ms, prepare))
+            else:
+                result = self._execute_query(query, params, timeout_ms, prepare)
+            query_span.set(rows=len(result) if isinstance(result, list) else result)
+            return result
+
+    def _execute_query(self, query: str, params: Optional[tuple] = None, timeout_ms: Optional[int] = None,
+                       prepare: bool = False, primary: bool = False) -> Union[List[Dict], int]:
         if self.use_sqlalchemy:
-            return self._execute_sqlalchemy_query(query, params)
+            return self._execute_sqlalchemy_query(query, params, timeout_ms)
         else:
-            return self._execute_psycopg2_query(query, params)
+            return self._execute_psycopg2_query(query, params, timeout_ms, prepare, primary)
 
-    def _execute_sqlalchemy_query(self, query: str, params: Optional[tuple] = None) -> Union[List[Dict], int]:
+    def _execute_sqlalchemy_query(self, query: str, params: Optional[tuple] = None,
+                                  timeout_ms: Optional[int] = None) -> Union[List[Dict], int]:
         """Выполнение запроса через SQLAlchemy"""
         with self.get_cursor() as session:
+            if timeout_ms:
+                session.execute(text("SELECT set_config('statement_timeout', :timeout, true)"),
+                                {'timeout': str(timeout_ms)})
             result = session.execute(query, params or {})
 
-            if query.strip().lower().startswith('select'):
+            if result.returns_rows:
                 # Преобразуем результат в список словарей
                 columns = result.keys()
                 return [dict(zip(columns, row)) for row in result.fetchall()]
@@ -162,16 +785,234 @@ class DatabaseManager:
                 session.commit()
                 return result.rowcount
 
-    def _execute_psycopg2_query(self, query: str, params: Optional[tuple] = None) -> Union[List[Dict], int]:
-        """Выполнение запроса через psycopg2"""
-        with self.get_cursor() as cursor:
-            cursor.execute(query, params or ())
+    def _execute_psycopg2_query(self, query: str, params: Optional[tuple] = None, timeout_ms: Optional[int] = None,
+                                prepare: bool = False, primary: bool = False) -> Union[List[Dict], int]:
+        """Выполнение запроса через psycopg2: запрос на чтение - на реплике, если она есть и не задан primary"""
+        if not primary and self._routable(query):
+            try:
+                return self._run_psycopg2_query(query, params, timeout_ms, prepare, read_only=True)
+            except ReplicaUnavailable as e:
+                # Запрос только читает, поэтому его безопасно повторить на основной БД
+                self.logger.warning(f"{e}, retrying on the primary")
+        return self._run_psycopg2_query(query, params, timeout_ms, prepare)
+
+    def _run_psycopg2_query(self, query: str, params: Optional[tuple] = None, timeout_ms: Optional[int] = None,
+                            prepare: bool = False, read_only: bool = False) -> Union[List[Dict], int]:
+        with self.get_cursor(read_only) as cursor:
+            if timeout_ms:
+                # set_config(..., true) действует только до конца текущей транзакции
+                cursor.execute("SELECT set_config('statement_timeout', %s, true)", (str(timeout_ms),))
+            if prepare and self.prepared_cache_size > 0 and not isinstance(params, dict):
+                self._execute_prepared(cursor, query, params)
+            else:
+                cursor.execute(query, params or None)
 
-            if query.strip().lower().startswith('select'):
+            # description есть у всего, что возвращает строки: SELECT, WITH ... SELECT, EXPLAIN
+            if cursor.description is not None:
                 return cursor.fetchall()
             else:
                 return cursor.rowcount
 
+    def _execute_prepared(self, cursor, query: str, params: Optional[tuple] = None):
+        """
+        EXECUTE подготовленного запроса; форма, впервые встреченная на подключении,
+        сначала подготавливается (PREPARE), самая давно не использованная вытесняется
+
+        PREPARE выполняется под SAVEPOINT: если Postgres не может подготовить запрос
+        (например, тип параметра не выводится), транзакция не ломается, а запрос
+        выполняется обычным способом.
+        """
+        with _prepared_lock:
+            statements = _prepared.get(cursor.connection)
+            if statements is None:
+                statements = _prepared[cursor.connection] = PreparedStatements(self.prepared_cache_size)
+            unpreparable = query in _unpreparable
+
+        name = statements.get(query)
+        if name is None:
+            if unpreparable:
+                cursor.execute(query, params or None)
+                return
+            name = statements.next_name()
+            if not self._prepare(cursor, name, query, params):
+                cursor.execute(query, params or None)
+                return
+            for evicted in statements.add(query, name):
+                cursor.execute(f"DEALLOCATE {evicted}")
+                _count_prepared('evicted')
+            _count_prepared('prepared')
+            annotate(prepared='miss')
+        else:
+            _count_prepared('hits')
+            annotate(prepared='hit')
+
+        try:
+            if params:
+                cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+            else:
+                cursor.execute(f"EXECUTE {name}")
+        except psycopg2.Error:
+            # Например, после изменения таблицы план с другим набором колонок уже не годится:
+            # в следующий раз форма подготовится заново под новым именем
+            statements.discard(query)
+            raise
+
+    def _prepare(self, cursor, name: str, query: str, params: Optional[tuple]) -> bool:
+        statement = query
+        if params:
+            # Шаблон psycopg2 -> текст Postgres: %s становятся $1, $2, ..., %% - обычным %
+            numbers = iter(range(1, len(params) + 1))
+            statement = PLACEHOLDER.sub(lambda match: '%' if match.group() == '%%' else f"${next(numbers)}", query)
+
+        cursor.execute("SAVEPOINT prepare_statement")
+        try:
+            cursor.execute(f"PREPARE {name} AS {statement}")
+        except psycopg2.Error as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT prepare_statement")
+            self.logger.debug(f"Query cannot be prepared, executing directly: {e}")
+            with _prepared_lock:
+                _prepared_stats['failed'] += 1
+                _unpreparable[query] = None
+                while len(_unpreparable) > MAX_UNPREPARABLE:
+                    _unpreparable.popitem(last=False)
+            return False
+        cursor.execute("RELEASE SAVEPOINT prepare_statement")
+        return True
+
+    def fetch_result_set(self, query: str, params: Optional[tuple] = None,
+                         timeout_ms: Optional[int] = None) -> ResultSet:
+        """
+        Выполнение SELECT с результатом в виде ResultSet (строки-кортежи и имена колонок)
+
+        В отличие от execute_query строки не превращаются в словари: для широких
+        результатов и выгрузки по колонкам (NumPy, Arrow) это намного меньше памяти.
+        """
+        with span('fetch_result_set') as fetch_span:
+            result_set = None
+            if self._routable(query):
+                try:
+                    result_set = self._fetch_result_set(query, params, timeout_ms, read_only=True)
+                except ReplicaUnavailable as e:
+                    self.logger.warning(f"{e}, retrying on the primary")
+            if result_set is None:
+                result_set = self._fetch_result_set(query, params, timeout_ms)
+            fetch_span.set(rows=len(result_set))
+            return result_set
+
+    def _fetch_result_set(self, query: str, params: Optional[tuple], timeout_ms: Optional[int],
+                          read_only: bool = False) -> ResultSet:
+        with self.get_raw_cursor(cursor_factory=psycopg2.extensions.cursor, read_only=read_only) as cursor:
+            if timeout_ms:
+                cursor.execute("SELECT set_config('statement_timeout', %s, true)", (str(timeout_ms),))
+            cursor.execute(query, params or None)
+            return ResultSet.from_cursor(cursor, cursor.fetchall())
+
+    def iter_result_sets(self, query: str, params: Optional[tuple] = None,
+                         batch_rows: int = DEFAULT_ITERSIZE) -> Iterator[ResultSet]:
+        """
+        Результат SELECT пачками по batch_rows строк через серверный курсор
+
+        Первая пачка отдается всегда, даже пустая: по ней известны колонки и их типы.
+        """
+        cursor_name = f"batches_{uuid.uuid4().hex}"
+        with self.get_raw_cursor(cursor_name, cursor_factory=psycopg2.extensions.cursor,
+                                 read_only=self._routable(query)) as cursor:
+            cursor.itersize = batch_rows
+            cursor.execute(query, params or None)
+            first = True
+            while True:
+                rows = cursor.fetchmany(batch_rows)
+                if rows or first:
+                    yield ResultSet.from_cursor(cursor, rows)
+                first = False
+                if len(rows) < batch_rows:
+                    return
+
+    def export_columnar(self, query: str, file: IO[bytes], params: Optional[tuple] = None,
+                        file_format: str = 'parquet', batch_rows: int = DEFAULT_ITERSIZE) -> int:
+        """
+        Потоковая выгрузка результата SELECT в Parquet или Arrow IPC (нужен pyarrow)
+
+        Args:
+            query: SQL запрос (SELECT или WITH ... SELECT)
+            file: Открытый на запись двоичный файл
+            params: Параметры для запроса
+            file_format: 'parquet' - пачка становится row group, 'arrow' - record batch файла Arrow IPC
+            batch_rows: Строк в пачке: в памяти не больше одной пачки
+
+        Returns:
+            Количество выгруженных строк
+        """
+        query = query.strip().rstrip(';')
+
+        with span('export_columnar', format=file_format) as export_span:
+            # closing: при ошибке записи серверный курсор и подключение освобождаются сразу
+            with closing(self.iter_result_sets(query, params, batch_rows)) as result_sets:
+                row_count = write_batches(result_sets, file, file_format)
+            export_span.set(rows=row_count)
+            return row_count
+
+    def export_csv(self, query: str, file: IO[str], params: Optional[tuple] = None,
+                   method: str = 'copy', itersize: int = DEFAULT_ITERSIZE) -> int:
+        """
+        Потоковая выгрузка результата SELECT в CSV без загрузки всех строк в память
+
+        Args:
+            query: SQL запрос (SELECT или WITH ... SELECT)
+            file: Открытый на запись текстовый файл
+            params: Параметры для запроса
+            method: 'copy' - COPY (...) TO STDOUT на стороне сервера,
+                    'cursor' - серверный курсор и построчная запись
+            itersize: Сколько строк серверный курсор забирает за один раз
+
+        Returns:
+            Количество выгруженных строк
+        """
+        query = query.strip().rstrip(';')
+
+        with span('export_csv', method=method) as export_span:
+            if method == 'copy':
+                row_count = self._copy_to_csv(query, file, params)
+            elif method == 'cursor':
+                row_count = self._stream_to_csv(query, file, params, itersize)
+            else:
+                raise ValueError(f"Unknown CSV export method: {method}")
+            export_span.set(rows=row_count)
+            return row_count
+
+    def _copy_to_csv(self, query: str, file: IO[str], params: Optional[tuple] = None) -> int:
+        """Выгрузка через COPY: строки идут с сервера прямо в файл"""
+        with self.get_raw_cursor(read_only=self._routable(query)) as cursor:
+            if params:
+                query = cursor.mogrify(query, params).decode(cursor.connection.encoding)
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH CSV HEADER", file)
+            return cursor.rowcount
+
+    def _stream_to_csv(self, query: str, file: IO[str], params: Optional[tuple] = None,
+                       itersize: int = DEFAULT_ITERSIZE) -> int:
+        """Выгрузка через серверный курсор: в памяти не больше itersize строк"""
+        cursor_name = f"export_{uuid.uuid4().hex}"
+        with self.get_raw_cursor(cursor_name, cursor_factory=psycopg2.extensions.cursor,
+                                 read_only=self._routable(query)) as cursor:
+            cursor.itersize = itersize
+            cursor.execute(query, params or None)
+
+            rows = iter(cursor)
+            first_row = next(rows, None)
+
+            # У серверного курсора описание колонок появляется только после первой выборки
+            writer = csv.writer(file)
+            writer.writerow([column.name for column in cursor.description])
+            if first_row is None:
+                return 0
+
+            writer.writerow(first_row)
+            row_count = 1
+            for row in rows:
+                writer.writerow(row)
+                row_count += 1
+            return row_count
+
     def close_connect(self):
         """Закрытие подключения к базе данных"""
         try:
@@ -189,16 +1030,44 @@ class DatabaseManager:
     def _close_sqlalchemy_connection(self):
         """Закрытие SQLAlchemy подключения"""
         if self.engine:
-            self.engine.dispose()
+            # Общий пул живет дольше менеджера, закрывается через close_all_pools()
+            if not self.pooled:
+                self.engine.dispose()
             self.engine = None
             self.SessionLocal = None
 
     def _close_psycopg2_connection(self):
         """Закрытие psycopg2 подключения"""
+        self.pool = None
         if self.connection and not self.connection.closed:
             self.connection.close()
             self.connection = None
 
+    def pool_stats(self) -> Dict[str, Any]:
+        """Статистика общего пула подключений (пустой словарь, если пул не используется)"""
+        if not self.pooled:
+            return {}
+
+        if self.use_sqlalchemy:
+            if not self.engine:
+                return {}
+            pool = self.engine.pool
+            return {
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'idle': pool.checkedin(),
+                'overflow': pool.overflow(),
+                'max_size': self.pool_config['max_size'],
+                'status': pool.status(),
+            }
+
+        return self.pool.stats() if self.pool else {}
+
+    def replica_stats(self) -> Dict[str, Any]:
+        """Состояние реплик (пустой словарь, если реплик нет)"""
+        replica_set = self._get_replica_set()
+        return replica_set.stats() if replica_set is not None else {}
+
     def test_connection(self) -> bool:
         """Тестирование подключения к базе данных"""
         try:
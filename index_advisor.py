@@ -0,0 +1,408 @@
+import argparse
+import json
+import logging
+import os
+import re
+from typing import Optional, Dict, List, Tuple, Iterable
+
+from dotenv import load_dotenv
+
+from database import DatabaseManager
+from schema_provider import SchemaProvider
+
+
+PG_STAT_STATEMENTS_QUERY = '''
+    SELECT query, calls, total_exec_time
+    FROM pg_stat_statements
+    WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+      AND query ~* '^\\s*(select|with)\\s'
+    ORDER BY total_exec_time DESC
+    LIMIT %s
+'''
+
+BTREE_INDEXES_QUERY = '''
+    SELECT tablename, indexname, indexdef
+    FROM pg_indexes
+    WHERE schemaname = 'public' AND indexdef LIKE '% USING btree %'
+'''
+
+TABLE_ROWS_QUERY = '''
+    SELECT relname AS table_name, reltuples::bigint AS row_estimate
+    FROM pg_class
+    WHERE relkind IN ('r', 'p') AND relnamespace = 'public'::regnamespace
+'''
+
+COLUMN_STATS_QUERY = '''
+    SELECT s.tablename, s.attname, s.n_distinct, c.reltuples
+    FROM pg_stats s
+    JOIN pg_class c ON c.relname = s.tablename AND c.relnamespace = 'public'::regnamespace
+    WHERE s.schemaname = 'public'
+'''
+
+# Операторы, по которым btree-индекс сужает поиск; <>, NOT IN и IS NOT NULL не в счет
+_EQUALITY_OPERATORS = ('=', 'in', 'is')
+_OPERATOR = r'(=|<=|>=|<(?!>)|>|\bin\b|\bbetween\b|\blike\b|\bis\s+null\b)'
+_QUALIFIED_LEFT = re.compile(r'\b([a-z_]\w*)\.([a-z_]\w*)\s*' + _OPERATOR)
+_JOIN_CONDITION = re.compile(r'\b([a-z_]\w*)\.([a-z_]\w*)\s*=\s*([a-z_]\w*)\.([a-z_]\w*)\b')
+_UNQUALIFIED_LEFT = re.compile(r'(?<![.\w])([a-z_]\w*)\s*' + _OPERATOR)
+_TABLE_REFERENCE = re.compile(r'(?:\bfrom|\bjoin|,)\s+([a-z_]\w*)(?:\s+(?:as\s+)?([a-z_]\w*))?')
+_ORDER_BY = re.compile(r'\border\s+by\s+(.+?)(?=\blimit\b|\boffset\b|\bfetch\b|\)|;|$)', re.S)
+# Индекс имеет смысл, если условия оставляют не больше 5% строк; диапазон оценивается в треть
+MAX_SELECTIVITY = 0.05
+RANGE_SELECTIVITY = 0.3
+
+_NOT_ALIASES = {
+    'on', 'where', 'join', 'left', 'right', 'inner', 'full', 'cross', 'natural', 'group', 'order', 'limit',
+    'offset', 'union', 'using', 'lateral', 'having', 'window', 'except', 'intersect', 'as',
+}
+
+
+class IndexProposal:
+    """Предлагаемый индекс: таблица, колонки и суммарный вес запросов, которым он поможет"""
+
+    def __init__(self, table: str, columns: Tuple[str, ...], equality_count: int):
+        self.table = table
+        self.columns = columns
+        self.equality_count = equality_count
+        self.score = 0.0
+        self.queries = 0
+        self.examples: List[str] = []
+        self.partially_covered_by: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        name = f"{self.table}_{'_'.join(self.columns)}_idx"
+        return name if len(name) <= 63 else name[:59] + '_idx'
+
+    @property
+    def sql(self) -> str:
+        return (f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {self.name} "
+                f"ON {self.table} ({', '.join(self.columns)});")
+
+    def __repr__(self):
+        return f"IndexProposal({self.table}{self.columns!r}, score={self.score:.1f})"
+
+
+class IndexAdvisor:
+    """
+    Подбор недостающих индексов по реально выполненным запросам
+
+    Источники запросов - журнал smart_line (GENERATED_SQL_LOG) и pg_stat_statements.
+    Из каждого SELECT (подзапросы разбираются отдельно) достаются колонки условий
+    WHERE, соединений и ORDER BY; для каждой таблицы получаются кандидаты: колонки
+    с равенством (самые селективные первыми) и одна колонка с диапазоном или
+    сортировкой, плюс колонки соединений. Кандидаты, которые уже покрыты
+    существующим btree-индексом, слабо селективные и на маленьких таблицах
+    не предлагаются.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, min_table_rows: int = 10_000):
+        """
+        Args:
+            db_manager: Менеджер БД, через который читаются схема и статистика
+            min_table_rows: Таблицы меньше этого размера не индексируются (хватает seq scan)
+        """
+        self.db_manager = db_manager
+        self.min_table_rows = min_table_rows
+
+        self.schema = SchemaProvider(db_manager)
+        self.indexes: Dict[str, List[Tuple[str, List[str]]]] = {}
+        self.table_rows: Dict[str, int] = {}
+        self.distinct: Dict[Tuple[str, str], float] = {}
+        self.logger = logging.getLogger(__name__)
+
+    def load(self):
+        """Чтение схемы, существующих индексов и статистики планировщика"""
+        self.schema.load()
+
+        self.indexes = {}
+        for row in self.db_manager.execute_query(BTREE_INDEXES_QUERY):
+            columns = self._index_columns(row['indexdef'])
+            if columns:
+                self.indexes.setdefault(row['tablename'], []).append((row['indexname'], columns))
+
+        self.table_rows = {row['table_name']: row['row_estimate']
+                           for row in self.db_manager.execute_query(TABLE_ROWS_QUERY)}
+
+        # n_distinct < 0 - доля от числа строк
+        self.distinct = {}
+        for row in self.db_manager.execute_query(COLUMN_STATS_QUERY):
+            n_distinct = row['n_distinct']
+            if n_distinct < 0:
+                n_distinct = -n_distinct * max(row['reltuples'], 1)
+            self.distinct[(row['tablename'], row['attname'])] = n_distinct
+
+    def statements_from_log(self, path: str) -> List[Tuple[str, float]]:
+        """Запросы из журнала smart_line с весом = время выполнения в мс"""
+        if not os.path.exists(path):
+            self.logger.warning(f"Generated SQL log not found: {path}")
+            return []
+
+        statements = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                statements.append((record['sql'], max(record.get('seconds', 0) * 1000, 1.0)))
+        return statements
+
+    def statements_from_pg_stat_statements(self, limit: int = 500) -> List[Tuple[str, float]]:
+        """Самые дорогие SELECT из pg_stat_statements с весом = суммарное время в мс"""
+        try:
+            rows = self.db_manager.execute_query(PG_STAT_STATEMENTS_QUERY, (limit,))
+        except Exception as e:
+            self.logger.warning(f"pg_stat_statements unavailable: {e}")
+            return []
+        return [(row['query'], max(float(row['total_exec_time']), 1.0)) for row in rows]
+
+    def advise(self, statements: Iterable[Tuple[str, float]], min_score: float = 0.0) -> List[IndexProposal]:
+        """
+        Список предлагаемых индексов по убыванию веса
+
+        Args:
+            statements: Пары (SQL, вес)
+            min_score: Индексы с меньшим суммарным весом не предлагаются
+        """
+        proposals: Dict[Tuple[str, Tuple[str, ...]], IndexProposal] = {}
+
+        for sql, weight in statements:
+            seen = set()
+            for table, equality, ranged, joins in self.predicates(sql):
+                for columns, equality_count in self._candidates(table, equality, ranged, joins):
+                    if (table, columns) in seen or self._covering_index(table, columns, equality_count):
+                        continue
+                    seen.add((table, columns))
+
+                    proposal = proposals.setdefault((table, columns), IndexProposal(table, columns, equality_count))
+                    proposal.score += weight
+                    proposal.queries += 1
+                    if len(proposal.examples) < 3:
+                        proposal.examples.append(' '.join(sql.split())[:200])
+
+        result = self._merge_prefixes(list(proposals.values()))
+        for proposal in result:
+            proposal.partially_covered_by = self._partial_index(proposal.table, proposal.columns[0])
+        return sorted((p for p in result if p.score >= min_score), key=lambda p: p.score, reverse=True)
+
+    def predicates(self, sql: str) -> List[Tuple[str, List[str], List[str], List[str]]]:
+        """
+        Колонки условий по таблицам, отдельно для каждого SELECT (подзапросы - отдельно)
+
+        Returns:
+            Список (таблица, колонки с равенством, с диапазоном/сортировкой, колонки соединений)
+        """
+        text = re.sub(r"'(?:[^']|'')*'", "''", sql).lower()
+        result = []
+        for scope in self._scopes(text):
+            result.extend(self._scope_predicates(scope))
+        return result
+
+    @staticmethod
+    def _scopes(text: str) -> List[str]:
+        """Текст запроса, разрезанный на SELECT-ы: каждый подзапрос в скобках заменяется на '?'"""
+        scopes = []
+        while True:
+            innermost = None
+            depth_starts = []
+            for position, char in enumerate(text):
+                if char == '(':
+                    depth_starts.append(position)
+                elif char == ')' and depth_starts:
+                    start = depth_starts.pop()
+                    if re.match(r'\(\s*(select|with)\b', text[start:]):
+                        innermost = (start, position)
+                        break
+            if innermost is None:
+                scopes.append(text)
+                return scopes
+            start, end = innermost
+            scopes.append(text[start + 1:end])
+            text = text[:start] + '?' + text[end + 1:]
+
+    def _scope_predicates(self, text: str) -> List[Tuple[str, List[str], List[str], List[str]]]:
+        aliases: Dict[str, str] = {}
+        for table, alias in _TABLE_REFERENCE.findall(text):
+            if table in self.schema.tables:
+                aliases[table] = table
+                if alias and alias not in _NOT_ALIASES:
+                    aliases[alias] = table
+        tables = set(aliases.values())
+        if not tables:
+            return []
+
+        found: Dict[str, Tuple[List[str], List[str], List[str]]] = {table: ([], [], []) for table in tables}
+
+        def add(table: Optional[str], column: str, kind: int):
+            if table is None or column not in self._columns(table):
+                return
+            if column not in found[table][kind]:
+                found[table][kind].append(column)
+
+        # Сначала соединения a.x = b.y, чтобы не принять их за фильтры
+        def join(match) -> str:
+            left_alias, left_column, right_alias, right_column = match.groups()
+            add(aliases.get(left_alias), left_column, 2)
+            add(aliases.get(right_alias), right_column, 2)
+            return '?'
+        text = _JOIN_CONDITION.sub(join, text)
+
+        for alias, column, operator in _QUALIFIED_LEFT.findall(text):
+            add(aliases.get(alias), column, 0 if operator.split()[0] in _EQUALITY_OPERATORS else 1)
+        for column, operator in _UNQUALIFIED_LEFT.findall(text):
+            add(self._owner(column, tables), column, 0 if operator.split()[0] in _EQUALITY_OPERATORS else 1)
+
+        for order_by in _ORDER_BY.findall(text):
+            for item in order_by.split(','):
+                reference = re.match(r'\s*(?:([a-z_]\w*)\.)?([a-z_]\w*)', item)
+                if reference:
+                    table = aliases.get(reference.group(1)) if reference.group(1) else self._owner(
+                        reference.group(2), tables)
+                    add(table, reference.group(2), 1)
+
+        return [(table, equality, ranged, joins) for table, (equality, ranged, joins) in found.items()
+                if equality or ranged or joins]
+
+    def _candidates(self, table: str, equality: List[str], ranged: List[str],
+                    joins: List[str]) -> List[Tuple[Tuple[str, ...], int]]:
+        """
+        Колонки индексов для одной таблицы одного SELECT:
+        - фильтры: равенства по убыванию числа различных значений, затем один диапазон;
+        - соединения: колонка соединения (для поиска по ней во вложенном цикле) и равенства.
+        Кандидаты, которые отсеют меньше 95% строк, не предлагаются.
+        """
+        if self.table_rows.get(table, 0) < self.min_table_rows:
+            return []
+
+        equality = sorted(equality, key=lambda column: self._distinct(table, column), reverse=True)[:3]
+        ranged = [column for column in ranged if column not in equality][:1]
+
+        candidates = []
+        if equality or ranged:
+            candidates.append((tuple(equality + ranged), len(equality)))
+        for column in joins:
+            if column not in equality and self._partial_index(table, column) is None:
+                candidates.append(((column,) + tuple(equality), len(equality) + 1))
+
+        return [(columns, equality_count) for columns, equality_count in candidates
+                if self._selectivity(table, columns, equality_count) <= MAX_SELECTIVITY]
+
+    def _distinct(self, table: str, column: str) -> float:
+        return self.distinct.get((table, column), 0)
+
+    def _selectivity(self, table: str, columns: Tuple[str, ...], equality_count: int) -> float:
+        """Грубая доля строк, которые останутся после условий (без статистики считаем колонку селективной)"""
+        selectivity = 1.0
+        for column in columns[:equality_count]:
+            distinct = self._distinct(table, column)
+            selectivity *= 1 / distinct if distinct else 0.001
+        if len(columns) > equality_count:
+            selectivity *= RANGE_SELECTIVITY
+        return selectivity
+
+    def _covering_index(self, table: str, columns: Tuple[str, ...], equality_count: int) -> Optional[str]:
+        """Существующий индекс, который уже обслуживает такой набор условий"""
+        for name, index_columns in self.indexes.get(table, []):
+            if self._covers(index_columns, columns, equality_count):
+                return name
+        return None
+
+    def _partial_index(self, table: str, leading_column: str) -> Optional[str]:
+        for name, index_columns in self.indexes.get(table, []):
+            if index_columns[0] == leading_column:
+                return name
+        return None
+
+    @staticmethod
+    def _covers(index_columns: List[str], columns: Tuple[str, ...], equality_count: int) -> bool:
+        """Порядок колонок с равенством не важен, колонка диапазона должна идти сразу за ними"""
+        if len(index_columns) < len(columns):
+            return False
+        if set(index_columns[:equality_count]) != set(columns[:equality_count]):
+            return False
+        return list(index_columns[equality_count:len(columns)]) == list(columns[equality_count:])
+
+    def _merge_prefixes(self, proposals: List[IndexProposal]) -> List[IndexProposal]:
+        """Кандидат, который покрывается более длинным кандидатом, отдает ему свой вес"""
+        proposals.sort(key=lambda p: len(p.columns), reverse=True)
+        kept: List[IndexProposal] = []
+        for proposal in proposals:
+            wider = next((k for k in kept if k.table == proposal.table
+                          and self._covers(list(k.columns), proposal.columns, proposal.equality_count)), None)
+            if wider is None:
+                kept.append(proposal)
+                continue
+            wider.score += proposal.score
+            wider.queries += proposal.queries
+        return kept
+
+    def _columns(self, table: str) -> set:
+        return {name for name, _ in self.schema.tables.get(table, [])}
+
+    def _owner(self, column: str, tables: set) -> Optional[str]:
+        """Таблица неквалифицированной колонки, если она однозначна"""
+        owners = [table for table in tables if column in self._columns(table)]
+        return owners[0] if len(owners) == 1 else None
+
+    @staticmethod
+    def _index_columns(indexdef: str) -> List[str]:
+        """Простые колонки btree-индекса; частичные индексы и индексы по выражениям не учитываются"""
+        match = re.search(r'USING btree \((.*?)\)(?:\s+INCLUDE\s+\(.*\))?$', indexdef)
+        if not match:
+            return []
+        columns = []
+        for part in match.group(1).split(','):
+            name = part.strip().split()[0].strip('"') if part.strip() else ''
+            if not re.fullmatch(r'[a-z_]\w*', name):
+                break
+            columns.append(name)
+        return columns
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Подбор недостающих индексов по выполненным запросам")
+    parser.add_argument('--log', default=os.environ.get('GENERATED_SQL_LOG', '.cache/generated_sql.jsonl'),
+                        help="Журнал выполненных запросов smart_line")
+    parser.add_argument('--no-stat-statements', action='store_true', help="Не читать pg_stat_statements")
+    parser.add_argument('--min-score', type=float, default=0.0, help="Минимальный вес индекса (мс)")
+    parser.add_argument('--min-table-rows', type=int, default=10_000, help="Не индексировать таблицы меньше")
+    parser.add_argument('--output', help="Записать CREATE INDEX в SQL-файл")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_args()
+
+    from smart_line import db_config
+
+    advisor = IndexAdvisor(DatabaseManager(db_config, use_sqlalchemy=False), min_table_rows=args.min_table_rows)
+    advisor.load()
+
+    statements = advisor.statements_from_log(args.log)
+    if not args.no_stat_statements:
+        statements += advisor.statements_from_pg_stat_statements()
+    print(f"Проанализировано запросов: {len(statements)}")
+
+    proposals = advisor.advise(statements, min_score=args.min_score)
+    if not proposals:
+        print("Недостающих индексов не найдено")
+
+    for proposal in proposals:
+        print(f"\n-- вес {proposal.score:.1f} мс, запросов: {proposal.queries}"
+              + (f", уже есть индекс {proposal.partially_covered_by} с той же первой колонкой"
+                 if proposal.partially_covered_by else ''))
+        for example in proposal.examples:
+            print(f"--   {example}")
+        print(proposal.sql)
+
+    if args.output and proposals:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write("-- Сгенерировано index_advisor.py; применять без транзакции (CONCURRENTLY)\n")
+            for proposal in proposals:
+                f.write(proposal.sql + '\n')
+        print(f"\nИндексы записаны в {args.output}")
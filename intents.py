@@ -0,0 +1,281 @@
+import re
+from typing import Optional, List, Tuple, Any
+
+from auth import User
+
+
+# Слова, которые не несут смысла для запроса и не снижают уверенность
+FILLER_WORDS = {
+    'покажи', 'показать', 'выведи', 'вывести', 'найди', 'найти', 'дай', 'список', 'перечень', 'какие', 'какая',
+    'все', 'всех', 'весь', 'пожалуйста', 'у', 'с', 'со', 'в', 'во', 'на', 'по', 'и', 'которые', 'есть', 'мне',
+    'show', 'list', 'find', 'get', 'give', 'all', 'me', 'what', 'which', 'are', 'the', 'of', 'in', 'with', 'for',
+    'please', 'and', 'that', 'is',
+}
+
+TASKS_PATTERN = r'задач\w*|tasks?'
+
+COLLEAGUES_PATTERN = r'коллег\w*|сотрудник\w*|colleagues|employees|teammates'
+
+CLOSED_STATUSES = "('completed', 'cancelled')"
+
+# Чьи задачи: порядок важен - более конкретные формулировки раньше.
+# Последний элемент - атрибут User, который подставляется в условие (id и отдел уже есть после входа)
+SUBJECTS = [
+    ('created_by_me',
+     r'(созда\w*|постави\w*|заве\w*)\s+(мной|мною|я)|я\s+(созда\w*|постави\w*|заве\w*)|created\s+by\s+me|i\s+created',
+     "t.created_by_user_id = %s", 'id'),
+    ('my_department',
+     r'(мо\w+|наш\w*)\s+(отдел\w*|подразделени\w*|департамент\w*)|(my|our)\s+(department|team)',
+     "t.assigned_department_id = %s", 'department_id'),
+    ('mine',
+     r'\bмо[иеёй]\w*|у\s+меня|\bmy\b|\bmine\b|assigned\s+to\s+me',
+     "t.assigned_user_id = %s", 'id'),
+]
+
+# Отрицания ("невыполненные", "не завершенные", "undone", "not done") - это не статус, а флаг open
+NOT_NEGATED = r'(?<!\bне\s)(?<!\bnot\s)'
+
+# Отрицание, которое не объяснил ни один шаблон ("не в работе"): такой промпт уходит в LLM
+NEGATION = r'\b(не|not)\b'
+
+
+def _not_negated(*alternatives: str) -> str:
+    '''
+        регулярка из вариантов, ни один из которых не совпадает сразу после "не" / "not"
+    '''
+    return '|'.join(NOT_NEGATED + alternative for alternative in alternatives)
+
+
+STATUSES = [
+    (_not_negated(r'\bнов\w*', r'\bnew\b'), 'new'),
+    (_not_negated(r'\bв\s+работе\b', r'\bin\s+progress\b'), 'in_progress'),
+    (_not_negated(r'\b(заверш[её]нн\w*|выполненн\w*|закрыт\w*|completed|done|closed)\b'), 'completed'),
+    (_not_negated(r'\b(отмен[её]нн\w*|cancel\w*)'), 'cancelled'),
+    (_not_negated(r'\bприостановлен\w*', r'\bна\s+паузе\b', r'\bon\s+hold\b'), 'on_hold'),
+]
+
+PRIORITIES = [
+    (_not_negated(r'\bсрочн\w*', r'\burgent\b'), 'urgent'),
+    (_not_negated(r'\b(высок\w*|high)\s+(приоритет\w*|priority)', r'\bважн\w*', r'\bimportant\b'), 'high'),
+    (_not_negated(r'\b(средн\w*|medium)\s+(приоритет\w*|priority)'), 'medium'),
+    (_not_negated(r'\b(низк\w*|low)\s+(приоритет\w*|priority)'), 'low'),
+]
+
+# Фильтры без параметров: (название, регулярка, условие)
+FLAGS = [
+    ('overdue', NOT_NEGATED + r'\b(просроч\w*|overdue)',
+     f"t.due_date < CURRENT_DATE AND t.status NOT IN {CLOSED_STATUSES}"),
+    ('open', r'\b(открыт\w*|активн\w*|текущ\w*|open|active|undone|unfinished|incomplete)\b'
+             r'|\bне\s*(заверш[её]нн\w*|выполненн\w*|закрыт\w*)|\bnot\s+(done|completed|closed|finished)\b',
+     f"t.status NOT IN {CLOSED_STATUSES}"),
+]
+
+# Периоды: (регулярка, нижняя граница, верхняя граница)
+PERIODS = [
+    (r'сегодня|today', "CURRENT_DATE", "CURRENT_DATE + INTERVAL '1 day'"),
+    (r'(на\s+)?(этой|текущей)\s+неделе|this\s+week',
+     "date_trunc('week', CURRENT_DATE)", "date_trunc('week', CURRENT_DATE) + INTERVAL '1 week'"),
+    (r'(в\s+)?(этом|текущем)\s+месяце|this\s+month',
+     "date_trunc('month', CURRENT_DATE)", "date_trunc('month', CURRENT_DATE) + INTERVAL '1 month'"),
+]
+
+GROUPINGS = [
+    (r'по\s+статус\w*|by\s+status', 't.status'),
+    (r'по\s+приоритет\w*|by\s+priority', 't.priority'),
+]
+
+COUNT_PATTERN = r'сколько|количеств\w*|число|how\s+many|count'
+
+# Тема задач: все после предлога - слова для полнотекстового поиска (migrations/006_task_search.sql)
+TOPIC_PATTERN = (r'(\bпро|\bоб?|\bна\s+тему|\bпо\s+теме|\bсвязанн\w*\s+с|\bкасающ\w*(\s+ся)?|\bс\s+упоминанием|'
+                 r'\babout|\bregarding|\bmentioning|\brelated\s+to|\bconcerning)\s+(?P<terms>\S.*)$')
+
+SEARCH_SOURCE = "search_tasks(%s) s JOIN tasks t ON t.id = s.task_id"
+
+COLLEAGUES_SQL = (
+    "SELECT u.id, u.first_name, u.last_name, u.username, u.email, u.position, u.is_manager "
+    "FROM users u "
+    "WHERE u.department_id = %s AND u.is_active "
+    "ORDER BY u.last_name, u.first_name"
+)
+
+TASK_COLUMNS = ('t.id, t.title, t.status, t.priority, t.due_date, '
+                't.assigned_user_id, t.assigned_department_id, t.created_at')
+
+
+class IntentMatch:
+    """Найденный шаблон: параметризованный SQL и уверенность сопоставления"""
+
+    def __init__(self, name: str, sql: str, params: tuple, confidence: float):
+        self.name = name
+        self.sql = sql
+        self.params = params
+        self.confidence = confidence
+
+    def __repr__(self):
+        return f"IntentMatch({self.name!r}, confidence={self.confidence:.2f})"
+
+
+class IntentMatcher:
+    """
+    Сопоставление типовых вопросов с параметризованными SQL-шаблонами без вызова LLM
+
+    Запрос собирается из частей: чьи задачи (мои, моего отдела, созданные мной),
+    фильтры по статусу, приоритету, просрочке и периоду, группировка или подсчет.
+    "Задачи про ..." ищутся через search_tasks с сортировкой по релевантности.
+    Уверенность - доля слов промпта, объясненных шаблоном; если часть промпта
+    не распознана (например, дополнительное условие), шаблон не применяется.
+    """
+
+    def __init__(self, min_confidence: float = 0.8, full_text_search: bool = True):
+        """
+        Args:
+            min_confidence: Минимальная доля распознанных слов промпта
+            full_text_search: Отвечать на вопросы о теме задач через search_tasks (нужна миграция 006)
+        """
+        self.min_confidence = min_confidence
+        self.full_text_search = full_text_search
+
+    def match(self, prompt: str, user: User) -> Optional[IntentMatch]:
+        text = prompt.lower().replace('ё', 'е')
+        spans: List[Tuple[int, int]] = []
+        topic_span: Optional[Tuple[int, int]] = None
+
+        def find(pattern: str):
+            # Совпадения внутри темы не считаются: слова темы - не фильтры
+            for found in re.finditer(pattern, text):
+                if topic_span is None or found.end() <= topic_span[0] or found.start() >= topic_span[1]:
+                    spans.append(found.span())
+                    return found
+            return None
+
+        tasks = find(TASKS_PATTERN)
+        if not tasks:
+            return self._match_colleagues(text, user)
+
+        terms = None
+        topic = re.search(TOPIC_PATTERN, text[tasks.end():]) if self.full_text_search else None
+        if topic:
+            start, end = tasks.end() + topic.start(), len(text)
+            # Группировка в конце ("... по статусу") к теме не относится
+            for pattern, _ in GROUPINGS:
+                grouping = re.search(pattern, text[tasks.end() + topic.start('terms'):])
+                if grouping:
+                    end = min(end, tasks.end() + topic.start('terms') + grouping.start())
+            terms = self._search_terms(text[tasks.end() + topic.start('terms'):end])
+            topic_span = (start, end)
+            spans.append(topic_span)
+
+        subject = None
+        for name, pattern, condition, attribute in SUBJECTS:
+            if find(pattern):
+                subject = (name, condition, getattr(user, attribute))
+                break
+        if subject is None and not terms:
+            return None
+
+        conditions: List[str] = []
+        params: List[Any] = []
+        name_parts = ['search'] if terms else []
+        if terms:
+            params.append(terms)
+        name = None
+        if subject is not None:
+            name, condition, value = subject
+            conditions.append(condition)
+            params.append(value)
+            name_parts.append(name)
+
+        for pattern, status in STATUSES:
+            if find(pattern):
+                conditions.append("t.status = %s")
+                params.append(status)
+                name_parts.append(status)
+                break
+
+        for pattern, priority in PRIORITIES:
+            if find(pattern):
+                conditions.append("t.priority = %s")
+                params.append(priority)
+                name_parts.append(priority)
+                break
+
+        for flag, pattern, flag_condition in FLAGS:
+            if find(pattern):
+                conditions.append(flag_condition)
+                name_parts.append(flag)
+
+        # Для "созданных" период относится к дате создания, иначе - к сроку
+        period_column = "t.created_at" if name == 'created_by_me' else "t.due_date"
+        for pattern, lower, upper in PERIODS:
+            if find(pattern):
+                conditions.append(f"{period_column} >= {lower} AND {period_column} < {upper}")
+                name_parts.append('period')
+                break
+
+        group_by = None
+        for pattern, column in GROUPINGS:
+            if find(pattern):
+                group_by = column
+                break
+        count_only = group_by is None and find(COUNT_PATTERN) is not None
+
+        confidence = self._coverage(text, spans)
+        if confidence < self.min_confidence or self._unexplained_negation(text, spans):
+            return None
+
+        source = SEARCH_SOURCE if terms else "tasks t"
+        where = (" WHERE " + ' AND '.join(f"({c})" for c in conditions)) if conditions else ""
+        if group_by:
+            sql = (f"SELECT {group_by}, count(*) AS tasks_count FROM {source}{where} "
+                   f"GROUP BY {group_by} ORDER BY tasks_count DESC")
+            name_parts.append('grouped')
+        elif count_only:
+            sql = f"SELECT count(*) AS tasks_count FROM {source}{where}"
+            name_parts.append('count')
+        elif terms:
+            sql = f"SELECT {TASK_COLUMNS}, s.rank FROM {source}{where} ORDER BY s.rank DESC, t.id"
+        else:
+            sql = f"SELECT {TASK_COLUMNS} FROM {source}{where} ORDER BY t.due_date NULLS LAST, t.id"
+
+        return IntentMatch('.'.join(name_parts), sql, tuple(params), confidence)
+
+    @staticmethod
+    def _search_terms(terms: str) -> str:
+        '''
+            слова темы для search_tasks: «елочки» - фраза, как и обычные кавычки; знаки в конце убираются
+        '''
+        return re.sub('[«»“”]', '"', terms).strip().rstrip('?!.').strip()
+
+    def _match_colleagues(self, text: str, user: User) -> Optional[IntentMatch]:
+        """Сотрудники отдела текущего пользователя"""
+        spans = []
+        for pattern in (COLLEAGUES_PATTERN, SUBJECTS[1][1] + r'|\bмо[иеёй]\w*|\bmy\b'):
+            found = re.search(pattern, text)
+            if not found:
+                return None
+            spans.append(found.span())
+
+        confidence = self._coverage(text, spans)
+        if confidence < self.min_confidence:
+            return None
+        return IntentMatch('colleagues', COLLEAGUES_SQL, (user.department_id,), confidence)
+
+    @staticmethod
+    def _unexplained_negation(text: str, spans: List[Tuple[int, int]]) -> bool:
+        """Есть ли "не" / "not" вне распознанных фрагментов: шаблон понял бы вопрос наоборот"""
+        return any(not any(start <= found.start() < end for start, end in spans)
+                   for found in re.finditer(NEGATION, text))
+
+    @staticmethod
+    def _coverage(text: str, spans: List[Tuple[int, int]]) -> float:
+        """Доля значимых слов промпта, попавших в распознанные фрагменты"""
+        words = [(m.start(), m.end(), m.group()) for m in re.finditer(r'\w+', text)]
+        if not words:
+            return 0.0
+
+        covered = 0
+        for start, end, word in words:
+            if word in FILLER_WORDS or any(start < span_end and end > span_start for span_start, span_end in spans):
+                covered += 1
+        return covered / len(words)
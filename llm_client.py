@@ -0,0 +1,342 @@
+import asyncio
+import email.utils
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from typing import Optional, Dict, Any, Callable, List
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from tracing import span, annotate
+
+
+DEFAULT_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+DEFAULT_MODEL = "deepseek/deepseek-r1-0528:free"
+
+# Статусы, после которых имеет смысл повторить запрос
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """Запрос к LLM не удался (после всех повторов или с неповторяемой ошибкой)"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CancelScope:
+    """
+    Отмена запроса из другого потока (проигравший запрос хеджирования)
+
+    Запрос, выполняемый с этой областью, регистрирует в ней свои HTTP-соединения;
+    cancel() закрывает их сокеты, и поток, ждущий ответа, сразу получает ошибку
+    вместо ожидания до конца генерации. Повторов после отмены не бывает.
+    """
+
+    __slots__ = ('cancelled', '_connections', '_lock')
+
+    def __init__(self):
+        self.cancelled = False
+        self._connections: List[Any] = []
+        self._lock = threading.Lock()
+
+    def add(self, connection):
+        with self._lock:
+            self._connections.append(connection)
+            if self.cancelled:
+                self._shutdown(connection)
+
+    def release(self):
+        """Запрос закончен: его соединения вернулись в пул, и отмена их больше не касается"""
+        with self._lock:
+            self._connections.clear()
+
+    def cancel(self):
+        # Под блокировкой: соединение, уже возвращенное в пул (release), закрыто не будет
+        with self._lock:
+            self.cancelled = True
+            for connection in self._connections:
+                self._shutdown(connection)
+
+    @staticmethod
+    def _shutdown(connection):
+        sock = getattr(connection, 'sock', None)
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+# Область отмены запроса, который выполняет текущий поток
+_current = threading.local()
+
+
+class _ScopedPool:
+    """Пул urllib3, который отдает соединение запроса в текущую CancelScope"""
+
+    def _get_conn(self, timeout=None):
+        connection = super()._get_conn(timeout)
+        scope = getattr(_current, 'scope', None)
+        if scope is not None:
+            scope.add(connection)
+        return connection
+
+
+class _ScopedHTTPConnectionPool(_ScopedPool, HTTPConnectionPool):
+    pass
+
+
+class _ScopedHTTPSConnectionPool(_ScopedPool, HTTPSConnectionPool):
+    pass
+
+
+class _CancellableAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _ScopedHTTPConnectionPool,
+                                                   'https': _ScopedHTTPSConnectionPool}
+
+
+class LLMClient:
+    """
+    Клиент chat-completions API (openrouter) с общей HTTP-сессией
+
+    - keep-alive: одно TLS-соединение переиспользуется между запросами
+    - раздельные таймауты на подключение и чтение ответа
+    - повторы на 429/5xx и сетевых ошибках с экспоненциальной задержкой и jitter,
+      с учетом заголовка Retry-After
+    - ограничение числа одновременных запросов (общее для sync и async вызовов)
+    - потоковые ответы (SSE) с досрочной остановкой, когда нужный текст уже получен
+    """
+
+    def __init__(self, api_url: Optional[str] = None, api_key: Optional[str] = None,
+                 model: Optional[str] = None, connect_timeout: float = 5.0, read_timeout: float = 120.0,
+                 max_retries: int = 4, backoff_base: float = 1.0, backoff_max: float = 30.0,
+                 max_concurrency: int = 4):
+        """
+        Args:
+            api_url: URL chat-completions (по умолчанию LLM_API_URL или openrouter)
+            api_key: Ключ API (по умолчанию LLAMA_API_KEY)
+            model: Модель по умолчанию (по умолчанию LLM_MODEL или deepseek)
+            connect_timeout: Таймаут установки соединения, сек
+            read_timeout: Таймаут ожидания ответа, сек
+            max_retries: Сколько раз повторять запрос после первой неудачи
+            backoff_base: Базовая задержка между повторами, сек
+            backoff_max: Максимальная задержка между повторами, сек
+            max_concurrency: Максимум одновременных запросов к API
+        """
+        self.api_url = api_url or os.environ.get('LLM_API_URL', DEFAULT_API_URL)
+        self.api_key = api_key or os.environ['LLAMA_API_KEY']
+        self.model = model or os.environ.get('LLM_MODEL', DEFAULT_MODEL)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        adapter = _CancellableAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        })
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.logger = logging.getLogger(__name__)
+
+    def complete(self, prompt: str, max_tokens: int, model: Optional[str] = None, stream: bool = False,
+                 until: Optional[Callable[[str], bool]] = None, cancel: Optional[CancelScope] = None) -> str:
+        """
+        Отправка одного пользовательского сообщения, возвращает текст ответа модели
+
+        Args:
+            stream: Получать ответ потоком (SSE)
+            until: Для потока - функция от накопленного текста; когда она вернет True,
+                   поток обрывается и возвращается уже полученный текст
+            cancel: Область отмены: после cancel() запрос обрывается с LLMError
+        """
+        payload = {
+            "model": model or self.model,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": max_tokens
+        }
+        if stream:
+            payload["stream"] = True
+        result = self.request(payload, until, cancel)
+        # Токены попадают в span вызывающего этапа (план, SQL, переписывание);
+        # у оборванного потока usage нет, и он не затирает токены другого запроса этого этапа
+        usage = result.get("usage") or {}
+        choice = result["choices"][0]
+        annotate(finish_reason=choice.get("finish_reason"),
+                 **{key: usage[key] for key in ("prompt_tokens", "completion_tokens") if usage.get(key) is not None})
+        return choice["message"]["content"]
+
+    async def acomplete(self, prompt: str, max_tokens: int, model: Optional[str] = None, stream: bool = False,
+                        until: Optional[Callable[[str], bool]] = None) -> str:
+        """Асинхронная версия complete: HTTP-запрос выполняется в пуле потоков"""
+        return await asyncio.to_thread(self.complete, prompt, max_tokens, model, stream, until)
+
+    def request(self, payload: Dict[str, Any], until: Optional[Callable[[str], bool]] = None,
+                cancel: Optional[CancelScope] = None) -> Dict[str, Any]:
+        """Отправка payload в chat-completions с повторами, возвращает JSON ответа (для потока - собранный)"""
+        with span('llm.request', model=payload.get("model"), stream=bool(payload.get("stream"))):
+            return self._request_with_retries(payload, until, cancel)
+
+    def _request_with_retries(self, payload: Dict[str, Any], until: Optional[Callable[[str], bool]] = None,
+                              cancel: Optional[CancelScope] = None) -> Dict[str, Any]:
+        last_error = None
+        stream = bool(payload.get("stream"))
+
+        for attempt in range(self.max_retries + 1):
+            if cancel is not None and cancel.cancelled:
+                raise LLMError("Request to LLM API was cancelled")
+            retry_after = None
+            try:
+                # Слот занят только на время самого запроса: пауза перед повтором его не держит
+                with self._slots:
+                    _current.scope = cancel
+                    try:
+                        response = self.session.post(self.api_url, json=payload, timeout=self.timeout,
+                                                     stream=stream)
+                        result = self._read_response(response, until) if response.status_code == 200 else None
+                    finally:
+                        _current.scope = None
+                        if cancel is not None:
+                            cancel.release()
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                last_error = LLMError(f"Request to LLM API failed: {e}")
+            except LLMError as e:
+                # Битый ответ (обрезанный JSON от прокси) - повторяемая ошибка, как и сетевые
+                last_error = e
+            else:
+                if result is not None:
+                    if result.get("choices"):
+                        return result
+                    # openrouter иногда отдает ошибку провайдера с кодом 200
+                    error = result.get("error") or {}
+                    last_error = LLMError(f"LLM API returned no choices: {error}", error.get("code"))
+                    if error.get("code") not in RETRY_STATUSES:
+                        raise last_error
+                elif response.status_code in RETRY_STATUSES:
+                    last_error = LLMError(f"Request failed with status {response.status_code}",
+                                          response.status_code)
+                    retry_after = self._parse_retry_after(response.headers.get("Retry-After"))
+                    response.close()
+                else:
+                    raise LLMError(f"Request failed with status {response.status_code}: {response.text[:200]}",
+                                   response.status_code)
+
+            # Оборванный отменой запрос не повторяется
+            if cancel is not None and cancel.cancelled:
+                raise LLMError("Request to LLM API was cancelled")
+            if attempt == self.max_retries:
+                break
+
+            delay = retry_after if retry_after is not None else self._backoff(attempt)
+            self.logger.warning(f"{last_error}; retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+            time.sleep(delay)
+
+        raise last_error
+
+    def _read_response(self, response: requests.Response,
+                       until: Optional[Callable[[str], bool]]) -> Dict[str, Any]:
+        """JSON ответа; поток SSE собирается в ответ того же вида"""
+        if not response.headers.get("Content-Type", "").startswith("text/event-stream"):
+            try:
+                return response.json()
+            except ValueError as e:
+                raise LLMError(f"LLM API returned malformed JSON: {e}", response.status_code)
+
+        content, finish_reason, usage, error = '', None, None, None
+        try:
+            for line in response.iter_lines(chunk_size=None):
+                # Пустые строки разделяют события, строки с ':' - комментарии (keep-alive openrouter)
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                try:
+                    event = json.loads(data)
+                except ValueError as e:
+                    raise LLMError(f"LLM API returned a malformed stream event: {e}", response.status_code)
+                if event.get("error"):
+                    error = event["error"]
+                    break
+                usage = event.get("usage") or usage
+                for choice in event.get("choices") or ():
+                    content += (choice.get("delta") or {}).get("content") or ''
+                    finish_reason = choice.get("finish_reason") or finish_reason
+                if until is not None and content and until(content):
+                    # Остаток ответа не нужен: закрытие соединения останавливает генерацию
+                    finish_reason = 'cancelled'
+                    break
+        finally:
+            response.close()
+
+        if error is not None and not content:
+            return {"error": error}
+        return {"choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+                "usage": usage}
+
+    def _backoff(self, attempt: int) -> float:
+        """Экспоненциальная задержка с полным jitter"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _parse_retry_after(self, value: Optional[str]) -> Optional[float]:
+        """Retry-After бывает числом секунд или HTTP-датой"""
+        if not value:
+            return None
+
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+
+        return min(max(seconds, 0.0), self.backoff_max)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    """
+    Общий на процесс клиент LLM
+
+    Создается при первом обращении, чтобы переменные окружения из .env
+    (load_dotenv в main.py) уже были загружены.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LLMClient()
+        return _client
+
+
+def configure_llm_client(**kwargs) -> LLMClient:
+    """Замена общего клиента на клиент с другими параметрами (см. LLMClient)"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = LLMClient(**kwargs)
+        return _client
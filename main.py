@@ -1,31 +1,62 @@
-from auth import authentication
-from smart_line import execute_prompt
+from client import ServiceClient, ServiceError
 from dotenv import load_dotenv
 
 load_dotenv()
 
-db_config = {
-    'host': 'localhost',
-    'port': 5434,
-    'database': 'task_db',
-    'user': 'postgres',
-    'password': 'postgres'
-}
+FILE_FORMATS = ('csv', 'parquet', 'arrow')
 
-if __name__ == "__main__":
-    user = authentication(db_config)
 
-    prompt = input(f'Какую информации хотели бы получить, {user.first_name} {user.last_name}?')
+def authentication(client: ServiceClient):
+    print("Идентифицируйте себя, введя: имя, фамилию, email и username")
+
+    first_name = input("Имя: ").strip()
+    last_name = input("Фамилия: ").strip()
+    email = input("Email: ").strip()
+    username = input("Username: ").strip()
 
-    file_or_console = input("Куда вам надо поместить полученные данные: в csv-файл или вывести в консоль?\nВведите: 'csv' или 'консоль'")
-    while file_or_console != 'csv' and file_or_console != 'консоль':
-        file_or_console = input("Введите: 'csv' или 'консоль'")
+    try:
+        return client.authenticate(first_name, last_name, email, username)
+    except ServiceError as e:
+        print(f"Проверьте данные ({e})")
+        return None
 
 
-    if file_or_console == 'csv':
-        output_file = input('Введите, куда сохранять?')
-        execute_prompt(prompt, user, output_file)
-    else:
-        execute_prompt(prompt, user)
+def print_page(page: dict):
+    if not page['row_count']:
+        print("Ничего не нашлось")
+        return
+    print(page['rows'])
+    if page['next']:
+        print(f"Показаны первые {page['row_count']} строк")
 
 
+# Вся работа идет в долгоживущем сервисе (python service.py), здесь только ввод и вывод
+if __name__ == "__main__":
+    client = ServiceClient()
+    user = authentication(client)
+    if user is None:
+        raise SystemExit(1)
+
+    prompt = input(f"Какую информации хотели бы получить, {user['first_name']} {user['last_name']}?")
+
+    file_or_console = input("Куда вам надо поместить полученные данные: в файл (csv, parquet, arrow) или вывести в консоль?\n"
+                            "Введите: 'csv', 'parquet', 'arrow' или 'консоль'")
+    while file_or_console not in FILE_FORMATS and file_or_console != 'консоль':
+        file_or_console = input("Введите: 'csv', 'parquet', 'arrow' или 'консоль'")
+
+    try:
+        if file_or_console in FILE_FORMATS:
+            output_file = input('Введите, куда сохранять?')
+            if not client.ask_file(prompt, output_file, file_or_console):
+                print("Ничего не нашлось")
+        else:
+            page = client.ask(prompt)
+            print(f"Путь генерации SQL: {page['path']}")
+            print_page(page)
+            while page['next'] and input("Показать следующую страницу? (да/нет) ").strip().lower() == 'да':
+                page = client.next_page(page['next'])
+                print_page(page)
+    except ServiceError as e:
+        print(f"Ошибка сервиса: {e}")
+    finally:
+        client.logout()
@@ -0,0 +1,26 @@
+-- Уведомления об изменении таблиц для кэша результатов (result_cache.py, режим 'notify').
+-- После каждой завершенной транзакции, менявшей таблицу, в канал table_changes
+-- приходит имя таблицы; кэш сбрасывает все результаты, читавшие ее.
+--
+-- Применение: psql -d task_db -f migrations/001_table_change_notify.sql
+
+CREATE OR REPLACE FUNCTION notify_table_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('table_changes', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    table_name text;
+BEGIN
+    FOREACH table_name IN ARRAY ARRAY['companies', 'departments', 'users', 'tasks', 'task_dependencies', 'task_history']
+    LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS notify_table_change ON %I', table_name);
+        EXECUTE format('CREATE TRIGGER notify_table_change
+                            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I
+                            FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change()', table_name);
+    END LOOP;
+END;
+$$;
@@ -0,0 +1,55 @@
+-- Индексы под соединения и фильтры, которые чаще всего встречаются в сгенерированных запросах.
+-- Изначально в схеме проиндексированы только первичные ключи и UNIQUE-ограничения.
+--
+-- CONCURRENTLY не блокирует запись в таблицы, но не работает внутри транзакции:
+-- применять без -1/--single-transaction:  psql -d task_db -f migrations/002_fk_indexes.sql
+
+-- "мои задачи", "мои задачи в работе", "просроченные" - исполнитель, статус, срок
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tasks_assigned_user_status_due_idx
+    ON tasks (assigned_user_id, status, due_date);
+
+-- задачи отдела по статусам и срокам
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tasks_assigned_department_status_due_idx
+    ON tasks (assigned_department_id, status, due_date);
+
+-- "задачи, которые я создал за период"
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tasks_created_by_user_created_at_idx
+    ON tasks (created_by_user_id, created_at);
+
+-- просроченные незакрытые задачи по всей компании
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tasks_open_due_date_idx
+    ON tasks (due_date) WHERE status NOT IN ('completed', 'cancelled');
+
+-- водяной знак кэша результатов (max(updated_at))
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tasks_updated_at_idx
+    ON tasks (updated_at);
+
+-- история конкретной задачи в хронологическом порядке
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_history_task_changed_at_idx
+    ON task_history (task_id, changed_at);
+
+-- "кто что менял за период"
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_history_changed_by_changed_at_idx
+    ON task_history (changed_by_user_id, changed_at);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_history_changed_at_idx
+    ON task_history (changed_at);
+
+-- обратное направление зависимостей: (task_id_1, task_id_2) уже покрыт UNIQUE-ограничением
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_dependencies_task_id_2_idx
+    ON task_dependencies (task_id_2);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_department_id_idx
+    ON users (department_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS departments_parent_department_id_idx
+    ON departments (parent_department_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS departments_company_id_idx
+    ON departments (company_id);
+
+ANALYZE tasks;
+ANALYZE task_history;
+ANALYZE task_dependencies;
+ANALYZE users;
+ANALYZE departments;
@@ -0,0 +1,97 @@
+-- Таблица замыкания иерархии отделов: для каждого отдела - все его предки и он сам.
+-- Вопросы вида "все задачи моего подразделения со всеми вложенными отделами"
+-- превращаются в один JOIN по индексу вместо рекурсивного CTE по departments.
+--
+--   department_closure(ancestor_id, descendant_id, depth)
+--   depth = 0 - сам отдел, 1 - прямой подчиненный, 2 - подчиненный подчиненного, ...
+--
+-- Триггеры на departments поддерживают таблицу при вставке и переносе отдела
+-- (смене parent_department_id); удаление отрабатывает ON DELETE CASCADE.
+--
+-- Применение: psql -d task_db -f migrations/003_department_closure.sql
+
+CREATE TABLE IF NOT EXISTS department_closure (
+    ancestor_id   integer NOT NULL REFERENCES departments (id) ON DELETE CASCADE,
+    descendant_id integer NOT NULL REFERENCES departments (id) ON DELETE CASCADE,
+    depth         integer NOT NULL,
+    PRIMARY KEY (ancestor_id, descendant_id)
+);
+
+-- путь от отдела к корню: WHERE descendant_id = X ORDER BY depth
+CREATE INDEX IF NOT EXISTS department_closure_descendant_depth_idx
+    ON department_closure (descendant_id, depth);
+
+CREATE OR REPLACE FUNCTION department_closure_insert() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO department_closure (ancestor_id, descendant_id, depth)
+    SELECT NEW.id, NEW.id, 0
+    UNION ALL
+    SELECT ancestor_id, NEW.id, depth + 1
+    FROM department_closure
+    WHERE descendant_id = NEW.parent_department_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION department_closure_move() RETURNS trigger AS $$
+BEGIN
+    IF NEW.parent_department_id IS NOT NULL AND EXISTS (
+        SELECT 1 FROM department_closure WHERE ancestor_id = NEW.id AND descendant_id = NEW.parent_department_id
+    ) THEN
+        RAISE EXCEPTION 'department % cannot be moved under its own subdepartment %', NEW.id, NEW.parent_department_id;
+    END IF;
+
+    -- Поддерево отрывается от прежних предков...
+    DELETE FROM department_closure c
+    USING department_closure subtree, department_closure old_ancestors
+    WHERE subtree.ancestor_id = NEW.id
+      AND old_ancestors.descendant_id = NEW.id AND old_ancestors.ancestor_id <> NEW.id
+      AND c.ancestor_id = old_ancestors.ancestor_id AND c.descendant_id = subtree.descendant_id;
+
+    -- ...и подвешивается к предкам нового родителя
+    INSERT INTO department_closure (ancestor_id, descendant_id, depth)
+    SELECT new_ancestors.ancestor_id, subtree.descendant_id, new_ancestors.depth + subtree.depth + 1
+    FROM department_closure new_ancestors, department_closure subtree
+    WHERE new_ancestors.descendant_id = NEW.parent_department_id AND subtree.ancestor_id = NEW.id;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS department_closure_insert ON departments;
+CREATE TRIGGER department_closure_insert
+    AFTER INSERT ON departments
+    FOR EACH ROW EXECUTE FUNCTION department_closure_insert();
+
+DROP TRIGGER IF EXISTS department_closure_move ON departments;
+CREATE TRIGGER department_closure_move
+    AFTER UPDATE OF parent_department_id ON departments
+    FOR EACH ROW WHEN (OLD.parent_department_id IS DISTINCT FROM NEW.parent_department_id)
+    EXECUTE FUNCTION department_closure_move();
+
+-- Заполнение по уже существующим отделам
+INSERT INTO department_closure (ancestor_id, descendant_id, depth)
+WITH RECURSIVE tree AS (
+    SELECT id AS ancestor_id, id AS descendant_id, 0 AS depth
+    FROM departments
+    UNION ALL
+    SELECT tree.ancestor_id, d.id, tree.depth + 1
+    FROM tree
+    JOIN departments d ON d.parent_department_id = tree.descendant_id
+)
+SELECT ancestor_id, descendant_id, depth FROM tree
+ON CONFLICT (ancestor_id, descendant_id) DO NOTHING;
+
+-- Кэш результатов (migrations/001_table_change_notify.sql) должен видеть и эту таблицу
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'notify_table_change') THEN
+        DROP TRIGGER IF EXISTS notify_table_change ON department_closure;
+        CREATE TRIGGER notify_table_change
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON department_closure
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change();
+    END IF;
+END;
+$$;
+
+ANALYZE department_closure;
@@ -0,0 +1,81 @@
+-- Агрегаты по task_history, которые поддерживает rollups.py (RollupPipeline).
+-- Аналитические вопросы (время цикла, время в статусах, кто что менял за период)
+-- читают эти таблицы вместо полного прохода по истории.
+--
+--   task_status_intervals        - сколько задача провела в каждом статусе (ended_at IS NULL - текущий статус)
+--   task_activity_daily_user     - изменения по дням, сотрудникам и полям
+--   task_activity_daily_department - то же по отделам, на которые назначены задачи
+--   rollup_watermarks            - до какого task_history.id история уже обработана
+--
+-- Применение: psql -d task_db -f migrations/004_task_history_rollups.sql
+-- Заполнение: python rollups.py --rebuild
+
+CREATE TABLE IF NOT EXISTS rollup_watermarks (
+    name       varchar(100) PRIMARY KEY,
+    last_id    bigint NOT NULL DEFAULT 0,
+    updated_at timestamp DEFAULT now()
+);
+
+INSERT INTO rollup_watermarks (name) VALUES ('task_history') ON CONFLICT (name) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS task_status_intervals (
+    id                 bigserial PRIMARY KEY,
+    task_id            integer NOT NULL,
+    status             varchar(30),
+    started_at         timestamp NOT NULL,
+    ended_at           timestamp,
+    duration_hours     double precision GENERATED ALWAYS AS (extract(epoch FROM ended_at - started_at) / 3600) STORED,
+    changed_by_user_id integer,
+    history_id         integer
+);
+
+CREATE INDEX IF NOT EXISTS task_status_intervals_task_started_idx
+    ON task_status_intervals (task_id, started_at);
+
+CREATE INDEX IF NOT EXISTS task_status_intervals_status_started_idx
+    ON task_status_intervals (status, started_at);
+
+CREATE INDEX IF NOT EXISTS task_status_intervals_open_idx
+    ON task_status_intervals (task_id) WHERE ended_at IS NULL;
+
+CREATE TABLE IF NOT EXISTS task_activity_daily_user (
+    day             date NOT NULL,
+    user_id         integer NOT NULL,
+    field_name      varchar(100) NOT NULL,
+    changes         bigint NOT NULL,
+    tasks_completed bigint NOT NULL,
+    PRIMARY KEY (day, user_id, field_name)
+);
+
+CREATE INDEX IF NOT EXISTS task_activity_daily_user_user_day_idx
+    ON task_activity_daily_user (user_id, day);
+
+CREATE TABLE IF NOT EXISTS task_activity_daily_department (
+    day             date NOT NULL,
+    department_id   integer NOT NULL,
+    field_name      varchar(100) NOT NULL,
+    changes         bigint NOT NULL,
+    tasks_completed bigint NOT NULL,
+    PRIMARY KEY (day, department_id, field_name)
+);
+
+CREATE INDEX IF NOT EXISTS task_activity_daily_department_department_day_idx
+    ON task_activity_daily_department (department_id, day);
+
+-- Кэш результатов (migrations/001_table_change_notify.sql) должен видеть и эти таблицы
+DO $$
+DECLARE
+    table_name text;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'notify_table_change') THEN
+        FOREACH table_name IN ARRAY ARRAY['task_status_intervals', 'task_activity_daily_user',
+                                          'task_activity_daily_department']
+        LOOP
+            EXECUTE format('DROP TRIGGER IF EXISTS notify_table_change ON %I', table_name);
+            EXECUTE format('CREATE TRIGGER notify_table_change
+                                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I
+                                FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change()', table_name);
+        END LOOP;
+    END IF;
+END;
+$$;
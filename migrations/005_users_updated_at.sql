@@ -0,0 +1,18 @@
+-- users.updated_at обновляется при каждом изменении строки.
+-- Справочник пользователей в памяти (auth.py, UserDirectory) сверяет max(updated_at)
+-- и дочитывает только измененные строки, поэтому колонка должна быть честной:
+-- без триггера у нее есть только значение по умолчанию при вставке.
+--
+-- Применение: psql -d task_db -f migrations/005_users_updated_at.sql
+
+CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS touch_updated_at ON users;
+CREATE TRIGGER touch_updated_at
+    BEFORE UPDATE ON users
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
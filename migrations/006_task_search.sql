@@ -0,0 +1,54 @@
+-- Полнотекстовый поиск по задачам: GIN-индекс по выражению task_search_vector(title, description)
+-- (title с весом A, description - B, в русской и английской конфигурациях) и функция search_tasks
+-- с ранжированием. Вопросы "задачи про миграцию" становятся поиском по индексу вместо
+-- ILIKE '%...%', который читает всю таблицу.
+-- Вектор не хранится в tasks: иначе большая колонка tsvector попадала бы в каждый SELECT *
+-- и в выгрузки CSV/Parquet. Индекс по выражению обновляется вместе со строкой, без триггера.
+--
+-- Применение: psql -d task_db -f migrations/006_task_search.sql
+-- Для поиска по подстроке (ILIKE) есть необязательные триграммные индексы:
+--   migrations/optional/task_search_trgm.sql
+
+-- При LC_CTYPE=C Postgres не приводит кириллицу к нижнему регистру, и "Миграция"
+-- не находится по слову "миграция": тогда регистр сводится через колляцию C.utf8
+DO $fold$
+BEGIN
+    IF (SELECT datctype FROM pg_database WHERE datname = current_database()) IN ('C', 'POSIX')
+       AND EXISTS (SELECT 1 FROM pg_collation WHERE collname = 'C.utf8') THEN
+        CREATE OR REPLACE FUNCTION task_search_fold(value text) RETURNS text
+            AS 'SELECT lower(value COLLATE "C.utf8")' LANGUAGE sql IMMUTABLE;
+    ELSE
+        CREATE OR REPLACE FUNCTION task_search_fold(value text) RETURNS text
+            AS 'SELECT value' LANGUAGE sql IMMUTABLE;
+    END IF;
+END
+$fold$;
+
+CREATE OR REPLACE FUNCTION task_search_vector(title text, description text) RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('russian', task_search_fold(coalesce(title, ''))), 'A')
+        || setweight(to_tsvector('english', task_search_fold(coalesce(title, ''))), 'A')
+        || setweight(to_tsvector('russian', task_search_fold(coalesce(description, ''))), 'B')
+        || setweight(to_tsvector('english', task_search_fold(coalesce(description, ''))), 'B')
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Прежний вариант этой миграции хранил вектор в колонке tasks.search_vector: она убирается
+DROP TRIGGER IF EXISTS update_task_search_vector ON tasks;
+DROP FUNCTION IF EXISTS update_task_search_vector();
+ALTER TABLE tasks DROP COLUMN IF EXISTS search_vector;
+
+-- Если task_search_fold поменялась (например, после смены LC_CTYPE), индекс надо перестроить:
+--   REINDEX INDEX tasks_search_idx;
+CREATE INDEX IF NOT EXISTS tasks_search_idx ON tasks USING gin (task_search_vector(title, description));
+
+-- Задачи, подходящие под запрос, и их релевантность. terms - слова в синтаксисе
+-- websearch_to_tsquery: "точная фраза", or, -исключение; слова приводятся к основе
+-- (миграцию -> миграц), поэтому находятся любые их формы.
+-- Функция встраивается в вызывающий запрос, и условие @@ идет по GIN-индексу:
+--   SELECT t.* FROM search_tasks('миграция') s JOIN tasks t ON t.id = s.task_id ORDER BY s.rank DESC
+CREATE OR REPLACE FUNCTION search_tasks(terms text) RETURNS TABLE (task_id integer, rank real) AS $$
+    SELECT t.id, ts_rank(task_search_vector(t.title, t.description), q.query)
+    FROM tasks t,
+         (SELECT websearch_to_tsquery('russian', task_search_fold(terms))
+                 || websearch_to_tsquery('english', task_search_fold(terms)) AS query) q
+    WHERE task_search_vector(t.title, t.description) @@ q.query
+$$ LANGUAGE sql STABLE;
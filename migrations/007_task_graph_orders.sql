@@ -0,0 +1,18 @@
+-- Порядок выполнения задач, посчитанный графом зависимостей (task_graph.py), для постраничного вывода.
+-- Порядок записывается один раз на вопрос, и страницы читаются по (order_key, position)
+-- вместо того, чтобы передавать весь список задач массивом в каждом запросе страницы.
+-- Таблица служебная: строки старше часа удаляет сам TaskGraph при следующей записи.
+-- UNLOGGED - после сбоя сервера содержимое теряется, и порядок просто считается заново;
+-- на репликах такие таблицы не читаются, поэтому запросы к ней всегда идут на основную БД.
+--
+-- Применение: psql -d task_db -f migrations/007_task_graph_orders.sql
+
+CREATE UNLOGGED TABLE IF NOT EXISTS task_graph_orders (
+    order_key  varchar(64) NOT NULL,
+    position   integer NOT NULL,
+    task_id    integer NOT NULL,
+    created_at timestamp NOT NULL DEFAULT now(),
+    PRIMARY KEY (order_key, position)
+);
+
+CREATE INDEX IF NOT EXISTS task_graph_orders_created_at_idx ON task_graph_orders (created_at);
@@ -0,0 +1,17 @@
+-- Водяной знак агрегатов (rollups.py) не обгоняет незавершенные транзакции.
+-- id в task_history выдаются последовательностью, но фиксируются не по порядку:
+-- строка с меньшим id может появиться после того, как строки с большими id уже обработаны,
+-- и без этой миграции она пропускалась бы навсегда.
+--
+--   safe_id       - до какого id все транзакции, писавшие историю, уже завершены
+--   frontier_id   - max(id) на момент снимка, который еще ждет завершения транзакций
+--   frontier_xmax - xmax того снимка: когда все транзакции с меньшим xid завершатся, frontier_id станет safe_id
+--
+-- Применение: psql -d task_db -f migrations/008_rollup_frontier.sql
+
+ALTER TABLE rollup_watermarks ADD COLUMN IF NOT EXISTS safe_id bigint NOT NULL DEFAULT 0;
+ALTER TABLE rollup_watermarks ADD COLUMN IF NOT EXISTS frontier_id bigint;
+ALTER TABLE rollup_watermarks ADD COLUMN IF NOT EXISTS frontier_xmax bigint;
+
+-- Уже обработанная история считается безопасной
+UPDATE rollup_watermarks SET safe_id = last_id WHERE safe_id < last_id;
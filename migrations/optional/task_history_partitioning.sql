@@ -0,0 +1,78 @@
+-- Необязательная миграция: секционирование task_history по месяцам changed_at.
+-- Запросы за период читают только нужные секции, старые месяцы можно отсоединить
+-- (ALTER TABLE task_history DETACH PARTITION ...) и хранить или удалять отдельно.
+-- id и последовательность сохраняются, поэтому водяной знак rollups.py продолжает работать.
+--
+-- Таблица переписывается целиком под эксклюзивной блокировкой - применять в окно обслуживания:
+--   psql -d task_db -1 -f migrations/optional/task_history_partitioning.sql
+-- Секции на будущее создаются заранее (например, раз в месяц по расписанию):
+--   SELECT create_task_history_partitions(date_trunc('month', now())::date, 3);
+
+LOCK TABLE task_history IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE task_history RENAME TO task_history_unpartitioned;
+
+CREATE TABLE task_history (
+    id                 integer NOT NULL DEFAULT nextval('task_history_id_seq'),
+    task_id            integer REFERENCES tasks (id),
+    changed_by_user_id integer REFERENCES users (id),
+    field_name         varchar(100),
+    old_value          text,
+    new_value          text,
+    changed_at         timestamp NOT NULL DEFAULT now(),
+    PRIMARY KEY (id, changed_at)
+) PARTITION BY RANGE (changed_at);
+
+ALTER SEQUENCE task_history_id_seq OWNED BY task_history.id;
+
+CREATE OR REPLACE FUNCTION create_task_history_partitions(from_month date, months integer) RETURNS void AS $$
+DECLARE
+    month_start date;
+BEGIN
+    FOR i IN 0 .. months - 1 LOOP
+        month_start := (date_trunc('month', from_month) + make_interval(months => i))::date;
+        EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF task_history FOR VALUES FROM (%L) TO (%L)',
+                       'task_history_' || to_char(month_start, 'YYYY_MM'),
+                       month_start, (month_start + interval '1 month')::date);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Секции от самой старой записи до трех месяцев вперед; все, что не попало, - в секцию по умолчанию
+DO $$
+DECLARE
+    first_month date := date_trunc('month', COALESCE((SELECT min(changed_at) FROM task_history_unpartitioned), now()));
+BEGIN
+    PERFORM create_task_history_partitions(
+        first_month,
+        ((extract(year FROM age(date_trunc('month', now()), first_month)) * 12
+          + extract(month FROM age(date_trunc('month', now()), first_month)))::integer + 4)
+    );
+END;
+$$;
+
+CREATE TABLE IF NOT EXISTS task_history_default PARTITION OF task_history DEFAULT;
+
+INSERT INTO task_history (id, task_id, changed_by_user_id, field_name, old_value, new_value, changed_at)
+SELECT id, task_id, changed_by_user_id, field_name, old_value, new_value, COALESCE(changed_at, now())
+FROM task_history_unpartitioned;
+
+DROP TABLE task_history_unpartitioned;
+
+-- Индексы из migrations/002_fk_indexes.sql, теперь на каждой секции
+CREATE INDEX IF NOT EXISTS task_history_task_changed_at_idx ON task_history (task_id, changed_at);
+CREATE INDEX IF NOT EXISTS task_history_changed_by_changed_at_idx ON task_history (changed_by_user_id, changed_at);
+CREATE INDEX IF NOT EXISTS task_history_changed_at_idx ON task_history (changed_at);
+
+-- Триггер кэша результатов из migrations/001_table_change_notify.sql
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'notify_table_change') THEN
+        CREATE TRIGGER notify_table_change
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON task_history
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change();
+    END IF;
+END;
+$$;
+
+ANALYZE task_history;
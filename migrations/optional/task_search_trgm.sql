@@ -0,0 +1,14 @@
+-- Необязательная миграция: триграммные индексы по tasks.title и tasks.description.
+-- Полнотекстовый поиск (migrations/006_task_search.sql) находит слова и их формы;
+-- для подстрок (ILIKE '%счет-фактур%', части артикулов и кодов) нужны триграммы,
+-- иначе ILIKE с % в начале читает всю таблицу. Индексы заметно больше обычных и
+-- замедляют запись, поэтому ставятся только там, где такие запросы действительно идут.
+--
+-- Нужно расширение pg_trgm (пакет postgresql-contrib) и права на CREATE EXTENSION.
+-- Индексы строятся без блокировки записи, поэтому файл применяется вне транзакции:
+--   psql -d task_db -f migrations/optional/task_search_trgm.sql
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tasks_title_trgm_idx ON tasks USING gin (title gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tasks_description_trgm_idx ON tasks USING gin (description gin_trgm_ops);
@@ -0,0 +1,272 @@
+import contextvars
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, Dict, Any, List, Tuple, Callable
+
+from llm_client import LLMClient, LLMError, CancelScope, get_llm_client, DEFAULT_MODEL
+from tracing import annotate
+
+
+class ModelStats:
+    """Задержки и ошибки одной модели"""
+
+    __slots__ = ('name', 'url', 'durations', 'calls', 'errors', 'wins', 'consecutive_failures', 'ejected_until')
+
+    def __init__(self, name: str, url: Optional[str], window: int):
+        self.name = name
+        self.url = url
+        self.durations = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.wins = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    def p95(self) -> Optional[float]:
+        if not self.durations:
+            return None
+        ordered = sorted(self.durations)
+        return ordered[max(1, math.ceil(0.95 * len(ordered))) - 1]
+
+
+class ModelRouter:
+    """
+    Вызов LLM через упорядоченный список моделей с хеджированием и отключением сбойных
+
+    Запрос уходит первой доступной модели. Если ответа нет дольше p95 ее
+    задержки (пока замеров мало - hedge_delay), параллельно запрашивается
+    следующая модель; побеждает первый годный ответ, а соединение второго
+    запроса закрывается - и потока, и еще не начавшегося ответа.
+    Ошибка или негодный ответ сразу передают запрос следующей модели. Модель,
+    не справившаяся eject_after раз подряд, исключается на eject_seconds.
+    """
+
+    def __init__(self, models: List[Tuple[str, Optional[str]]], hedge_delay: float = 5.0,
+                 min_hedge_delay: float = 0.5, min_samples: int = 5, eject_after: int = 3,
+                 eject_seconds: float = 30.0, window: int = 200, max_retries: int = 1, max_workers: int = 16):
+        """
+        Args:
+            models: Пары (модель, URL chat-completions) по приоритету; URL None - общий клиент get_llm_client()
+            hedge_delay: Задержка перед хеджированием, пока у модели меньше min_samples замеров, сек
+            min_hedge_delay: Нижняя граница задержки перед хеджированием, сек
+            min_samples: Сколько замеров нужно, чтобы доверять p95 модели
+            eject_after: После скольких неудач подряд модель исключается
+            eject_seconds: На сколько исключается модель, сек
+            window: Сколько последних задержек модели хранить
+            max_retries: Повторов внутри клиента для отдельных URL (дальше выручает следующая модель)
+            max_workers: Потоков для параллельных запросов
+        """
+        if not models:
+            raise ValueError("ModelRouter needs at least one model")
+        self.models = [ModelStats(name, url, window) for name, url in models]
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.max_retries = max_retries
+
+        self._clients: Dict[str, LLMClient] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-route')
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def complete(self, prompt: str, max_tokens: int, stream: bool = False,
+                 until_factory: Optional[Callable[[], Callable[[str], bool]]] = None,
+                 valid: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        Текст первого годного ответа (prompt, max_tokens и stream - как у LLMClient.complete)
+
+        Args:
+            until_factory: Создает для каждого запроса свою функцию until (например, SqlStreamParser)
+            valid: Проверка ответа (например, что в нем есть SQL); негодный ответ считается ошибкой модели
+        """
+        candidates = iter(self._candidates())
+        cancelled = threading.Event()
+        pending: Dict[Any, ModelStats] = {}
+        scopes: Dict[Any, CancelScope] = {}
+        hedged = False
+        last_error: Optional[Exception] = None
+
+        def launch() -> bool:
+            model = next(candidates, None)
+            if model is None:
+                return False
+            scope = CancelScope()
+            # Контекст трассировки переносится в поток, чтобы токены попали в span вызывающего этапа
+            future = self._executor.submit(contextvars.copy_context().run, self._attempt, model, prompt,
+                                           max_tokens, stream, until_factory, valid, cancelled, scope)
+            pending[future] = model
+            scopes[future] = scope
+            return True
+
+        launch()
+        while pending:
+            timeout = None
+            if not hedged and len(pending) == 1:
+                timeout = self._hedge_delay(next(iter(pending.values())))
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # Хеджирование - один раз: если моделей больше нет, дальше просто ждем
+                launch()
+                hedged = True
+                continue
+
+            for future in done:
+                model = pending.pop(future)
+                try:
+                    text = future.result()
+                except (LLMError, ValueError) as e:
+                    last_error = e
+                    self.logger.warning(f"Model {model.name} failed: {e}")
+                    continue
+                # Победитель найден: соединения остальных запросов закрываются, не дожидаясь ответа
+                cancelled.set()
+                for loser in pending:
+                    scopes[loser].cancel()
+                with self._lock:
+                    model.wins += 1
+                annotate(model=model.name, hedged=hedged)
+                return text
+
+            # Следующая модель подключается сразу после ошибки, не дожидаясь задержки хеджирования
+            if len(pending) < 2:
+                launch()
+
+        raise LLMError(f"All models failed, last error: {last_error}",
+                       getattr(last_error, 'status_code', None))
+
+    def _attempt(self, model: ModelStats, prompt: str, max_tokens: int, stream: bool,
+                 until_factory: Optional[Callable[[], Callable[[str], bool]]],
+                 valid: Optional[Callable[[str], bool]], cancelled: threading.Event, scope: CancelScope) -> str:
+        until = until_factory() if until_factory is not None else None
+
+        def stop(text: str) -> bool:
+            return cancelled.is_set() or (until is not None and until(text))
+
+        started = time.monotonic()
+        with self._lock:
+            model.calls += 1
+        try:
+            text = self._client(model).complete(prompt, max_tokens, model=model.name, stream=stream, until=stop,
+                                                cancel=scope)
+            if not text or (valid is not None and not valid(text)):
+                raise LLMError(f"Model {model.name} returned an unusable answer")
+        except (LLMError, ValueError):
+            if not cancelled.is_set():
+                self._record_failure(model)
+            raise
+
+        if not cancelled.is_set():
+            self._record_success(model, time.monotonic() - started)
+        return text
+
+    def _client(self, model: ModelStats) -> LLMClient:
+        if model.url is None:
+            return get_llm_client()
+        with self._lock:
+            if model.url not in self._clients:
+                # Ключ API общий с основным клиентом
+                self._clients[model.url] = LLMClient(api_url=model.url, api_key=get_llm_client().api_key,
+                                                     max_retries=self.max_retries)
+            return self._clients[model.url]
+
+    def _candidates(self) -> List[ModelStats]:
+        '''
+            доступные модели в порядке приоритета; если исключены все - та, что вернется раньше других
+        '''
+        now = time.monotonic()
+        with self._lock:
+            available = [model for model in self.models if model.ejected_until <= now]
+            if not available:
+                available = [min(self.models, key=lambda model: model.ejected_until)]
+        return available
+
+    def _hedge_delay(self, model: ModelStats) -> float:
+        with self._lock:
+            p95 = model.p95() if len(model.durations) >= self.min_samples else None
+        return max(self.min_hedge_delay, p95 if p95 is not None else self.hedge_delay)
+
+    def _record_success(self, model: ModelStats, seconds: float):
+        with self._lock:
+            model.durations.append(seconds)
+            model.consecutive_failures = 0
+
+    def _record_failure(self, model: ModelStats):
+        with self._lock:
+            model.errors += 1
+            model.consecutive_failures += 1
+            if model.consecutive_failures >= self.eject_after:
+                model.ejected_until = time.monotonic() + self.eject_seconds
+                model.consecutive_failures = 0
+                self.logger.warning(f"Model {model.name} ejected for {self.eject_seconds:.0f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {model.name: {'calls': model.calls, 'errors': model.errors, 'wins': model.wins,
+                                 'p95_ms': round(model.p95() * 1000, 1) if model.durations else None,
+                                 'ejected': model.ejected_until > now}
+                    for model in self.models}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        for client in self._clients.values():
+            client.close()
+
+
+def parse_models(value: str) -> List[Tuple[str, Optional[str]]]:
+    '''
+        список моделей из строки "модель,модель=URL,...": без URL модель идет через общий клиент
+    '''
+    models = []
+    for item in value.split(','):
+        name, _, url = item.strip().partition('=')
+        if name:
+            models.append((name.strip(), url.strip() or None))
+    return models
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def _router_from_env() -> ModelRouter:
+    models = parse_models(os.environ.get('LLM_MODELS', ''))
+    if not models:
+        models = [(os.environ.get('LLM_MODEL', DEFAULT_MODEL), None)]
+    return ModelRouter(
+        models,
+        hedge_delay=float(os.environ.get('LLM_HEDGE_DELAY', 5.0)),
+        eject_after=int(os.environ.get('LLM_EJECT_AFTER', 3)),
+        eject_seconds=float(os.environ.get('LLM_EJECT_SECONDS', 30.0)),
+    )
+
+
+def get_model_router() -> ModelRouter:
+    """
+    Общий на процесс маршрутизатор моделей (LLM_MODELS, по умолчанию одна модель LLM_MODEL)
+
+    Создается при первом обращении, как и get_llm_client().
+    """
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = _router_from_env()
+        return _router
+
+
+def configure_model_router(models: List[Tuple[str, Optional[str]]], **kwargs) -> ModelRouter:
+    """Замена общего маршрутизатора (параметры см. ModelRouter)"""
+    global _router
+    with _router_lock:
+        if _router is not None:
+            _router.close()
+        _router = ModelRouter(models, **kwargs)
+        return _router
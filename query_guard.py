@@ -0,0 +1,265 @@
+import base64
+import json
+import re
+from typing import Optional, Dict, Any, List
+
+from psycopg2.extras import RealDictCursor
+
+from database import DatabaseManager, is_read_only
+
+
+# Функции, возвращающие несколько строк: с ними id в результате может повторяться
+SET_RETURNING_FUNCTIONS = re.compile(
+    r'\b(unnest|generate_series|generate_subscripts|regexp_matches|regexp_split_to_table|string_to_table|'
+    r'jsonb?_array_elements\w*|jsonb?_each\w*|jsonb?_object_keys|jsonb?_to_recordset|jsonb?_populate_recordset|'
+    r'jsonb_path_query)\s*\(', re.I
+)
+
+# Источник запроса - одна таблица с необязательным псевдонимом (FROM tasks t)
+SINGLE_TABLE = re.compile(r'(\w+\.)?\w+(\s+(as\s+)?\w+)?', re.I)
+
+# Конец списка FROM у внешнего запроса
+FROM_END = r'(where|group\s+by|having|window|order\s+by|limit|offset|fetch|for)\b'
+
+# Колонка таблицы уникальна и не NULL: есть уникальный индекс без условия ровно по ней
+UNIQUE_COLUMN_QUERY = '''
+    SELECT EXISTS (
+        SELECT 1
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = %s AND i.indkey[0] = %s AND i.indnkeyatts = 1
+          AND i.indisunique AND i.indpred IS NULL AND a.attnotnull
+    ) AS is_unique
+'''
+
+# OID типов без сортировки (json, xml, геометрия): по таким колонкам порядок страниц не задать
+UNORDERABLE_TYPES = {114, 142, 600, 601, 602, 603, 604, 628, 718}
+
+
+class QueryRejected(Exception):
+    """Сгенерированный запрос не прошел проверку (запись в БД или слишком дорогой план)"""
+
+    def __init__(self, reason: str, plan: Optional[Dict[str, Any]] = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.plan = plan
+
+
+class QueryPage:
+    """Одна страница результата и курсор для следующей (None, если страниц больше нет)"""
+
+    def __init__(self, rows: list, next_cursor: Optional[str]):
+        self.rows = rows
+        self.next_cursor = next_cursor
+
+
+class QueryGuard:
+    """
+    Проверка сгенерированного SQL перед выполнением
+
+    - запрос должен только читать данные;
+    - план из EXPLAIN не должен превышать порог по стоимости и числу строк;
+    - запрос выполняется с собственным statement_timeout;
+    - большой результат отдается страницами: по id (keyset), если запрос без своей
+      сортировки читает одну таблицу и id в результате - ее уникальная колонка,
+      иначе через OFFSET (при соединении один id бывает у многих строк, и keyset
+      потерял бы часть из них на границе страниц);
+      страницы OFFSET сортируются однозначно: к сортировке запроса добавляются
+      все колонки результата, чтобы строки не повторялись и не терялись между страницами.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, max_cost: float = 1_000_000, max_rows: float = 5_000_000,
+                 statement_timeout_ms: int = 30_000, page_size: int = 1000):
+        """
+        Args:
+            db_manager: Менеджер БД, через который выполняются проверки и запросы
+            max_cost: Максимальная оценка стоимости плана (Total Cost)
+            max_rows: Максимальная оценка числа строк результата (Plan Rows)
+            statement_timeout_ms: Ограничение времени выполнения одного запроса
+            page_size: Размер страницы для больших результатов
+        """
+        self.db_manager = db_manager
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.statement_timeout_ms = statement_timeout_ms
+        self.page_size = page_size
+
+    def check(self, sql: str, params: Optional[tuple] = None) -> Dict[str, Any]:
+        """
+        Проверка запроса без его выполнения
+
+        Returns:
+            Оценки планировщика: {'cost': ..., 'rows': ..., 'node': ...}
+
+        Raises:
+            QueryRejected: запрос что-то меняет в БД или его план слишком дорогой
+        """
+        sql = self._strip(sql)
+
+        # is_read_only учитывает и SELECT ... INTO, nextval, FOR UPDATE; если что-то пропущено,
+        # запрос все равно выполняется в транзакции только на чтение (см. smart_line.execute_sql)
+        if not sql.lower().startswith(('select', 'with')) or not is_read_only(sql):
+            raise QueryRejected("Разрешены только запросы на чтение (SELECT)")
+
+        result = self.db_manager.execute_query(f"EXPLAIN (FORMAT JSON) {sql}", params,
+                                               timeout_ms=self.statement_timeout_ms)
+        plan = result[0]['QUERY PLAN'][0]['Plan']
+        summary = {'cost': plan['Total Cost'], 'rows': plan['Plan Rows'], 'node': plan['Node Type']}
+
+        if summary['cost'] > self.max_cost:
+            raise QueryRejected(f"Оценка стоимости плана {summary['cost']:.0f} больше допустимой {self.max_cost:.0f}",
+                                summary)
+        if summary['rows'] > self.max_rows:
+            raise QueryRejected(f"Ожидается {summary['rows']} строк, допустимо не больше {self.max_rows:.0f}",
+                                summary)
+
+        return summary
+
+    def run(self, sql: str, params: Optional[tuple] = None, cursor: Optional[str] = None,
+            page_key: Optional[str] = None) -> QueryPage:
+        """
+        Выполнение проверенного запроса с таймаутом; большой результат - постранично
+
+        Args:
+            sql: SQL запрос
+            params: Параметры запроса
+            cursor: Курсор следующей страницы из предыдущего QueryPage
+            page_key: Колонка результата с уникальными возрастающими значениями, по которой
+                запрос уже отсортирован (например, position ответов графа): страницы идут по ней (keyset)
+        """
+        sql = self._strip(sql)
+        params = tuple(params or ())
+        # В постраничный запрос всегда добавляются параметры, поэтому % из LIKE надо экранировать
+        template = sql if params else sql.replace('%', '%%')
+
+        if cursor is None:
+            summary = self.check(sql, params or None)
+            # С page_key страница по ключу дешевая, а оценка строк (например, по task_graph_orders) бывает занижена
+            if summary['rows'] <= self.page_size and not page_key:
+                rows = self.db_manager.execute_query(sql, params or None, timeout_ms=self.statement_timeout_ms,
+                                                     prepare=True)
+                return QueryPage(rows, None)
+            if page_key:
+                position = {'mode': 'keyset', 'after': None, 'key': page_key}
+            else:
+                position = self._first_position(sql, params)
+        else:
+            position = self._decode_cursor(cursor)
+
+        if position['mode'] == 'keyset':
+            key = position.get('key', 'id')
+            condition = f"WHERE q.{key} > %s " if position['after'] is not None else ""
+            paged_sql = f"SELECT * FROM ({template}) AS q {condition}ORDER BY q.{key} LIMIT %s"
+            after = (position['after'],) if position['after'] is not None else ()
+            paged_params = params + after + (self.page_size + 1,)
+        else:
+            paged_sql = self._offset_sql(template, position.get('order') or [])
+            paged_params = params + (self.page_size + 1, position['offset'])
+
+        # Страницы одного запроса отличаются только параметрами - план готовится один раз на подключение
+        rows = self.db_manager.execute_query(paged_sql, paged_params, timeout_ms=self.statement_timeout_ms,
+                                             prepare=True)
+        if len(rows) <= self.page_size:
+            return QueryPage(rows, None)
+
+        rows = rows[:self.page_size]
+        if position['mode'] == 'keyset':
+            next_position = {**position, 'after': rows[-1][position.get('key', 'id')]}
+        else:
+            next_position = {**position, 'offset': position['offset'] + self.page_size}
+        return QueryPage(rows, self._encode_cursor(next_position))
+
+    def _first_position(self, sql: str, params: tuple) -> Dict[str, Any]:
+        """Выбор способа пагинации по колонкам результата и наличию сортировки"""
+        with self.db_manager.get_raw_cursor(cursor_factory=RealDictCursor) as raw_cursor:
+            raw_cursor.execute(f"SELECT * FROM ({sql}) AS q LIMIT 0", params or None)
+            description = raw_cursor.description
+
+            columns = [column.name for column in description]
+            if not self._has_top_level_order_by(sql) and columns.count('id') == 1 and self._single_table(sql):
+                # id должен быть самой колонкой таблицы с уникальным индексом, а не выражением с именем id
+                column = description[columns.index('id')]
+                if column.table_oid:
+                    raw_cursor.execute(UNIQUE_COLUMN_QUERY, (column.table_oid, column.table_column))
+                    if raw_cursor.fetchone()['is_unique']:
+                        return {'mode': 'keyset', 'after': None}
+
+        # Номера колонок для досортировки: без нее порядок строк между запросами страниц не гарантирован
+        order = [number for number, column in enumerate(description, 1) if column.type_code not in UNORDERABLE_TYPES]
+        if not order:
+            raise QueryRejected("Большой результат без сортируемых колонок нельзя разбить на страницы")
+        return {'mode': 'offset', 'offset': 0, 'order': order}
+
+    @staticmethod
+    def _offset_sql(template: str, order: List[int]) -> str:
+        '''
+            страница OFFSET: своя сортировка запроса дополняется номерами колонок (ORDER BY status, 1, 2, 3),
+            запрос без сортировки сортируется по ним целиком
+        '''
+        tiebreak = ', '.join(str(number) for number in order)
+        order_by = QueryGuard._top_level_positions(template, r'order\s+by\b')
+        if not order:
+            return f"SELECT * FROM ({template}) AS q LIMIT %s OFFSET %s"
+        if not order_by:
+            return f"SELECT * FROM ({template}) AS q ORDER BY {tiebreak} LIMIT %s OFFSET %s"
+
+        # Досортировка встает в конец ORDER BY, перед LIMIT/OFFSET/FETCH самого запроса
+        ends = [position for position in QueryGuard._top_level_positions(template, r'(limit|offset|fetch)\b')
+                if position > order_by[-1]]
+        end = ends[0] if ends else len(template)
+        ordered = f"{template[:end].rstrip()}, {tiebreak} {template[end:]}".rstrip()
+        return f"SELECT * FROM ({ordered}) AS q LIMIT %s OFFSET %s"
+
+    @staticmethod
+    def _single_table(sql: str) -> bool:
+        """Читает ли запрос одну таблицу без соединений, UNION и функций, размножающих строки"""
+        if not sql.lower().startswith('select') or SET_RETURNING_FUNCTIONS.search(sql):
+            return False
+        if QueryGuard._top_level_positions(sql, r'(union|intersect|except)\b'):
+            return False
+        starts = QueryGuard._top_level_positions(sql, r'from\b')
+        if len(starts) != 1:
+            return False
+        tail = sql[starts[0] + len('from'):]
+        ends = QueryGuard._top_level_positions(tail, FROM_END)
+        source = (tail[:ends[0]] if ends else tail).strip()
+        return SINGLE_TABLE.fullmatch(source) is not None
+
+    @staticmethod
+    def _has_top_level_order_by(sql: str) -> bool:
+        """Есть ли ORDER BY вне скобок (то есть у самого внешнего запроса)"""
+        return bool(QueryGuard._top_level_positions(sql, r'order\s+by\b'))
+
+    @staticmethod
+    def _top_level_positions(sql: str, pattern: str) -> List[int]:
+        """Позиции слов по регулярке вне скобок и строк"""
+        # Строки заменяются пробелами той же длины, чтобы позиции совпадали с исходным текстом
+        text = re.sub(r"'(?:[^']|'')*'", lambda literal: "'" + ' ' * (len(literal.group()) - 2) + "'", sql).lower()
+        positions = []
+        depth = 0
+        for position, char in enumerate(text):
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+            elif (depth == 0 and (position == 0 or not (text[position - 1].isalnum() or text[position - 1] == '_'))
+                  and re.match(pattern, text[position:])):
+                positions.append(position)
+        return positions
+
+    @staticmethod
+    def _strip(sql: str) -> str:
+        return sql.strip().rstrip(';').strip()
+
+    @staticmethod
+    def _encode_cursor(position: Dict[str, Any]) -> str:
+        return base64.urlsafe_b64encode(json.dumps(position, default=str).encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Dict[str, Any]:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        # Курсор приходит от клиента, а ключ и номера колонок подставляются в SQL
+        valid_key = re.fullmatch(r'[a-z_]\w*', str(position.get('key', 'id'))) is not None
+        if not valid_key or not all(isinstance(number, int) for number in position.get('order', ())):
+            raise ValueError("Invalid page cursor")
+        return position
@@ -0,0 +1,283 @@
+import logging
+import re
+import sys
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, Set, Tuple
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+
+from tracing import annotate
+
+
+NOTIFY_CHANNEL = 'table_changes'
+
+# Колонки-водяные знаки для режима 'watermark': при любой вставке/изменении они растут
+WATERMARK_COLUMNS = {
+    'companies': 'updated_at',
+    'departments': 'updated_at',
+    'users': 'updated_at',
+    'tasks': 'updated_at',
+    'task_dependencies': 'created_at',
+    'task_history': 'changed_at',
+}
+
+# Таблицы, на которых установлен триггер из migrations/001_table_change_notify.sql
+NOTIFY_TRIGGERS_QUERY = '''
+    SELECT DISTINCT c.relname AS table_name
+    FROM pg_trigger t
+    JOIN pg_class c ON c.oid = t.tgrelid
+    WHERE t.tgname = 'notify_table_change' AND NOT t.tgisinternal
+'''
+
+_STOP_KEYWORDS = (r'where|group|order|limit|offset|having|window|union|intersect|except|join|inner|left|right'
+                  r'|full|cross|natural|on|using|select|from|returning')
+_FROM_LIST = re.compile(rf'\bfrom\s+(.+?)(?=\b(?:{_STOP_KEYWORDS})\b|\)|;|$)', re.I | re.S)
+_JOIN_TABLE = re.compile(r'\bjoin\s+(?:lateral\s+)?([a-z_][\w.]*)\s*(\()?', re.I)
+_CTE_NAME = re.compile(r'(?:\bwith(?:\s+recursive)?|,)\s*([a-z_]\w*)\s+as\s*(?:not\s+)?(?:materialized\s+)?\(', re.I)
+_FROM_INSIDE_FUNCTION = re.compile(r'\b(?:extract|substring|trim|overlay|position)\s*\([^()]*\)', re.I)
+
+# Результат с этими функциями меняется от вызова к вызову, хотя таблицы те же (CURRENT_DATE допустим)
+VOLATILE_FUNCTIONS = re.compile(
+    r'\b(random|setseed|now|clock_timestamp|statement_timestamp|transaction_timestamp|timeofday|'
+    r'gen_random_uuid|uuid_generate_\w+|txid_current\w*|pg_current_xact_id|pg_sleep\w*)\s*\(|'
+    r'\b(current_timestamp|current_time|localtime|localtimestamp)\b',
+    re.I
+)
+
+
+def referenced_tables(query: str) -> Set[str]:
+    """
+    Таблицы, которые читает запрос (FROM-списки и JOIN, без CTE и функций)
+
+    Разбор приблизительный, но консервативный: лишнее имя приведет к тому,
+    что запрос не будет кэшироваться, а не к устаревшему результату.
+    """
+    text = re.sub(r"'(?:[^']|'')*'", "''", query)
+    text = _FROM_INSIDE_FUNCTION.sub('0', text)
+
+    names = set()
+    for match in _FROM_LIST.finditer(text):
+        for part in match.group(1).split(','):
+            identifier = re.match(r'\s*([a-z_][\w.]*)\s*(\()?', part, re.I)
+            if identifier and not identifier.group(2):
+                names.add(identifier.group(1))
+    for match in _JOIN_TABLE.finditer(text):
+        if not match.group(2):
+            names.add(match.group(1))
+
+    ctes = {name.lower() for name in _CTE_NAME.findall(text)}
+    return {name.split('.')[-1].lower() for name in names} - ctes
+
+
+class ResultCache:
+    """
+    Кэш результатов SELECT с LRU-вытеснением по объему памяти
+
+    Результат сбрасывается при изменении любой таблицы, которую читал запрос:
+    - режим 'notify': триггеры шлют NOTIFY после commit, кэш слушает канал
+      отдельным подключением и перед каждым чтением забирает уведомления;
+    - режим 'watermark': перед чтением сравниваются max(updated_at)/max(id)
+      таблиц с сохраненными вместе с результатом. Удаление строк водяные знаки
+      не сдвигает (если удалена не последняя по id строка), поэтому в этом режиме
+      результат после DELETE может остаться в кэше до следующей вставки или
+      изменения таблицы; для таблиц, из которых удаляют, нужен режим 'notify'.
+    Запросы к таблицам без триггера (или без водяного знака) не кэшируются.
+    """
+
+    def __init__(self, db_config: Dict[str, Any], max_bytes: int = 64 * 1024 * 1024, mode: str = 'notify'):
+        """
+        Args:
+            db_config: Параметры подключения (для служебного подключения кэша)
+            max_bytes: Ограничение на примерный объем закэшированных результатов
+            mode: 'notify' (LISTEN/NOTIFY) или 'watermark' (max(updated_at))
+        """
+        if mode not in ('notify', 'watermark'):
+            raise ValueError(f"Unknown result cache mode: {mode}")
+
+        self.db_config = db_config
+        self.max_bytes = max_bytes
+        self.mode = mode
+
+        self._entries: "OrderedDict[tuple, Tuple[list, Set[str], int, tuple]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._watched: Set[str] = set()
+        self._connection = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.logger = logging.getLogger(__name__)
+
+    def fetch(self, query: str, params: Optional[tuple], execute: Callable[[], list],
+              uncached: Optional[Callable[[], list]] = None) -> list:
+        """
+        Результат запроса из кэша или через execute() с сохранением в кэш
+
+        Args:
+            query: SQL запрос (SELECT)
+            params: Параметры запроса
+            execute: Функция, которая выполняет запрос в БД
+            uncached: Функция для запроса, который не кэшируется (по умолчанию execute)
+        """
+        tables = referenced_tables(query)
+        key = (query, repr(params))
+
+        with self._lock:
+            try:
+                self._ensure_connection()
+                cacheable = bool(tables) and tables <= self._watched and not VOLATILE_FUNCTIONS.search(query)
+                state = self._table_state(tables) if cacheable else None
+            except psycopg2.Error as e:
+                # Без служебного подключения проверить свежесть нельзя - идем в БД напрямую
+                self.logger.error(f"Result cache unavailable: {e}")
+                self._reset_connection()
+                cacheable = False
+
+            if cacheable:
+                entry = self._entries.get(key)
+                if entry is not None and entry[3] == state:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    annotate(cache_hit=True)
+                    return list(entry[0])
+                if entry is not None:
+                    self._evict(key)
+                self.misses += 1
+                annotate(cache_hit=False)
+
+        if not cacheable:
+            return (uncached or execute)()
+
+        result = execute()
+        if not isinstance(result, list):
+            return result
+
+        with self._lock:
+            try:
+                # Если пока шел запрос таблицы поменялись, результат мог оказаться смесью - не храним
+                if self.mode == 'notify' and self._table_state(tables) != state:
+                    return result
+            except psycopg2.Error:
+                self._reset_connection()
+                return result
+            self._store(key, result, tables, state)
+
+        return result
+
+    def invalidate_table(self, table: str):
+        """Сброс всех результатов, читавших таблицу"""
+        with self._lock:
+            self._invalidate(table)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'watched_tables': sorted(self._watched),
+            }
+
+    def close(self):
+        with self._lock:
+            self._reset_connection()
+
+    def _ensure_connection(self):
+        if self._connection is not None and not self._connection.closed:
+            return
+
+        self._connection = psycopg2.connect(
+            host=self.db_config['host'],
+            port=self.db_config['port'],
+            database=self.db_config['database'],
+            user=self.db_config['user'],
+            password=self.db_config['password'],
+            cursor_factory=RealDictCursor
+        )
+        self._connection.autocommit = True
+
+        with self._connection.cursor() as cursor:
+            if self.mode == 'notify':
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                cursor.execute(NOTIFY_TRIGGERS_QUERY)
+                self._watched = {row['table_name'] for row in cursor.fetchall()}
+            else:
+                self._watched = set(WATERMARK_COLUMNS)
+
+        # Пока подключения не было, уведомления могли потеряться
+        self._entries.clear()
+        self._bytes = 0
+
+    def _reset_connection(self):
+        if self._connection is not None and not self._connection.closed:
+            self._connection.close()
+        self._connection = None
+        self._watched = set()
+
+    def _table_state(self, tables: Set[str]) -> tuple:
+        """Текущая 'версия' таблиц: счетчики уведомлений или водяные знаки"""
+        if self.mode == 'notify':
+            # Обмен с сервером, а не только poll(): сервер отдает накопившиеся уведомления раньше ответа,
+            # так что NOTIFY транзакции, закоммиченной до этого момента, гарантированно уже получен
+            with self._connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            while self._connection.notifies:
+                self._invalidate(self._connection.notifies.pop(0).payload)
+            return tuple(self._generations.get(table, 0) for table in sorted(tables))
+
+        selects = ', '.join(
+            f"(SELECT max({WATERMARK_COLUMNS[table]}) FROM {table}), (SELECT max(id) FROM {table})"
+            for table in sorted(tables)
+        )
+        with self._connection.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+            cursor.execute(f"SELECT {selects}")
+            return tuple(cursor.fetchone())
+
+    def _invalidate(self, table: str):
+        self._generations[table] = self._generations.get(table, 0) + 1
+        stale = [key for key, entry in self._entries.items() if table in entry[1]]
+        for key in stale:
+            self._evict(key)
+        self.invalidations += len(stale)
+
+    def _store(self, key: tuple, result: list, tables: Set[str], state: tuple):
+        size = self._estimate_size(result)
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._evict(key)
+        self._entries[key] = (result, tables, size, state)
+        self._bytes += size
+
+        while self._bytes > self.max_bytes:
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, key: tuple):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[2]
+
+    @staticmethod
+    def _estimate_size(result: list) -> int:
+        """Примерный объем результата в памяти: список, строки и значения"""
+        size = sys.getsizeof(result)
+        for row in result:
+            size += sys.getsizeof(row)
+            values = row.values() if isinstance(row, dict) else row
+            for value in values:
+                size += sys.getsizeof(value)
+        return size
@@ -0,0 +1,243 @@
+import json
+from decimal import Decimal
+from typing import Optional, Dict, Any, List, Iterable, Iterator, Tuple, Union, IO
+
+# Колоночные форматы нужны только выгрузке в Parquet/Arrow и аналитике:
+# без numpy и pyarrow все остальное работает
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+
+# OID типов Postgres (pg_type), у которых есть свой тип в Arrow и NumPy; остальные - строки
+BOOL, BYTEA, INT8, INT2, INT4, OID = 16, 17, 20, 21, 23, 26
+FLOAT4, FLOAT8, DATE, TIME, TIMESTAMP, TIMESTAMPTZ, INTERVAL, NUMERIC = 700, 701, 1082, 1083, 1114, 1184, 1186, 1700
+
+# Форматы файлов выгрузки по расширению; все прочие расширения - CSV
+OUTPUT_FORMATS = {'.parquet': 'parquet', '.pq': 'parquet',
+                  '.arrow': 'arrow', '.arrows': 'arrow', '.feather': 'arrow', '.ipc': 'arrow'}
+
+NUMPY_DTYPES = {BOOL: 'bool', INT2: 'int16', INT4: 'int32', INT8: 'int64', OID: 'int64',
+                FLOAT4: 'float32', FLOAT8: 'float64'}
+
+# Самая большая точность decimal128; numeric без заданной точности (avg, sum) выгружается как float64
+MAX_DECIMAL_PRECISION = 38
+
+
+def _require(module, name: str):
+    if module is None:
+        raise ImportError(f"{name} is required for columnar results, install it with: pip install {name}")
+    return module
+
+
+def arrow_type(type_code: int, precision: Optional[int] = None, scale: Optional[int] = None):
+    '''
+        тип Arrow для колонки Postgres; неизвестные типы выгружаются строками
+    '''
+    _require(pa, 'pyarrow')
+    if type_code == BOOL:
+        return pa.bool_()
+    if type_code == INT2:
+        return pa.int16()
+    if type_code == INT4:
+        return pa.int32()
+    if type_code in (INT8, OID):
+        return pa.int64()
+    if type_code == FLOAT4:
+        return pa.float32()
+    if type_code == FLOAT8:
+        return pa.float64()
+    if type_code == NUMERIC:
+        if precision and 0 < precision <= MAX_DECIMAL_PRECISION and scale is not None and scale >= 0:
+            return pa.decimal128(precision, scale)
+        return pa.float64()
+    if type_code == DATE:
+        return pa.date32()
+    if type_code == TIME:
+        return pa.time64('us')
+    if type_code == TIMESTAMP:
+        return pa.timestamp('us')
+    if type_code == TIMESTAMPTZ:
+        return pa.timestamp('us', tz='UTC')
+    if type_code == INTERVAL:
+        return pa.duration('us')
+    if type_code == BYTEA:
+        return pa.binary()
+    return pa.string()
+
+
+def unique_names(names: List[str]) -> List[str]:
+    '''
+        имена колонок без повторов (id, id -> id, id_2): словари колонок и Parquet
+        не допускают одноименных колонок, а в SELECT с JOIN они обычны
+    '''
+    seen: Dict[str, int] = {}
+    result = []
+    for name in names:
+        seen[name] = seen.get(name, 0) + 1
+        candidate = name if seen[name] == 1 else f"{name}_{seen[name]}"
+        while candidate in seen and candidate != name:
+            seen[name] += 1
+            candidate = f"{name}_{seen[name]}"
+        if candidate != name:
+            seen[candidate] = 1
+        result.append(candidate)
+    return result
+
+
+def _arrow_values(values: List[Any], arrow_column_type) -> List[Any]:
+    '''
+        значения из psycopg2 в вид, который pyarrow примет для типа колонки
+    '''
+    if pa.types.is_string(arrow_column_type):
+        return [value if value is None or isinstance(value, str)
+                else json.dumps(value, ensure_ascii=False, default=str) if isinstance(value, (dict, list))
+                else str(value)
+                for value in values]
+    if pa.types.is_floating(arrow_column_type):
+        return [float(value) if isinstance(value, Decimal) else value for value in values]
+    if pa.types.is_binary(arrow_column_type):
+        return [bytes(value) if value is not None else None for value in values]
+    return values
+
+
+class ResultSet:
+    """
+    Результат запроса: имена колонок и строки-кортежи
+
+    В отличие от списка словарей из RealDictCursor ключи не повторяются в каждой
+    строке, поэтому широкий результат занимает в разы меньше памяти. Итерация
+    отдает строки-словари по одной, не создавая их все сразу; tuples() - строки
+    как есть, columns(), to_numpy() и to_arrow() - результат по колонкам.
+    """
+
+    __slots__ = ('names', 'types', 'rows')
+
+    def __init__(self, names: List[str], rows: List[tuple],
+                 types: Optional[List[Tuple[int, Optional[int], Optional[int]]]] = None):
+        """
+        Args:
+            names: Имена колонок
+            rows: Строки-кортежи в порядке колонок
+            types: Для каждой колонки (OID типа Postgres, точность, масштаб); None - типы неизвестны
+        """
+        self.names = names
+        self.rows = rows
+        self.types = types
+
+    @classmethod
+    def from_cursor(cls, cursor, rows: List[tuple]) -> 'ResultSet':
+        """Результат из строк курсора с фабрикой по умолчанию (строки-кортежи)"""
+        description = cursor.description or ()
+        return cls([column.name for column in description], rows,
+                   [(column.type_code, column.precision, column.scale) for column in description])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        names = self.names
+        for row in self.rows:
+            yield dict(zip(names, row))
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Dict[str, Any], 'ResultSet']:
+        if isinstance(index, slice):
+            return ResultSet(self.names, self.rows[index], self.types)
+        return dict(zip(self.names, self.rows[index]))
+
+    def __repr__(self):
+        return f"ResultSet(columns={self.names!r}, rows={len(self.rows)})"
+
+    def tuples(self) -> List[tuple]:
+        return self.rows
+
+    def dicts(self) -> List[Dict[str, Any]]:
+        return list(self)
+
+    def columns(self) -> Dict[str, list]:
+        """Колонки как списки значений: {имя: [значения]} (повторы имен - см. unique_names)"""
+        return dict(zip(unique_names(self.names), self._column_values()))
+
+    def _column_values(self) -> List[list]:
+        # По позиции, а не по имени: в SELECT могут быть одноименные колонки
+        if not self.rows:
+            return [[] for _ in self.names]
+        return [list(column) for column in zip(*self.rows)]
+
+    def to_numpy(self) -> Dict[str, Any]:
+        '''
+            колонки как массивы NumPy: числа и bool без NULL - в своем dtype,
+            float с NULL - с NaN, остальное - массивы object
+        '''
+        _require(np, 'numpy')
+        arrays = {}
+        for index, (name, values) in enumerate(zip(unique_names(self.names), self._column_values())):
+            dtype = NUMPY_DTYPES.get(self.types[index][0]) if self.types else None
+            has_nulls = any(value is None for value in values)
+            if dtype is not None and not has_nulls:
+                arrays[name] = np.array(values, dtype=dtype)
+            elif dtype in ('float32', 'float64'):
+                arrays[name] = np.array([np.nan if value is None else value for value in values], dtype=dtype)
+            else:
+                arrays[name] = np.array(values, dtype=object)
+        return arrays
+
+    def arrow_schema(self):
+        _require(pa, 'pyarrow')
+        if self.types is None:
+            raise ValueError("Column types are unknown, build the ResultSet with ResultSet.from_cursor")
+        return pa.schema([pa.field(name, arrow_type(*column_type))
+                          for name, column_type in zip(unique_names(self.names), self.types)])
+
+    def to_arrow_batch(self, schema=None):
+        """RecordBatch со схемой по типам Postgres (или с переданной, общей для всех пачек выгрузки)"""
+        schema = schema if schema is not None else self.arrow_schema()
+        arrays = [pa.array(_arrow_values(values, field.type), type=field.type)
+                  for field, values in zip(schema, self._column_values())]
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    def to_arrow(self):
+        return pa.Table.from_batches([self.to_arrow_batch()])
+
+
+def output_format(path: str) -> str:
+    """Формат выгрузки по расширению файла: 'parquet', 'arrow' или 'csv'"""
+    for extension, file_format in OUTPUT_FORMATS.items():
+        if path.lower().endswith(extension):
+            return file_format
+    return 'csv'
+
+
+def write_batches(result_sets: Iterable[ResultSet], file: IO[bytes], file_format: str) -> int:
+    '''
+        пишет пачки результата в Parquet (каждая пачка - row group) или в файл Arrow IPC
+        (каждая пачка - record batch); схема берется из типов первой пачки, поэтому
+        первая пачка нужна даже пустая - тогда получится файл без строк; возвращает число строк
+    '''
+    _require(pa, 'pyarrow')
+    if file_format not in ('parquet', 'arrow'):
+        raise ValueError(f"Unknown columnar format: {file_format}")
+
+    writer = None
+    row_count = 0
+    try:
+        for result_set in result_sets:
+            if writer is None:
+                schema = result_set.arrow_schema()
+                writer = (pa.parquet.ParquetWriter(file, schema) if file_format == 'parquet'
+                          else pa.ipc.new_file(file, schema))
+            if len(result_set):
+                writer.write_batch(result_set.to_arrow_batch(schema))
+            row_count += len(result_set)
+    finally:
+        if writer is not None:
+            writer.close()
+    return row_count
@@ -0,0 +1,251 @@
+import argparse
+import logging
+import threading
+import time
+from typing import Dict, Any
+
+import psycopg2.errors
+from dotenv import load_dotenv
+from psycopg2.extras import RealDictCursor
+
+from database import DatabaseManager
+
+
+WATERMARK_NAME = 'task_history'
+
+# Таблицы агрегатов: запросы к ним перед выполнением подтягивают свежую историю
+ROLLUP_TABLES = {'task_status_intervals', 'task_activity_daily_user', 'task_activity_daily_department'}
+
+LOCK_WATERMARK_QUERY = '''
+    SELECT last_id, safe_id, frontier_id, frontier_xmax FROM rollup_watermarks WHERE name = %(name)s FOR UPDATE
+'''
+
+# Последний видимый id истории и границы снимка: транзакции с xid из [xmin, xmax) еще не завершены.
+# Берется до блокировки водяного знака, пока у своей транзакции нет xid
+FRONTIER_QUERY = '''
+    SELECT (SELECT max(id) FROM task_history) AS max_id,
+           pg_snapshot_xmin(s)::text::bigint AS xmin, pg_snapshot_xmax(s)::text::bigint AS xmax
+    FROM pg_current_snapshot() AS s
+'''
+
+# Порция не заходит дальше safe_id: выше него еще могут зафиксироваться строки с меньшими id
+BATCH_END_QUERY = '''
+    SELECT max(id) AS upto, count(*) AS rows
+    FROM (SELECT id FROM task_history WHERE id > %(last)s AND id <= %(safe)s ORDER BY id LIMIT %(batch_size)s) AS batch
+'''
+
+SAVE_FRONTIER_QUERY = '''
+    UPDATE rollup_watermarks SET safe_id = %(safe)s, frontier_id = %(frontier_id)s, frontier_xmax = %(frontier_xmax)s
+    WHERE name = %(name)s
+'''
+
+# Первый интервал задачи: от создания до первой смены статуса (статус берется из old_value)
+INITIAL_INTERVALS_QUERY = '''
+    INSERT INTO task_status_intervals (task_id, status, started_at, ended_at)
+    SELECT DISTINCT ON (h.task_id) h.task_id, h.old_value, LEAST(t.created_at, h.changed_at), h.changed_at
+    FROM task_history h
+    JOIN tasks t ON t.id = h.task_id
+    WHERE h.id > %(last)s AND h.id <= %(upto)s AND h.field_name = 'status' AND h.old_value IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM task_status_intervals i WHERE i.task_id = h.task_id)
+    ORDER BY h.task_id, h.changed_at, h.id
+'''
+
+# Открытый интервал закрывается первой сменой статуса из новой порции
+CLOSE_INTERVALS_QUERY = '''
+    UPDATE task_status_intervals i
+    SET ended_at = GREATEST(f.changed_at, i.started_at)
+    FROM (
+        SELECT DISTINCT ON (task_id) task_id, changed_at
+        FROM task_history
+        WHERE id > %(last)s AND id <= %(upto)s AND field_name = 'status'
+        ORDER BY task_id, changed_at, id
+    ) AS f
+    WHERE i.task_id = f.task_id AND i.ended_at IS NULL
+'''
+
+# Каждая смена статуса открывает интервал; если в порции есть следующая смена - он сразу закрыт
+NEW_INTERVALS_QUERY = '''
+    INSERT INTO task_status_intervals (task_id, status, started_at, ended_at, changed_by_user_id, history_id)
+    SELECT task_id, new_value, changed_at, lead(changed_at) OVER w, changed_by_user_id, id
+    FROM task_history
+    WHERE id > %(last)s AND id <= %(upto)s AND field_name = 'status'
+    WINDOW w AS (PARTITION BY task_id ORDER BY changed_at, id)
+'''
+
+DAILY_USER_QUERY = '''
+    INSERT INTO task_activity_daily_user AS a (day, user_id, field_name, changes, tasks_completed)
+    SELECT changed_at::date, changed_by_user_id, field_name, count(*),
+           count(*) FILTER (WHERE field_name = 'status' AND new_value = 'completed')
+    FROM task_history
+    WHERE id > %(last)s AND id <= %(upto)s AND changed_by_user_id IS NOT NULL AND field_name IS NOT NULL
+    GROUP BY 1, 2, 3
+    ON CONFLICT (day, user_id, field_name) DO UPDATE
+    SET changes = a.changes + EXCLUDED.changes, tasks_completed = a.tasks_completed + EXCLUDED.tasks_completed
+'''
+
+DAILY_DEPARTMENT_QUERY = '''
+    INSERT INTO task_activity_daily_department AS a (day, department_id, field_name, changes, tasks_completed)
+    SELECT h.changed_at::date, t.assigned_department_id, h.field_name, count(*),
+           count(*) FILTER (WHERE h.field_name = 'status' AND h.new_value = 'completed')
+    FROM task_history h
+    JOIN tasks t ON t.id = h.task_id
+    WHERE h.id > %(last)s AND h.id <= %(upto)s AND t.assigned_department_id IS NOT NULL AND h.field_name IS NOT NULL
+    GROUP BY 1, 2, 3
+    ON CONFLICT (day, department_id, field_name) DO UPDATE
+    SET changes = a.changes + EXCLUDED.changes, tasks_completed = a.tasks_completed + EXCLUDED.tasks_completed
+'''
+
+SAVE_WATERMARK_QUERY = '''
+    UPDATE rollup_watermarks SET last_id = %(upto)s, updated_at = now() WHERE name = %(name)s
+'''
+
+PENDING_QUERY = '''
+    SELECT w.last_id, w.safe_id, w.updated_at,
+           (SELECT count(*) FROM task_history h WHERE h.id > w.last_id) AS pending
+    FROM rollup_watermarks w
+    WHERE w.name = %(name)s
+'''
+
+
+class RollupPipeline:
+    """
+    Инкрементальное обновление агрегатов по task_history
+
+    Каждый проход берет строки истории после сохраненного водяного знака (task_history.id)
+    порциями по batch_size и в одной транзакции с водяным знаком обновляет
+    интервалы статусов и дневные агрегаты по сотрудникам и отделам. Строка
+    rollup_watermarks блокируется на время порции, поэтому параллельные проходы
+    не обработают одну и ту же историю дважды.
+
+    id выдаются последовательностью, но транзакции фиксируются не по порядку, поэтому
+    водяной знак не обгоняет safe_id - границу, ниже которой все писавшие историю
+    транзакции уже завершены (см. _advance_frontier). Пока идет долгая транзакция,
+    новые строки ждут ее завершения. Водяной знак по id предполагает, что история
+    только дописывается; если строки правили задним числом, агрегаты пересчитываются
+    через rebuild().
+    """
+
+    def __init__(self, db_manager: DatabaseManager, batch_size: int = 100_000, min_refresh_interval: float = 5.0):
+        """
+        Args:
+            db_manager: Менеджер БД с таблицами из migrations/004_task_history_rollups.sql
+            batch_size: Строк истории в одной транзакции
+            min_refresh_interval: refresh() без force не ходит в БД чаще, чем раз в столько секунд
+        """
+        self.db_manager = db_manager
+        self.batch_size = batch_size
+        self.min_refresh_interval = min_refresh_interval
+
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def refresh(self, force: bool = False) -> int:
+        """Обработка всей новой истории; возвращает число обработанных строк"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._refreshed_at < self.min_refresh_interval:
+                return 0
+            self._refreshed_at = now
+
+            processed = 0
+            started = time.monotonic()
+            while True:
+                batch = self._process_batch()
+                processed += batch
+                if batch < self.batch_size:
+                    break
+
+            if processed:
+                self.logger.info(f"Rollups updated with {processed} task_history rows "
+                                 f"in {time.monotonic() - started:.2f}s")
+            return processed
+
+    def rebuild(self) -> int:
+        """Пересчет агрегатов с нуля"""
+        with self._lock:
+            with self.db_manager.get_raw_cursor() as cursor:
+                cursor.execute("TRUNCATE task_status_intervals, task_activity_daily_user, "
+                               "task_activity_daily_department")
+                cursor.execute("UPDATE rollup_watermarks SET last_id = 0, updated_at = now() WHERE name = %s",
+                               (WATERMARK_NAME,))
+        return self.refresh(force=True)
+
+    def _process_batch(self) -> int:
+        with self.db_manager.get_raw_cursor(cursor_factory=RealDictCursor) as cursor:
+            params: Dict[str, Any] = {'name': WATERMARK_NAME, 'batch_size': self.batch_size}
+
+            cursor.execute(FRONTIER_QUERY)
+            snapshot = cursor.fetchone()
+            try:
+                cursor.execute(LOCK_WATERMARK_QUERY, params)
+            except psycopg2.errors.UndefinedColumn:
+                raise RuntimeError("rollup_watermarks has no safe_id, apply migrations/008_rollup_frontier.sql")
+            row = cursor.fetchone()
+            if row is None:
+                raise RuntimeError("rollup_watermarks is not initialised, apply migrations/004_task_history_rollups.sql")
+            params['last'] = row['last_id']
+            params.update(self._advance_frontier(row, snapshot))
+            cursor.execute(SAVE_FRONTIER_QUERY, params)
+
+            cursor.execute(BATCH_END_QUERY, params)
+            batch = cursor.fetchone()
+            if batch['upto'] is None:
+                return 0
+            params['upto'] = batch['upto']
+
+            for query in (INITIAL_INTERVALS_QUERY, CLOSE_INTERVALS_QUERY, NEW_INTERVALS_QUERY,
+                          DAILY_USER_QUERY, DAILY_DEPARTMENT_QUERY):
+                cursor.execute(query, params)
+
+            cursor.execute(SAVE_WATERMARK_QUERY, params)
+            return batch['rows']
+
+    @staticmethod
+    def _advance_frontier(row: Dict[str, Any], snapshot: Dict[str, Any]) -> Dict[str, Any]:
+        '''
+            новые safe_id и frontier: max(id) из снимка становится безопасным, когда завершатся
+            все транзакции, бывшие в работе в момент снимка (xmin текущего снимка дошел до его xmax);
+            если в работе нет ни одной транзакции - сразу. Граница ждет, пока не станет безопасной,
+            а не сдвигается на каждом проходе, иначе под постоянной нагрузкой она не дождется никогда
+        '''
+        safe, frontier_id, frontier_xmax = row['safe_id'], row['frontier_id'], row['frontier_xmax']
+        max_id = snapshot['max_id'] or 0
+        if snapshot['xmin'] >= snapshot['xmax']:
+            safe, frontier_id, frontier_xmax = max(safe, max_id), None, None
+        elif frontier_xmax is None or snapshot['xmin'] >= frontier_xmax:
+            if frontier_xmax is not None:
+                safe = max(safe, frontier_id)
+            frontier_id, frontier_xmax = max_id, snapshot['xmax']
+        return {'safe': safe, 'frontier_id': frontier_id, 'frontier_xmax': frontier_xmax}
+
+    def status(self) -> Dict[str, Any]:
+        """Водяной знак и сколько строк истории еще не обработано"""
+        rows = self.db_manager.execute_query(PENDING_QUERY, {'name': WATERMARK_NAME})
+        return dict(rows[0]) if rows else {}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Обновление агрегатов по task_history")
+    parser.add_argument('--rebuild', action='store_true', help="Пересчитать агрегаты с нуля")
+    parser.add_argument('--watch', type=float, help="Обновлять раз в столько секунд, пока не прервут")
+    parser.add_argument('--batch-size', type=int, default=100_000, help="Строк истории в одной транзакции")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_args()
+
+    from smart_line import db_config
+
+    pipeline = RollupPipeline(DatabaseManager(db_config, use_sqlalchemy=False), batch_size=args.batch_size)
+    started = time.monotonic()
+    processed = pipeline.rebuild() if args.rebuild else pipeline.refresh(force=True)
+    print(f"Обработано строк истории: {processed} за {time.monotonic() - started:.1f} с")
+
+    while args.watch:
+        time.sleep(args.watch)
+        processed = pipeline.refresh(force=True)
+        if processed:
+            print(f"Обработано строк истории: {processed}")
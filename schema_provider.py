@@ -0,0 +1,278 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Optional, Dict, List, Tuple
+
+from database import DatabaseManager
+
+
+# По этим основам слов видно, какие таблицы затрагивает промпт
+TABLE_KEYWORDS = {
+    'tasks': ('задач', 'task'),
+    'users': ('сотрудник', 'пользовател', 'исполнител', 'коллег', 'менеджер', 'руководител', 'user', 'employee'),
+    'departments': ('отдел', 'подразделени', 'департамент', 'дивизион', 'department', 'division'),
+    'companies': ('компани', 'организаци', 'company'),
+    'task_dependencies': ('завис', 'связан', 'блокир', 'depend', 'block'),
+    'task_history': ('истори', 'изменени', 'изменял', 'менял', 'history', 'changed'),
+    # иерархия отделов: migrations/003_department_closure.sql
+    'department_closure': ('подразделени', 'дивизион', 'подотдел', 'дочерн', 'подчинен', 'вложен', 'иерарх',
+                           'division', 'subdepartment', 'hierarch', 'subtree'),
+    # агрегаты по истории: migrations/004_task_history_rollups.sql
+    'task_status_intervals': ('длительн', 'сколько времени', 'как долго', 'провел', 'пролежал', 'зависл',
+                              'в статусе', 'cycle time', 'lead time', 'how long', 'time in status'),
+    'task_activity_daily_user': ('активн', 'по дням', 'за день', 'ежедневн', 'динамик', 'кто менял', 'кто закрыл',
+                                 'activity', 'daily', 'per day'),
+    'task_activity_daily_department': ('активн', 'по дням', 'за день', 'ежедневн', 'динамик',
+                                       'activity', 'daily', 'per day'),
+}
+
+# Подсказки модели, как пользоваться служебными таблицами
+TABLE_NOTES = {
+    'department_closure': (
+        "department_closure holds every (ancestor, descendant) pair of the department tree, "
+        "including each department with itself at depth 0. For a department together with all "
+        "its subdepartments use JOIN department_closure dc ON dc.descendant_id = <department id column> "
+        "WHERE dc.ancestor_id = <root department id>; never walk departments with WITH RECURSIVE"
+    ),
+    'task_status_intervals': (
+        "task_status_intervals has one row per period a task spent in a status, with started_at, "
+        "ended_at (NULL while the task is still in it) and duration_hours. For cycle time, time in status "
+        "or how long tasks stayed somewhere use this table instead of pairing task_history rows"
+    ),
+    'task_activity_daily_user': (
+        "task_activity_daily_user counts task_history changes per day, user (changed_by) and field_name; "
+        "tasks_completed counts status changes to completed. Sum it over days instead of counting task_history"
+    ),
+    'task_activity_daily_department': (
+        "task_activity_daily_department is the same daily count per assigned department of the task; "
+        "combine with department_closure for a department with its subdepartments"
+    ),
+}
+
+# Подсказки к индексам, которые появляются миграциями: выводятся, только если индекс есть в БД
+INDEX_NOTES = {
+    # полнотекстовый поиск: migrations/006_task_search.sql
+    ('tasks', 'tasks_search_idx'): (
+        "tasks_search_idx is a full-text index over tasks title and description in Russian and English. "
+        "To find tasks about a topic or mentioning words use FROM search_tasks('words') s "
+        "JOIN tasks t ON t.id = s.task_id ORDER BY s.rank DESC instead of ILIKE on title or description; "
+        "search_tasks matches any word form and accepts \"exact phrase\", or, -excluded"
+    ),
+}
+
+# Текстовое описание схемы на случай, если до БД не достучаться
+STATIC_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'db_structure', 'task_db_structure.txt')
+
+COLUMNS_QUERY = '''
+    SELECT table_name, column_name, udt_name
+    FROM information_schema.columns
+    WHERE table_schema = 'public'
+    ORDER BY table_name, ordinal_position
+'''
+
+FOREIGN_KEYS_QUERY = '''
+    SELECT tc.table_name, kcu.column_name,
+           ccu.table_name AS foreign_table_name, ccu.column_name AS foreign_column_name
+    FROM information_schema.table_constraints tc
+    JOIN information_schema.key_column_usage kcu
+        ON tc.constraint_name = kcu.constraint_name AND tc.table_schema = kcu.table_schema
+    JOIN information_schema.constraint_column_usage ccu
+        ON ccu.constraint_name = tc.constraint_name AND ccu.table_schema = tc.table_schema
+    WHERE tc.constraint_type = 'FOREIGN KEY' AND tc.table_schema = 'public'
+    ORDER BY tc.table_name, kcu.column_name
+'''
+
+INDEXES_QUERY = '''
+    SELECT tablename, indexname, indexdef
+    FROM pg_indexes
+    WHERE schemaname = 'public'
+    ORDER BY tablename, indexname
+'''
+
+
+class SchemaProvider:
+    """
+    Описание схемы БД для промптов LLM, построенное по information_schema и pg_indexes
+
+    Схема читается из базы один раз и кэшируется вместе с хэшем версии.
+    Для каждого промпта отдаются только нужные таблицы: найденные по ключевым
+    словам, таблицы, на которые они ссылаются, и таблицы на пути между ними
+    по внешним ключам. Если база недоступна, отдается статическая схема из
+    db_structure, а чтение из базы повторяется не чаще раза в retry_interval.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, retry_interval: float = 30.0):
+        """
+        Args:
+            db_manager: Менеджер БД, из которой читается схема
+            retry_interval: Через сколько секунд после неудачи снова читать схему из БД
+        """
+        self.db_manager = db_manager
+        self.retry_interval = retry_interval
+
+        self.tables: Dict[str, List[Tuple[str, str]]] = {}
+        self.indexes: Dict[str, List[str]] = {}
+        self.foreign_keys: List[Tuple[str, str, str, str]] = []
+        self.version: Optional[str] = None
+        self.static_schema: Optional[str] = None
+        self._failed_at: Optional[float] = None
+
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def load(self):
+        """Чтение схемы из БД (один раз, повторно - через refresh или после неудачи)"""
+        with self._lock:
+            if self.version is None or self._retry_due():
+                self._introspect()
+
+    def _retry_due(self) -> bool:
+        return self._failed_at is not None and time.monotonic() - self._failed_at >= self.retry_interval
+
+    def refresh(self):
+        """Принудительное перечитывание схемы, например после миграции"""
+        with self._lock:
+            self._introspect()
+
+    def _introspect(self):
+        try:
+            columns = self.db_manager.execute_query(COLUMNS_QUERY)
+            foreign_keys = self.db_manager.execute_query(FOREIGN_KEYS_QUERY)
+            indexes = self.db_manager.execute_query(INDEXES_QUERY)
+        except Exception as e:
+            self.logger.error(f"Schema introspection failed, using static schema "
+                              f"(retry in {self.retry_interval:.0f}s): {e}")
+            self._failed_at = time.monotonic()
+            if self.static_schema is None:
+                with open(STATIC_SCHEMA_PATH, 'r', encoding='utf-8') as f:
+                    self.static_schema = f.read()
+                self.version = hashlib.sha256(self.static_schema.encode('utf-8')).hexdigest()
+            return
+
+        if self._failed_at is not None:
+            self.logger.info("Schema introspection recovered, static schema is no longer used")
+        self._failed_at = None
+        self.static_schema = None
+        self.tables = {}
+        for row in columns:
+            self.tables.setdefault(row['table_name'], []).append((row['column_name'], row['udt_name']))
+
+        self.foreign_keys = [(row['table_name'], row['column_name'],
+                              row['foreign_table_name'], row['foreign_column_name'])
+                             for row in foreign_keys]
+
+        self.indexes = {}
+        for row in indexes:
+            self.indexes.setdefault(row['tablename'], []).append(self._format_index(row))
+
+        self.version = hashlib.sha256(self.render(self.tables).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _format_index(row: Dict) -> str:
+        """'CREATE UNIQUE INDEX x ON t USING btree (a, b)' -> 'x UNIQUE (a, b)'"""
+        match = re.search(r'USING \w+ (\(.*\))', row['indexdef'])
+        columns = match.group(1) if match else ''
+        unique = ' UNIQUE' if 'UNIQUE' in row['indexdef'] else ''
+        return f"{row['indexname']}{unique} {columns}".strip()
+
+    def get_version(self) -> str:
+        """Хэш текущей версии схемы: меняется вместе со структурой БД"""
+        self.load()
+        return self.version
+
+    def context_for(self, prompt: str) -> str:
+        """Описание схемы, урезанное до таблиц, нужных для промпта"""
+        self.load()
+
+        if self.static_schema is not None:
+            return self.static_schema
+
+        tables = self.relevant_tables(prompt)
+        return self.render(tables)
+
+    def full_context(self) -> str:
+        self.load()
+        return self.static_schema if self.static_schema is not None else self.render(self.tables)
+
+    def relevant_tables(self, prompt: str) -> List[str]:
+        """Таблицы по ключевым словам + их внешние ключи + связующие таблицы между ними"""
+        text = prompt.lower()
+
+        matched = [table for table in self.tables
+                   if table in text or any(stem in text for stem in TABLE_KEYWORDS.get(table, ()))]
+        if not matched:
+            return list(self.tables)
+
+        selected = set(matched)
+
+        # Соединяем все найденные таблицы с первой кратчайшими путями по внешним ключам
+        for table in matched[1:]:
+            selected.update(self._fk_path(matched[0], table))
+
+        # Таблицы, на которые ссылаются выбранные: без них не сделать JOIN по id
+        for table, _, foreign_table, _ in self.foreign_keys:
+            if table in matched:
+                selected.add(foreign_table)
+
+        return [table for table in self.tables if table in selected]
+
+    def _fk_path(self, source: str, target: str) -> List[str]:
+        """Кратчайший путь между таблицами по графу внешних ключей (без учета направления)"""
+        neighbours: Dict[str, set] = {}
+        for table, _, foreign_table, _ in self.foreign_keys:
+            neighbours.setdefault(table, set()).add(foreign_table)
+            neighbours.setdefault(foreign_table, set()).add(table)
+
+        previous = {source: None}
+        queue = deque([source])
+        while queue:
+            table = queue.popleft()
+            if table == target:
+                break
+            for neighbour in neighbours.get(table, ()):
+                if neighbour not in previous:
+                    previous[neighbour] = table
+                    queue.append(neighbour)
+
+        if target not in previous:
+            return [target]
+
+        path = []
+        table = target
+        while table is not None:
+            path.append(table)
+            table = previous[table]
+        return path
+
+    def render(self, tables) -> str:
+        """Компактное текстовое описание таблиц, индексов, внешних ключей между ними и подсказок"""
+        tables = set(tables)
+        lines = ['task_db structure:']
+
+        for table, columns in self.tables.items():
+            if table not in tables:
+                continue
+            column_list = ', '.join(f"{name} {data_type}" for name, data_type in columns)
+            lines.append(f"{table}({column_list})")
+            for index in self.indexes.get(table, []):
+                lines.append(f"    index {index}")
+
+        foreign_keys = [fk for fk in self.foreign_keys if fk[0] in tables and fk[2] in tables]
+        if foreign_keys:
+            lines.append('foreign keys:')
+            for table, column, foreign_table, foreign_column in foreign_keys:
+                lines.append(f"    {table}.{column} -> {foreign_table}.{foreign_column}")
+
+        notes = [note for table, note in TABLE_NOTES.items() if table in tables]
+        notes.extend(note for (table, index_name), note in INDEX_NOTES.items()
+                     if table in tables and index_name in (index.split()[0] for index in self.indexes.get(table, ())))
+        if notes:
+            lines.append('notes:')
+            lines.extend(f"    {note}" for note in notes)
+
+        return '\n'.join(lines)
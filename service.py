@@ -0,0 +1,553 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import secrets
+import signal
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Tuple
+
+from dotenv import load_dotenv
+
+from auth import User, UserAuthenticator, UserDirectory, SessionTokens
+from database import DatabaseManager, close_all_pools, prepared_statement_stats
+from llm_client import get_llm_client
+from model_router import get_model_router
+from query_guard import QueryRejected
+from smart_line import (generate_sql, execute_sql, rewrite_sql_query, cache_sql, log_executed_sql,
+                        schema_provider, sql_cache, result_cache, llm_flights, db_flights, db_config, db_replicas,
+                        replica_config, LLM_PATHS)
+from sql_extractor import extract_sql
+from tracing import span
+
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 422: 'Unprocessable Entity', 429: 'Too Many Requests',
+                500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+
+# Сколько ждать следующий запрос на keep-alive соединении, сек
+IDLE_TIMEOUT = 30.0
+
+FILE_CHUNK_SIZE = 64 * 1024
+
+# Форматы файлового ответа /ask: расширение временного файла (по нему execute_sql выбирает формат) и Content-Type
+FILE_FORMATS = {
+    'csv': ('.csv', 'text/csv; charset=utf-8'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('.arrow', 'application/vnd.apache.arrow.file'),
+}
+
+# Продолжений (следующих страниц) на одного пользователя: старые вытесняются
+MAX_CONTINUATIONS = 20
+
+
+class HTTPError(Exception):
+    """Ответ с кодом ошибки и сообщением для клиента"""
+
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class Session:
+    """Состояние пользователя в сервисе: одновременные запросы и продолжения (следующие страницы)"""
+
+    __slots__ = ('user', 'active', 'continuations', 'last_seen')
+
+    def __init__(self, user: User):
+        self.user = user
+        self.active = 0
+        self.continuations: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.last_seen = time.monotonic()
+
+
+class SessionStore:
+    """
+    Сессии поверх подписанных токенов auth.SessionTokens
+
+    Сам токен сервер не хранит: id пользователя берется из проверенного токена,
+    а пользователь - из справочника UserDirectory, так что отключенный в users
+    сотрудник теряет доступ после ближайшей сверки справочника. В памяти
+    остается только состояние по пользователю (лимит одновременных запросов и
+    продолжения); простаивающее дольше ttl состояние удаляется чисткой.
+    """
+
+    def __init__(self, tokens: SessionTokens, directory: UserDirectory, max_sessions: int = 10_000):
+        """
+        Args:
+            tokens: Выпуск и проверка токенов
+            directory: Справочник пользователей
+            max_sessions: Ограничение числа состояний (самые давние вытесняются)
+        """
+        self.tokens = tokens
+        self.directory = directory
+        self.ttl = tokens.ttl
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[int, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, user: User) -> str:
+        self._state(user)
+        return self.tokens.issue(user)
+
+    def get(self, token: str) -> Optional[Session]:
+        user_id = self.tokens.verify(token)
+        user = self.directory.get(user_id) if user_id is not None else None
+        return self._state(user) if user is not None else None
+
+    def drop(self, token: str):
+        self.tokens.revoke(token)
+
+    def purge(self) -> int:
+        idle_since = time.monotonic() - self.ttl
+        with self._lock:
+            expired = [user_id for user_id, session in self._sessions.items()
+                       if session.last_seen <= idle_since and not session.active]
+            for user_id in expired:
+                del self._sessions[user_id]
+        return len(expired)
+
+    def _state(self, user: User) -> Session:
+        with self._lock:
+            session = self._sessions.get(user.id)
+            if session is None:
+                session = self._sessions[user.id] = Session(user)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(user.id)
+            # Данные пользователя - из последней сверки справочника
+            session.user = user
+            session.last_seen = time.monotonic()
+            return session
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class QueryService:
+    """
+    Долгоживущий HTTP+JSON сервис поверх smart_line
+
+    Пулы подключений, HTTP-сессия LLM, схема и кэши создаются один раз и живут
+    между запросами. Вызовы LLM и БД выполняются в пуле потоков и ограничены
+    отдельными семафорами, как в batch.py. Нагрузку сверх max_in_flight сервис
+    не ставит в очередь, а сразу отвечает 503 с Retry-After; одному
+    пользователю доступно не больше per_user одновременных запросов (429).
+
+    Эндпоинты:
+        POST /auth    {first_name, last_name, email, username} -> {token, expires_in, user}
+        POST /ask     {prompt, format: 'json' | 'csv' | 'parquet' | 'arrow'} -> страница строк или файл
+        POST /next    {next} -> следующая страница
+        POST /logout
+        GET  /health
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8080, session_ttl: float = 900.0,
+                 max_in_flight: int = 64, per_user: int = 4, llm_concurrency: int = 4, db_concurrency: int = 8):
+        """
+        Args:
+            host: Адрес сервера
+            port: Порт сервера
+            session_ttl: Время жизни токена сессии, сек
+            max_in_flight: Максимум одновременно обрабатываемых запросов
+            per_user: Максимум одновременных запросов одного пользователя
+            llm_concurrency: Одновременных обращений к LLM
+            db_concurrency: Одновременных запросов к БД
+        """
+        self.host = host
+        self.port = port
+        self.max_in_flight = max_in_flight
+        self.per_user = per_user
+        self.llm_concurrency = llm_concurrency
+        self.db_concurrency = db_concurrency
+
+        self.authenticator = UserAuthenticator(db_config)
+        self.sessions = SessionStore(SessionTokens(ttl=session_ttl), self.authenticator.directory)
+        # Тот же пул только на чтение, что у execute_sql: его состояние и показывает /health
+        self.db_manager = DatabaseManager(db_config, use_sqlalchemy=False, pooled=True, pool_config={'readonly': True},
+                                          replicas=db_replicas, replica_config=replica_config)
+
+        self._in_flight = 0
+        self._server = None
+        self._llm_slots = None
+        self._db_slots = None
+        self._started_at = time.time()
+        self._stats = {'requests': 0, 'rejected_busy': 0, 'rejected_user': 0, 'errors': 0}
+        self.logger = logging.getLogger(__name__)
+
+    async def start(self):
+        """Прогрев и запуск сервера в текущем цикле событий"""
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.llm_concurrency + self.db_concurrency))
+        self._llm_slots = asyncio.Semaphore(self.llm_concurrency)
+        self._db_slots = asyncio.Semaphore(self.db_concurrency)
+
+        await asyncio.to_thread(self._warm_up)
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                  limit=MAX_HEADER_BYTES)
+        loop.create_task(self._purge_sessions())
+        self.logger.info(f"Query service listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _warm_up(self):
+        '''
+            подключения, справочник пользователей, схема и клиент LLM готовятся до первого запроса
+        '''
+        self.db_manager.test_connection()
+        self.authenticator.directory.refresh()
+        schema_provider.get_version()
+        try:
+            get_llm_client()
+            get_model_router()
+        except KeyError:
+            self.logger.warning("LLAMA_API_KEY is not set, LLM paths will fail until it is configured")
+
+    async def _purge_sessions(self):
+        while True:
+            await asyncio.sleep(60)
+            self.sessions.purge()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), IDLE_TIMEOUT)
+                except HTTPError as e:
+                    await self._write_json(writer, e.status, {'error': e.message}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, method, path, headers, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None
+            raise
+        except asyncio.LimitOverrunError:
+            raise HTTPError(413, "Request headers are too large")
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            raise HTTPError(400, "Malformed Content-Length header")
+        if length < 0:
+            raise HTTPError(400, "Malformed Content-Length header")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, "Request body is too large")
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target.split('?', 1)[0], headers, body
+
+    async def _respond(self, writer: asyncio.StreamWriter, method: str, path: str, headers: Dict[str, str],
+                       body: bytes, keep_alive: bool):
+        self._stats['requests'] += 1
+        started = time.monotonic()
+        status = 200
+        try:
+            if path == '/health' and method == 'GET':
+                await self._write_json(writer, 200, self.health(), keep_alive)
+                return
+
+            routes = {'/auth': self._auth, '/ask': self._ask, '/next': self._next, '/logout': self._logout}
+            handler = routes.get(path)
+            if handler is None:
+                raise HTTPError(404, f"Unknown endpoint {path}")
+            if method != 'POST':
+                raise HTTPError(405, "Use POST")
+
+            # Сверх лимита запрос не ждет в очереди: клиент сам повторит позже
+            if self._in_flight >= self.max_in_flight:
+                self._stats['rejected_busy'] += 1
+                raise HTTPError(503, "Service is busy, retry later", {'Retry-After': '1'})
+
+            self._in_flight += 1
+            try:
+                payload = self._parse_json(body)
+                with span(f"http{path}"):
+                    result = await handler(payload, headers)
+            finally:
+                self._in_flight -= 1
+
+            if isinstance(result, str):
+                await self._write_file(writer, result, keep_alive)
+            else:
+                await self._write_json(writer, 200, result, keep_alive)
+        except HTTPError as e:
+            status = e.status
+            await self._write_json(writer, e.status, {'error': e.message}, keep_alive, e.headers)
+        except Exception as e:
+            status = 500
+            self._stats['errors'] += 1
+            self.logger.exception(f"Request {method} {path} failed: {e}")
+            await self._write_json(writer, 500, {'error': f"{type(e).__name__}: {e}"}, keep_alive)
+        finally:
+            self.logger.info(f"{method} {path} {status} {time.monotonic() - started:.3f}s")
+
+    @staticmethod
+    def _parse_json(body: bytes) -> Dict[str, Any]:
+        if not body:
+            return {}
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            raise HTTPError(400, "Body is not valid JSON")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "Body must be a JSON object")
+        return payload
+
+    @staticmethod
+    def _token(headers: Dict[str, str]) -> str:
+        authorization = headers.get('authorization', '')
+        return authorization[7:] if authorization.lower().startswith('bearer ') else ''
+
+    async def _session(self, headers: Dict[str, str]) -> Session:
+        token = self._token(headers)
+        # Проверка токена может сверять справочник с users - в поток, как и вход
+        session = await asyncio.to_thread(self.sessions.get, token) if token else None
+        if session is None:
+            raise HTTPError(401, "Missing or expired session token")
+        return session
+
+    async def _auth(self, payload: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+        fields = ('first_name', 'last_name', 'email', 'username')
+        if not all(isinstance(payload.get(field), str) and payload[field].strip() for field in fields):
+            raise HTTPError(400, f"Required fields: {', '.join(fields)}")
+
+        # Вход - поиск в справочнике; в поток уходит из-за редкой сверки справочника с users
+        user = await asyncio.to_thread(self.authenticator.authenticate, *(payload[field].strip() for field in fields))
+        if user is None:
+            raise HTTPError(401, "User not found")
+
+        return {'token': self.sessions.create(user), 'expires_in': int(self.sessions.ttl), 'user': user.to_dict()}
+
+    async def _logout(self, payload: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+        await self._session(headers)
+        self.sessions.drop(self._token(headers))
+        return {'ok': True}
+
+    async def _ask(self, payload: Dict[str, Any], headers: Dict[str, str]):
+        session = await self._session(headers)
+        prompt = payload.get('prompt')
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise HTTPError(400, "Field 'prompt' is required")
+        output_format = payload.get('format', 'json')
+        if not isinstance(output_format, str) or (output_format != 'json' and output_format not in FILE_FORMATS):
+            raise HTTPError(400, f"Field 'format' must be one of: json, {', '.join(FILE_FORMATS)}")
+
+        if session.active >= self.per_user:
+            self._stats['rejected_user'] += 1
+            raise HTTPError(429, f"At most {self.per_user} concurrent requests per user", {'Retry-After': '1'})
+        session.active += 1
+        try:
+            return await self._answer(session, prompt.strip(), output_format)
+        finally:
+            session.active -= 1
+
+    async def _answer(self, session: Session, prompt: str, output_format: str):
+        '''
+            план -> SQL -> выполнение, как execute_prompt, но с семафорами LLM и БД;
+            для файловых форматов возвращает путь к временному файлу, который отправляется клиенту и удаляется
+        '''
+        user = session.user
+        async with self._llm_slots:
+            sql_query, info = await asyncio.to_thread(generate_sql, prompt, user)
+        if not sql_query:
+            return {'path': info['path'], 'sql': None, 'rows': [], 'row_count': 0, 'next': None}
+
+        output_file = None
+        if output_format in FILE_FORMATS:
+            descriptor, output_file = tempfile.mkstemp(prefix='smart_line_', suffix=FILE_FORMATS[output_format][0])
+            os.close(descriptor)
+
+        try:
+            try:
+                row_count, rows, next_cursor, seconds = await self._execute(sql_query, output_file, info['params'],
+                                                                            page_key=info['page_key'])
+            except QueryRejected as e:
+                if info['path'] not in LLM_PATHS:
+                    raise HTTPError(422, f"Query rejected: {e.reason}")
+                # Одна попытка попросить модель переписать тяжелый запрос
+                async with self._llm_slots:
+                    rewritten = await asyncio.to_thread(rewrite_sql_query, prompt, sql_query, e.reason, user)
+                sql_query = extract_sql(rewritten)
+                if not sql_query:
+                    raise HTTPError(422, f"Query rejected: {e.reason}")
+                try:
+                    row_count, rows, next_cursor, seconds = await self._execute(sql_query, output_file, info['params'])
+                except QueryRejected as e:
+                    raise HTTPError(422, f"Query rejected: {e.reason}")
+        except BaseException:
+            if output_file:
+                os.remove(output_file)
+            raise
+
+        log_executed_sql(sql_query, info['params'], info['path'], seconds)
+        if info['path'] in LLM_PATHS:
+            cache_sql(prompt, user, sql_query)
+
+        if output_file:
+            return output_file
+
+        next_id = None
+        if next_cursor:
+            next_id = secrets.token_urlsafe(12)
+            session.continuations[next_id] = {'sql': sql_query, 'params': info['params'], 'cursor': next_cursor}
+            while len(session.continuations) > MAX_CONTINUATIONS:
+                session.continuations.popitem(last=False)
+
+        return {'path': info['path'], 'sql': sql_query, 'row_count': row_count, 'rows': rows, 'next': next_id,
+                'timings': {stage: round(seconds, 3) for stage, seconds in info['timings'].items()}}
+
+    async def _execute(self, sql_query: str, output_file: Optional[str], params, cursor: Optional[str] = None,
+                       page_key: Optional[str] = None):
+        started = time.monotonic()
+        async with self._db_slots:
+            row_count, rows, next_cursor = await asyncio.to_thread(execute_sql, sql_query, output_file, params, cursor,
+                                                                   page_key)
+        return row_count, rows, next_cursor, time.monotonic() - started
+
+    async def _next(self, payload: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+        session = await self._session(headers)
+        if not isinstance(payload.get('next'), str):
+            raise HTTPError(400, "Field 'next' is required")
+        continuation = session.continuations.pop(payload['next'], None)
+        if continuation is None:
+            raise HTTPError(404, "Unknown or already used page token")
+
+        row_count, rows, next_cursor, _ = await self._execute(continuation['sql'], None, continuation['params'],
+                                                              continuation['cursor'])
+        next_id = None
+        if next_cursor:
+            next_id = secrets.token_urlsafe(12)
+            session.continuations[next_id] = {**continuation, 'cursor': next_cursor}
+        return {'row_count': row_count, 'rows': rows, 'next': next_id}
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            'uptime_seconds': round(time.time() - self._started_at, 1),
+            'in_flight': self._in_flight,
+            'max_in_flight': self.max_in_flight,
+            'sessions': len(self.sessions),
+            'users': len(self.authenticator.directory),
+            'requests': dict(self._stats),
+            'db_pool': self.db_manager.pool_stats(),
+            'sql_cache': sql_cache.stats(),
+            'result_cache': result_cache.stats() if result_cache is not None else None,
+            'models': get_model_router().stats(),
+            'single_flight': {flights.name: flights.stats() for flights in (llm_flights, db_flights) if flights},
+            'prepared_statements': prepared_statement_stats(),
+            'db_replicas': self.db_manager.replica_stats(),
+        }
+
+    @staticmethod
+    async def _write_json(writer: asyncio.StreamWriter, status: int, data: Dict[str, Any], keep_alive: bool,
+                          headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(data, ensure_ascii=False, default=str).encode('utf-8')
+        QueryService._write_head(writer, status, 'application/json; charset=utf-8', len(body), keep_alive, headers)
+        writer.write(body)
+        await writer.drain()
+
+    @staticmethod
+    async def _write_file(writer: asyncio.StreamWriter, path: str, keep_alive: bool):
+        '''
+            отдает файл кусками: drain после каждого куска не дает медленному клиенту раздуть буфер
+        '''
+        content_type = next((content_type for extension, content_type in FILE_FORMATS.values()
+                             if path.endswith(extension)), 'application/octet-stream')
+        try:
+            QueryService._write_head(writer, 200, content_type, os.path.getsize(path), keep_alive)
+            with open(path, 'rb') as f:
+                while chunk := f.read(FILE_CHUNK_SIZE):
+                    writer.write(chunk)
+                    await writer.drain()
+        finally:
+            os.remove(path)
+
+    @staticmethod
+    def _write_head(writer: asyncio.StreamWriter, status: int, content_type: str, length: int, keep_alive: bool,
+                    headers: Optional[Dict[str, str]] = None):
+        lines = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+                 f"Content-Type: {content_type}",
+                 f"Content-Length: {length}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="HTTP-сервис ответов на промпты (клиент - main.py)")
+    parser.add_argument('--host', default=os.environ.get('SERVICE_HOST', '127.0.0.1'), help="Адрес сервера")
+    parser.add_argument('--port', type=int, default=int(os.environ.get('SERVICE_PORT', 8080)), help="Порт сервера")
+    parser.add_argument('--session-ttl', type=float, default=float(os.environ.get('SESSION_TTL', 900)),
+                        help="Время жизни токена сессии, сек")
+    parser.add_argument('--max-in-flight', type=int, default=64, help="Одновременных запросов, сверх - 503")
+    parser.add_argument('--per-user', type=int, default=4, help="Одновременных запросов одного пользователя, сверх - 429")
+    parser.add_argument('--llm-concurrency', type=int, default=4, help="Одновременных запросов к LLM")
+    parser.add_argument('--db-concurrency', type=int, default=8, help="Одновременных запросов к БД")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_args()
+
+    service = QueryService(args.host, args.port, args.session_ttl, args.max_in_flight, args.per_user,
+                           args.llm_concurrency, args.db_concurrency)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.cancel)
+        await service.start()
+        print(f"Сервис запущен: http://{args.host}:{args.port}")
+        try:
+            await stop
+        except asyncio.CancelledError:
+            pass
+        await service.stop()
+
+    try:
+        asyncio.run(main())
+    finally:
+        close_all_pools()
+        print("Сервис остановлен")
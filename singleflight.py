@@ -0,0 +1,78 @@
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+from tracing import annotate
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Объединение одновременных одинаковых вызовов в один
+
+    Первый вызов с ключом (ведущий) выполняет функцию, остальные вызовы с тем же
+    ключом, пришедшие до его завершения, ждут и получают тот же результат или то
+    же исключение. После завершения ключ забывается: повторы позже - забота
+    кэшей (sql_cache, result_cache), здесь только то, что уже в полете.
+    Результат общий для всех ждущих, изменять его нельзя.
+    """
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name: Имя группы для статистики (например, 'llm' или 'db')
+        """
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+
+        self._in_flight: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, function: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            call = self._in_flight.get(key)
+            if call is None:
+                call = self._in_flight[key] = _Call()
+                leader = True
+                self.calls += 1
+            else:
+                leader = False
+                self.coalesced += 1
+
+        if not leader:
+            # Сэкономленный вызов попадает в smart_line_coalesced_total текущего span
+            annotate(coalesced=1)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = len(self._in_flight)
+        total = self.calls + self.coalesced
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': in_flight,
+            'saved_rate': round(self.coalesced / total, 4) if total else 0.0,
+        }
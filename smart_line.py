@@ -1,12 +1,28 @@
-import csv
-
 from auth import User
 
-import requests
 import json
 import os
+import threading
+import time
+from typing import Tuple, Optional, Dict, Any
+
+import psycopg2
 
-from database import DatabaseManager
+from database import DatabaseManager, parse_replicas
+from intents import IntentMatcher
+from llm_client import LLMError
+from model_router import get_model_router
+from query_guard import QueryGuard, QueryRejected
+from result_cache import ResultCache, referenced_tables
+from result_set import output_format
+from rollups import RollupPipeline, ROLLUP_TABLES
+from schema_provider import SchemaProvider, TABLE_KEYWORDS, TABLE_NOTES
+from singleflight import SingleFlight
+from sql_fingerprint import fingerprint
+from sql_cache import SqlCache
+from sql_extractor import extract_sql, has_sql, SqlStreamParser
+from task_graph import TaskGraph, GraphQuery, GraphCycleError, match_graph_prompt
+from tracing import span, traced, annotate
 
 db_config = {
     'host': 'localhost',
@@ -16,7 +32,83 @@ db_config = {
     'password': 'postgres'
 }
 
+# Кэш сгенерированных SQL переживает перезапуск процесса
+sql_cache = SqlCache(
+    path=os.environ.get('SQL_CACHE_PATH', '.cache/sql_cache.json'),
+    max_size=int(os.environ.get('SQL_CACHE_MAX_SIZE', 1000)),
+    ttl=float(os.environ.get('SQL_CACHE_TTL', 24 * 3600))
+)
+
+# Повторные SELECT отдаются из памяти, пока не поменяются прочитанные таблицы
+result_cache = None
+if os.environ.get('RESULT_CACHE', '1') != '0':
+    result_cache = ResultCache(
+        db_config,
+        max_bytes=int(os.environ.get('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+        mode=os.environ.get('RESULT_CACHE_MODE', 'notify')
+    )
+
+# Пороги проверки сгенерированного SQL перед выполнением
+guard_config = {
+    'max_cost': float(os.environ.get('QUERY_MAX_COST', 1_000_000)),
+    'max_rows': float(os.environ.get('QUERY_MAX_ROWS', 5_000_000)),
+    'statement_timeout_ms': int(os.environ.get('QUERY_TIMEOUT_MS', 30_000)),
+    'page_size': int(os.environ.get('QUERY_PAGE_SIZE', 1000)),
+}
+
+# Сколько подготовленных запросов держать на каждом подключении пула (0 - не готовить)
+prepared_cache_size = int(os.environ.get('PREPARED_STATEMENTS', 100))
+
+# Реплики для запросов на чтение: DB_REPLICAS="host:port,host:port" (остальные параметры - как у db_config).
+# Недоступная или отставшая больше DB_REPLICA_MAX_LAG секунд реплика пропускается, без реплик - основная БД
+db_replicas = parse_replicas(os.environ.get('DB_REPLICAS', ''), db_config)
+replica_config = {
+    'balance': os.environ.get('DB_REPLICA_BALANCE', 'least_connections'),
+    'max_lag_seconds': float(os.environ.get('DB_REPLICA_MAX_LAG', 10)),
+    'check_interval': float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', 5)),
+}
+
+# Типовые вопросы отвечаются по локальным шаблонам, без LLM;
+# "Задачи про ..." ищутся по полнотекстовому индексу (migrations/006_task_search.sql), TASK_SEARCH=0 - выключить
+intent_matcher = IntentMatcher(min_confidence=float(os.environ.get('INTENT_MIN_CONFIDENCE', 0.8)),
+                               full_text_search=os.environ.get('TASK_SEARCH', '1') != '0')
+
+# Журнал выполненных запросов: по нему index_advisor.py подбирает недостающие индексы
+generated_sql_log = os.environ.get('GENERATED_SQL_LOG', '.cache/generated_sql.jsonl')
+_generated_sql_log_lock = threading.Lock()
+
+# Вопросы о зависимостях задач (блокеры, порядок, критический путь, циклы) отвечаются графом в памяти
+task_graph = None
+if os.environ.get('TASK_GRAPH', '1') != '0':
+    task_graph = TaskGraph(DatabaseManager(db_config, use_sqlalchemy=False, pooled=True),
+                           min_refresh_interval=float(os.environ.get('TASK_GRAPH_REFRESH_SECONDS', 1.0)))
+
+# Агрегаты по task_history дообновляются перед запросом, который их читает
+rollup_pipeline = None
+if os.environ.get('ROLLUPS', '1') != '0':
+    rollup_pipeline = RollupPipeline(DatabaseManager(db_config, use_sqlalchemy=False, pooled=True),
+                                     min_refresh_interval=float(os.environ.get('ROLLUPS_REFRESH_SECONDS', 5.0)))
+
+# Схема читается из БД при первом промпте и дальше берется из памяти; пока БД недоступна,
+# используется статическая схема, а чтение из БД повторяется раз в SCHEMA_RETRY_SECONDS
+schema_provider = SchemaProvider(DatabaseManager(db_config, use_sqlalchemy=False, pooled=True),
+                                 retry_interval=float(os.environ.get('SCHEMA_RETRY_SECONDS', 30)))
+
+# SQL от модели читается потоком: генерация обрывается, как только закрыт блок с запросом,
+# а проигравший хеджированный запрос (model_router.py) - на следующем фрагменте
+llm_stream = os.environ.get('LLM_STREAM', '1') != '0'
 
+# Одинаковые промпты одного пользователя и одинаковые SELECT, пришедшие одновременно,
+# выполняются один раз: остальные ждут результат уже идущего вызова
+llm_flights = None
+db_flights = None
+if os.environ.get('SINGLE_FLIGHT', '1') != '0':
+    llm_flights = SingleFlight('llm')
+    db_flights = SingleFlight('db')
+
+
+
+@traced('create_sql_plan')
 def create_sql_plan(prompt: str, user: User):
     '''
         эта функция для того, чтобы составить список простых подзапросов на естественном языке и порядок их выполнения
@@ -26,44 +118,7 @@ def create_sql_plan(prompt: str, user: User):
     request = f'''
         Найти: {prompt}
         Структура базы данных:
-            task_db structure:
-            1. users(id, department_id, username,email, first_name, last_name, position, is_manager, is_active, created_at, 
-                    updated_at)
-            Indexes:
-                "users_pkey" PRIMARY KEY, btree (id)
-                "users_email_key" UNIQUE CONSTRAINT, btree (email)
-                "users_username_key" UNIQUE CONSTRAINT, btree (username)
-            2. companies(id, name, description, created_at, updated_at)
-            Indexes:
-                "companies_pkey" PRIMARY KEY, btree (id)
-            3. departments(id, company_id, parent_department_id, name,description, created_at, updated_at)
-            Indexes:
-                "departments_pkey" PRIMARY KEY, btree (id)
-            4. tasks(id, title, description, status, priority, assigned_user_id, assigned_department_id, created_by_user_id, 
-                    due_date, start_date, completed_date, created_at,updated_at)
-            Indexes:
-                "tasks_pkey" PRIMARY KEY, btree (id)
-            5. task_dependencies(id, task_id_1, task_id_2, created_at, created_by_user_id)
-            Indexes:
-                "task_dependencies_pkey" PRIMARY KEY, btree (id)
-                "task_dependencies_task_id_1_task_id_2_key" UNIQUE CONSTRAINT, btree (task_id_1, task_id_2)
-            6. task_history(id, task_id, changed_by_user_id, field_name, old_value, new_value, changed_at)
-            Indexes:
-                "task_history_pkey" PRIMARY KEY, btree (id)
-            foreign_keys_relationship
-                table_name     |      column_name       | foreign_table_name | foreign_column_name |              constraint_nam
-            -------------------+------------------------+--------------------+---------------------+----------------------------
-             departments       | company_id             | companies          | id                  | departments_company_id_fkey
-             departments       | parent_department_id   | departments        | id                  | departments_parent_department_id_fkey
-             task_dependencies | created_by_user_id     | users              | id                  | task_dependencies_created_by_user_id_fkey
-             task_dependencies | task_id_1              | tasks              | id                  | task_dependencies_task_id_1_fkey
-             task_dependencies | task_id_2              | tasks              | id                  | task_dependencies_task_id_2_fkey
-             task_history      | changed_by_user_id     | users              | id                  | task_history_changed_by_user_id_fkey
-             task_history      | task_id                | tasks              | id                  | task_history_task_id_fkey
-             tasks             | assigned_department_id | departments        | id                  | tasks_assigned_department_id_fkey
-             tasks             | assigned_user_id       | users              | id                  | tasks_assigned_user_id_fkey
-             tasks             | created_by_user_id     | users              | id                  | tasks_created_by_user_id_fkey
-             users             | department_id          | departments        | id                  | users_department_id_fkey
+            {schema_provider.context_for(prompt)}
              
         Пользователь, который написал этот запрос:
             {user}
@@ -95,35 +150,14 @@ def create_sql_plan(prompt: str, user: User):
                 Выбрать итоговые поля
     '''
 
-    # Настройка аутентификации
-    api_url = "https://openrouter.ai/api/v1/chat/completions"
-    api_key = os.environ['LLAMA_API_KEY']
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-
-    # Подготовка сообщений
-    payload = {
-        "model": "deepseek/deepseek-r1-0528:free",
-        "messages": [
-            {"role": "user", "content": request}
-        ],
-        "max_tokens": 200
-    }
-
-    # Выполнение запроса
-    response = requests.post(api_url, headers=headers, data=json.dumps(payload))
-
-    # Handle the response
-    if response.status_code == 200:
-        result = response.json()
-        return result["choices"][0]["message"]["content"]
-    else:
-        print(f"Error: Request failed with status {response.status_code}")
+    try:
+        return get_model_router().complete(request, max_tokens=200, stream=llm_stream)
+    except LLMError as e:
+        print(f"Error: {e}")
         return ''
 
 
+@traced('make_sql_query')
 def make_sql_query(prompt: str, sql_plan: str, user: User) -> str:
     '''
         эта функция для создания запроса SQL из списка подзапросов, которые были созданы в функции create_sql_plan
@@ -132,44 +166,7 @@ def make_sql_query(prompt: str, sql_plan: str, user: User) -> str:
     request = f'''
             Найти: {prompt}
             Структура базы данных:
-                task_db structure:
-                1. users(id, department_id, username,email, first_name, last_name, position, is_manager, is_active, created_at, 
-                        updated_at)
-                Indexes:
-                    "users_pkey" PRIMARY KEY, btree (id)
-                    "users_email_key" UNIQUE CONSTRAINT, btree (email)
-                    "users_username_key" UNIQUE CONSTRAINT, btree (username)
-                2. companies(id, name, description, created_at, updated_at)
-                Indexes:
-                    "companies_pkey" PRIMARY KEY, btree (id)
-                3. departments(id, company_id, parent_department_id, name,description, created_at, updated_at)
-                Indexes:
-                    "departments_pkey" PRIMARY KEY, btree (id)
-                4. tasks(id, title, description, status, priority, assigned_user_id, assigned_department_id, created_by_user_id, 
-                        due_date, start_date, completed_date, created_at,updated_at)
-                Indexes:
-                    "tasks_pkey" PRIMARY KEY, btree (id)
-                5. task_dependencies(id, task_id_1, task_id_2, created_at, created_by_user_id)
-                Indexes:
-                    "task_dependencies_pkey" PRIMARY KEY, btree (id)
-                    "task_dependencies_task_id_1_task_id_2_key" UNIQUE CONSTRAINT, btree (task_id_1, task_id_2)
-                6. task_history(id, task_id, changed_by_user_id, field_name, old_value, new_value, changed_at)
-                Indexes:
-                    "task_history_pkey" PRIMARY KEY, btree (id)
-                foreign_keys_relationship
-                    table_name     |      column_name       | foreign_table_name | foreign_column_name |              constraint_nam
-                -------------------+------------------------+--------------------+---------------------+----------------------------
-                 departments       | company_id             | companies          | id                  | departments_company_id_fkey
-                 departments       | parent_department_id   | departments        | id                  | departments_parent_department_id_fkey
-                 task_dependencies | created_by_user_id     | users              | id                  | task_dependencies_created_by_user_id_fkey
-                 task_dependencies | task_id_1              | tasks              | id                  | task_dependencies_task_id_1_fkey
-                 task_dependencies | task_id_2              | tasks              | id                  | task_dependencies_task_id_2_fkey
-                 task_history      | changed_by_user_id     | users              | id                  | task_history_changed_by_user_id_fkey
-                 task_history      | task_id                | tasks              | id                  | task_history_task_id_fkey
-                 tasks             | assigned_department_id | departments        | id                  | tasks_assigned_department_id_fkey
-                 tasks             | assigned_user_id       | users              | id                  | tasks_assigned_user_id_fkey
-                 tasks             | created_by_user_id     | users              | id                  | tasks_created_by_user_id_fkey
-                 users             | department_id          | departments        | id                  | users_department_id_fkey
+                {schema_provider.context_for(prompt)}
 
             Пользователь, который написал этот запрос:
                 {user}
@@ -182,59 +179,342 @@ def make_sql_query(prompt: str, sql_plan: str, user: User) -> str:
             Ожидаемый формат ответа (без комментариев, ):
                 SQL-запрос
         '''
-    # Настройка аутентификации
-    api_url = "https://openrouter.ai/api/v1/chat/completions"
-    api_key = os.environ['LLAMA_API_KEY']
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-
-    # Подготовка сообщений
-    payload = {
-        "model": "deepseek/deepseek-r1-0528:free",
-        "messages": [
-            {"role": "user", "content": request}
-        ],
-        "max_tokens": 400
-    }
-
-    # Выполнение запроса
-    response = requests.post(api_url, headers=headers, data=json.dumps(payload))
-
-    # Handle the response
-    if response.status_code == 200:
-        result = response.json()
-        print(result["choices"][0]["message"]["content"])
-        return result["choices"][0]["message"]["content"]
+    try:
+        sql_query = get_model_router().complete(request, max_tokens=400, stream=llm_stream,
+                                                until_factory=SqlStreamParser, valid=has_sql)
+    except LLMError as e:
+        print(f"Error: {e}")
+        return ''
+
+    print(sql_query)
+    return sql_query
+
+
+
+@traced('make_sql_query_direct')
+def make_sql_query_direct(prompt: str, user: User) -> str:
+    '''
+        быстрый путь для простых промптов: план и SQL за один вызов LLM
+    '''
+    request = f'''
+            Найти: {prompt}
+            Структура базы данных:
+                {schema_provider.context_for(prompt)}
+
+            Пользователь, который написал этот запрос:
+                {user}
+
+            Задача: имея структуру БД и данные текущего пользователя, сначала мысленно определить нужные таблицы,
+                    условия и поля, затем написать один SQL запрос для изначального промпта.
+
+            Ожидаемый формат ответа (без комментариев и рассуждений):
+                SQL-запрос
+        '''
+    try:
+        sql_query = get_model_router().complete(request, max_tokens=400, stream=llm_stream,
+                                                until_factory=SqlStreamParser, valid=has_sql)
+    except LLMError as e:
+        print(f"Error: {e}")
+        return ''
+
+    print(sql_query)
+    return sql_query
+
+
+# Признаки агрегатов, сравнений и подзапросов - для них план нужен
+COMPLEX_MARKERS = (
+    'сравн', 'кажд', 'средн', 'процент', 'доля', 'долю', 'рейтинг', 'топ', 'больше чем', 'меньше чем',
+    'чаще', 'реже', 'кроме', 'без учета', 'динамик', 'распределени', 'группир',
+    'compare', 'each', 'average', 'percent', 'ratio', 'top', 'rank', 'except', 'per ',
+)
+
+SIMPLE_PROMPT_MAX_WORDS = 15
+
+
+def classify_prompt(prompt: str) -> str:
+    '''
+        решает, нужен ли промпту этап планирования:
+        'simple' - одна-две таблицы без агрегатов и сравнений, хватит одного вызова LLM,
+        'complex' - несколько таблиц или аналитика, нужен двухэтапный путь
+    '''
+    text = prompt.lower()
+
+    if len(text.split()) > SIMPLE_PROMPT_MAX_WORDS:
+        return 'complex'
+
+    if any(marker in text for marker in COMPLEX_MARKERS):
+        return 'complex'
+
+    # Служебные таблицы с подсказкой в схеме (например, иерархия отделов) запрос не усложняют
+    tables = [table for table, stems in TABLE_KEYWORDS.items()
+              if table not in TABLE_NOTES and any(stem in text for stem in stems)]
+    return 'simple' if len(tables) <= 2 else 'complex'
+
+
+def _coalesced(flights: Optional[SingleFlight], key, function, *args):
+    '''
+        вызов function через группу flights; без группы (SINGLE_FLIGHT=0) - напрямую
+    '''
+    if flights is None:
+        return function(*args)
+    return flights.do(key, function, *args)
+
+
+@traced('generate_sql')
+def generate_sql(prompt: str, user: User, fast_path: bool = True) -> Tuple[str, Dict[str, Any]]:
+    '''
+        возвращает SQL для промпта и сведения о том, как он получен:
+        info['path'] - 'intent' (локальный шаблон), 'graph' (граф зависимостей), 'cache',
+                       'fast' (один вызов LLM) или 'two_stage' (план + SQL),
+        info['params'] - параметры запроса (только для шаблонов и графа),
+        info['page_key'] - колонка для постраничного вывода по ключу (только для графа),
+        info['timings'] - длительность каждого этапа в секундах
+    '''
+    info = {'path': 'intent', 'params': None, 'page_key': None, 'timings': {}}
+
+    intent = intent_matcher.match(prompt, user)
+    if intent is not None:
+        info['intent'] = intent.name
+        info['params'] = intent.params
+        annotate(path=info['path'], intent=intent.name)
+        return intent.sql, info
+
+    graph_query = match_graph_prompt(prompt) if task_graph is not None else None
+    if graph_query is not None:
+        info['path'] = 'graph'
+        started = time.monotonic()
+        try:
+            sql_query, info['params'] = task_graph.to_sql(graph_query)
+        except GraphCycleError as e:
+            print(f"Порядок выполнения не определен, есть циклическая зависимость: {' -> '.join(map(str, e.cycle))}")
+            graph_query = GraphQuery('cycles', None)
+            sql_query, info['params'] = task_graph.to_sql(graph_query)
+        info['graph'] = graph_query.kind
+        # Ответы графа отсортированы по уникальной position: страницы идут по ней, без OFFSET
+        info['page_key'] = 'position'
+        info['timings']['graph'] = time.monotonic() - started
+        annotate(path=info['path'], graph=graph_query.kind)
+        return sql_query, info
+
+    info['path'] = 'cache'
+    cached_sql = sql_cache.get(prompt, user, schema_provider.get_version())
+    annotate(cache_hit=cached_sql is not None)
+    if cached_sql is not None:
+        annotate(path=info['path'])
+        return cached_sql, info
+
+    key = ('generate', sql_cache.normalize_prompt(prompt), str(user), fast_path)
+    sql_query, info['path'], timings = _coalesced(llm_flights, key, _generate_with_llm, prompt, user, fast_path)
+    info['timings'].update(timings)
+
+    annotate(path=info['path'])
+    return sql_query, info
+
+
+def _generate_with_llm(prompt: str, user: User, fast_path: bool) -> Tuple[str, str, Dict[str, float]]:
+    '''
+        SQL от модели: один вызов для простых промптов или план + SQL;
+        возвращает SQL, путь и длительности этапов
+    '''
+    timings = {}
+    if fast_path and classify_prompt(prompt) == 'simple':
+        path = 'fast'
+        started = time.monotonic()
+        sql_query = make_sql_query_direct(prompt, user)
+        timings['sql'] = time.monotonic() - started
     else:
-        print(f"Error: Request failed with status {response.status_code}")
+        path = 'two_stage'
+        started = time.monotonic()
+        sql_plan = create_sql_plan(prompt, user)
+        timings['plan'] = time.monotonic() - started
+
+        started = time.monotonic()
+        sql_query = make_sql_query(prompt, sql_plan, user)
+        timings['sql'] = time.monotonic() - started
+
+    return extract_sql(sql_query), path, timings
+
+
+@traced('rewrite_sql_query')
+def rewrite_sql_query(prompt: str, sql_query: str, reason: str, user: User) -> str:
+    '''
+        просит модель переписать SQL, который не прошел проверку плана (слишком дорогой или не только чтение)
+    '''
+    key = ('rewrite', sql_cache.normalize_prompt(prompt), str(user), sql_query, reason)
+    return _coalesced(llm_flights, key, _rewrite_sql_query, prompt, sql_query, reason, user)
+
+
+def _rewrite_sql_query(prompt: str, sql_query: str, reason: str, user: User) -> str:
+    request = f'''
+            Найти: {prompt}
+            Структура базы данных:
+                {schema_provider.context_for(prompt)}
+
+            Пользователь, который написал этот запрос:
+                {user}
+
+            Этот SQL-запрос был отклонен перед выполнением. Причина: {reason}
+                {sql_query}
+
+            Задача: переписать запрос так, чтобы он отвечал на тот же вопрос, только читал данные,
+                    не содержал декартовых произведений, соединял таблицы по внешним ключам
+                    и отбирал как можно меньше строк.
+
+            Ожидаемый формат ответа (без комментариев и рассуждений):
+                SQL-запрос
+        '''
+    try:
+        sql_query = get_model_router().complete(request, max_tokens=400, stream=llm_stream,
+                                                until_factory=SqlStreamParser, valid=has_sql)
+    except LLMError as e:
+        print(f"Error: {e}")
         return ''
 
+    print(sql_query)
+    return sql_query
 
 
-def execute_prompt(prompt: str, user: User, csvfile: str = None) -> None:
-    sql_plan = create_sql_plan(prompt, user)
-    sql_query = make_sql_query(prompt, sql_plan, user)
+# Пути, на которых SQL написан моделью и его стоит класть в кэш
+LLM_PATHS = ('fast', 'two_stage')
 
-    db_manager = DatabaseManager(db_config, use_sqlalchemy=False)
 
-    if not sql_query[6:len(sql_query)-3]:
-        print("Ничего не нашлось")
+def cache_sql(prompt: str, user: User, sql_query: str) -> None:
+    '''
+        сохраняет успешно выполненный SQL в кэш для текущей версии схемы
+    '''
+    sql_cache.put(prompt, user, schema_provider.get_version(), sql_query)
+
+
+def log_executed_sql(sql_query: str, params: Optional[tuple], path: str, seconds: float) -> None:
+    '''
+        дописывает выполненный запрос в журнал generated_sql_log (пустое значение отключает журнал)
+    '''
+    if not generated_sql_log:
         return
 
-    result = db_manager.execute_query(sql_query[6:len(sql_query)-3])
+    record = {'ts': time.time(), 'path': path, 'sql': sql_query, 'params': params, 'seconds': round(seconds, 4)}
+    line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+    with _generated_sql_log_lock:
+        directory = os.path.dirname(generated_sql_log)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(generated_sql_log, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+
+@traced('execute_sql')
+def execute_sql(sql_query: str, output_file: str = None, params: Optional[tuple] = None, cursor: Optional[str] = None,
+                page_key: Optional[str] = None) -> Tuple[int, Optional[list], Optional[str]]:
+    '''
+        проверяет SQL через EXPLAIN и выполняет его: при output_file выгружает результат в файл потоком
+        (формат по расширению: .parquet, .arrow/.feather, остальное - CSV),
+        иначе возвращает первую (или следующую по cursor) страницу строк (page_key - см. QueryGuard.run);
+        возвращает число строк, строки и курсор следующей страницы
+    '''
+    if rollup_pipeline is not None and referenced_tables(sql_query) & ROLLUP_TABLES:
+        try:
+            rollup_pipeline.refresh()
+        except (psycopg2.Error, RuntimeError) as e:
+            # Запрос все равно выполняется, агрегаты могут отставать от истории
+            print(f"Агрегаты по истории не обновлены: {e}")
+
+    # Литералы из сгенерированного SQL выносятся в параметры: запросы одной формы
+    # попадают в один подготовленный запрос (PREPARE) и в один ключ объединения
+    shape = fingerprint(sql_query, params)
+    sql_query, params = shape.sql, shape.params
+
+    # Сгенерированный SQL выполняется в транзакциях только на чтение: если проверка QueryGuard что-то
+    # пропустит (например, функцию с побочным эффектом), запись все равно не пройдет
+    db_manager = DatabaseManager(db_config, use_sqlalchemy=False, pooled=True, pool_config={'readonly': True},
+                                 result_cache=result_cache, prepared_cache_size=prepared_cache_size,
+                                 replicas=db_replicas, replica_config=replica_config)
+    guard = QueryGuard(db_manager, **guard_config)
+
+    if output_file:
+        guard.check(sql_query, params)
+        # Файл пишется потоком, не загружая весь результат в память;
+        # Parquet и Arrow - пачками строк, которые аналитики читают без разбора CSV
+        file_format = output_format(output_file)
+        with span('write_file', format=file_format) as write_span:
+            if file_format == 'csv':
+                with open(output_file, 'w', newline='', encoding='utf-8') as file:
+                    row_count = db_manager.export_csv(sql_query, file, params)
+            else:
+                with open(output_file, 'wb') as file:
+                    row_count = db_manager.export_columnar(sql_query, file, params, file_format)
+            write_span.set(rows=row_count, bytes=os.path.getsize(output_file))
+        return row_count, None, None
+
+    # Результат не зависит от пользователя: одинаковый запрос с теми же параметрами выполняется один раз
+    page = _coalesced(db_flights, (shape.key, repr(params), cursor, page_key), guard.run, sql_query, params, cursor,
+                      page_key)
+    annotate(rows=len(page.rows))
+    return len(page.rows), page.rows, page.next_cursor
 
-    if not result:
+
+@traced('prompt')
+def execute_prompt(prompt: str, user: User, output_file: str = None) -> Optional[Dict[str, Any]]:
+    '''
+        отвечает на промпт; если результат не поместился на одну страницу,
+        возвращает продолжение для show_next_page
+    '''
+    sql_query, info = generate_sql(prompt, user)
+    timings = ', '.join(f"{stage}: {seconds:.2f} с" for stage, seconds in info['timings'].items())
+    print(f"Путь генерации SQL: {info['path']}" + (f" ({timings})" if timings else ''))
+
+    if not sql_query:
         print("Ничего не нашлось")
-        return
+        return None
 
-    if csvfile:
-        with open(csvfile, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerows(result)
-    else:
-        print(result)
+    started = time.monotonic()
+    try:
+        row_count, result, next_cursor = execute_sql(sql_query, output_file, info['params'],
+                                                     page_key=info['page_key'])
+    except QueryRejected as e:
+        print(f"Запрос отклонен: {e.reason}")
+        if info['path'] not in LLM_PATHS:
+            return None
+
+        # Одна попытка попросить модель переписать тяжелый запрос
+        sql_query = extract_sql(rewrite_sql_query(prompt, sql_query, e.reason, user))
+        if not sql_query:
+            print("Ничего не нашлось")
+            return None
+        started = time.monotonic()
+        try:
+            row_count, result, next_cursor = execute_sql(sql_query, output_file, info['params'])
+        except QueryRejected as e:
+            print(f"Запрос отклонен: {e.reason}")
+            return None
 
+    log_executed_sql(sql_query, info['params'], info['path'], time.monotonic() - started)
 
+    # В кэш попадает только SQL, который успешно выполнился
+    if info['path'] in LLM_PATHS:
+        cache_sql(prompt, user, sql_query)
 
+    if not row_count:
+        print("Ничего не нашлось")
+        return None
+
+    if output_file:
+        return None
+
+    print(result)
+    if next_cursor:
+        print(f"Показаны первые {row_count} строк")
+        return {'sql': sql_query, 'params': info['params'], 'cursor': next_cursor}
+    return None
+
+
+@traced('next_page')
+def show_next_page(continuation: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    '''
+        печатает следующую страницу результата, возвращает продолжение или None
+    '''
+    row_count, result, next_cursor = execute_sql(continuation['sql'], params=continuation['params'],
+                                                 cursor=continuation['cursor'])
+    print(result)
+    if next_cursor:
+        return {**continuation, 'cursor': next_cursor}
+    return None
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+
+class SqlCache:
+    """
+    Кэш сгенерированных SQL-запросов с LRU-вытеснением, TTL и хранением на диске
+
+    Ключ кэша строится из нормализованного промпта, данных пользователя (ровно то,
+    что уходит в LLM) и хэша структуры БД. При изменении текста схемы весь кэш
+    сбрасывается автоматически.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_size: int = 1000, ttl: Optional[float] = 24 * 3600):
+        """
+        Args:
+            path: Путь к файлу кэша на диске (None - только в памяти)
+            max_size: Максимальное количество записей
+            ttl: Время жизни записи в секундах (None - без ограничения)
+        """
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.schema_hash = None
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def normalize_prompt(prompt: str) -> str:
+        """Приведение промпта к каноническому виду: регистр, пробелы, завершающая пунктуация"""
+        prompt = re.sub(r'\s+', ' ', prompt.strip().lower())
+        return prompt.rstrip(' ?!.')
+
+    @staticmethod
+    def hash_schema(schema: str) -> str:
+        return hashlib.sha256(schema.encode('utf-8')).hexdigest()
+
+    def make_key(self, prompt: str, user, schema_hash: str) -> str:
+        raw = '\x1f'.join((self.normalize_prompt(prompt), str(user), schema_hash))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, prompt: str, user, schema: str) -> Optional[str]:
+        """Получение SQL из кэша или None, если записи нет или она устарела"""
+        schema_hash = self.hash_schema(schema)
+        key = self.make_key(prompt, user, schema_hash)
+
+        with self._lock:
+            self._check_schema(schema_hash)
+
+            entry = self.entries.get(key)
+            if entry is not None and self._is_expired(entry):
+                del self.entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry['sql']
+
+    def put(self, prompt: str, user, schema: str, sql: str):
+        """Сохранение SQL в кэш с вытеснением самых старых записей"""
+        schema_hash = self.hash_schema(schema)
+        key = self.make_key(prompt, user, schema_hash)
+
+        with self._lock:
+            self._check_schema(schema_hash)
+
+            self.entries[key] = {'sql': sql, 'created_at': time.time()}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self._save()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+    def _is_expired(self, entry: Dict[str, Any]) -> bool:
+        return self.ttl is not None and time.time() - entry['created_at'] > self.ttl
+
+    def _check_schema(self, schema_hash: str):
+        """Сброс кэша, если структура БД поменялась"""
+        if self.schema_hash != schema_hash:
+            if self.entries:
+                self.entries.clear()
+                self._save()
+            self.schema_hash = schema_hash
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # Повреждённый файл кэша не должен ломать работу - начинаем с пустого
+            return
+
+        self.schema_hash = data.get('schema_hash')
+        for key, entry in data.get('entries', []):
+            if not self._is_expired(entry):
+                self.entries[key] = entry
+
+    def _save(self):
+        if not self.path:
+            return
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Пишем во временный файл и атомарно подменяем, чтобы не оставить обрезанный JSON
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'schema_hash': self.schema_hash, 'entries': list(self.entries.items())},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,170 @@
+import re
+from typing import Optional, List
+
+
+# Языки в заголовке блока кода, которые считаются SQL
+SQL_LANGUAGES = {'sql', 'postgresql', 'postgres', 'pgsql', 'psql', 'plpgsql'}
+
+THINK_BLOCK = re.compile(r'<think>.*?(?:</think>|\Z)', re.S | re.I)
+
+# Блок кода: ``` или ~~~, необязательный язык, тело до такой же закрывающей черты
+# (или до конца текста, если ответ оборвался на max_tokens)
+FENCE = re.compile(r'(`{3,}|~{3,})[ \t]*([A-Za-z]*)(.*?)(?:\1|\Z)', re.S)
+FENCE_LINE = re.compile(r'\s*(`{3,}|~{3,})[ \t]*([A-Za-z]*)(.*)')
+
+SQL_START = re.compile(r'^[ \t(]*(select|with)\b', re.I | re.M)
+
+# Строка пояснения после SQL: начинается с кириллицы или типичного начала фразы
+PROSE_START = re.compile(r'\s*([а-яё]|(this|the|here|note|explanation)\b)', re.I)
+
+# Комментарий в конце строки: ';' перед ним все равно завершает запрос
+TRAILING_COMMENT = re.compile(r'\s*--[^\']*$')
+
+
+def _strip_reasoning(text: str) -> str:
+    return THINK_BLOCK.sub('', text)
+
+
+def _looks_like_sql(body: str) -> bool:
+    lines = [line for line in body.strip().splitlines() if not line.strip().startswith('--')]
+    return bool(lines) and SQL_START.match(lines[0]) is not None
+
+
+def _is_prose(line: str) -> bool:
+    stripped = line.strip()
+    if not stripped or stripped.startswith('--'):
+        return False
+    return PROSE_START.match(stripped) is not None
+
+
+def _ends_statement(line: str) -> bool:
+    return TRAILING_COMMENT.sub('', line).rstrip().endswith(';')
+
+
+def _clean(sql: str) -> str:
+    return sql.strip().rstrip(';').strip()
+
+
+def _bare_sql(text: str) -> str:
+    '''
+        SQL без блока кода: от первой строки с SELECT/WITH до ';' в конце строки
+        или до первой строки пояснения
+    '''
+    match = SQL_START.search(text)
+    if match is None:
+        return ''
+
+    lines: List[str] = []
+    for line in text[match.start():].splitlines():
+        if lines and _is_prose(line):
+            break
+        if _ends_statement(line):
+            lines.append(TRAILING_COMMENT.sub('', line))
+            break
+        lines.append(line)
+    return _clean('\n'.join(lines))
+
+
+def extract_sql(text: Optional[str]) -> str:
+    '''
+        вырезает SQL из ответа модели: первый блок кода с SQL (```sql, ```postgresql, ```, ~~~),
+        а без блоков - запрос, начинающийся с SELECT/WITH; рассуждения в <think> и текст
+        до и после запроса отбрасываются; пустая строка, если SQL в ответе нет
+    '''
+    if not text:
+        return ''
+    text = _strip_reasoning(text)
+
+    for match in FENCE.finditer(text):
+        language, body = match.group(2), match.group(3)
+        if language and language.lower() not in SQL_LANGUAGES:
+            # ```SELECT ...``` в одну строку: "язык" на самом деле начало запроса
+            body = language + body
+        if _looks_like_sql(body):
+            return _clean(body)
+
+    return _bare_sql(text)
+
+
+def has_sql(text: Optional[str]) -> bool:
+    return bool(extract_sql(text))
+
+
+class SqlStreamParser:
+    """
+    Инкрементальный разбор потокового ответа модели: готов ли уже SQL
+
+    Вызывается с накопленным текстом после каждого фрагмента потока и
+    возвращает True, как только закрыт первый блок кода с SQL или запрос без
+    блока закончился ';' либо строкой пояснения. Разбираются только новые
+    строки; если текст начался заново (повтор запроса), разбор сбрасывается.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._consumed = 0
+        self._prefix = ''
+        self._in_think = False
+        self._fence: Optional[str] = None
+        self._body: List[str] = []
+        self._bare = False
+        self.done = False
+
+    def __call__(self, text: str) -> bool:
+        if not text.startswith(self._prefix):
+            self._reset()
+        if self.done:
+            return True
+
+        # Обрабатываются только завершенные строки, хвост ждет следующего фрагмента
+        end = text.rfind('\n') + 1
+        for line in text[self._consumed:end].splitlines():
+            if self._feed_line(line):
+                self.done = True
+                return True
+        self._consumed = max(self._consumed, end)
+        self._prefix = text[:self._consumed]
+
+        # Закрывающая черта блока часто приходит последним фрагментом без перевода строки
+        tail = text[self._consumed:].strip()
+        if self._fence is not None and tail == self._fence and _looks_like_sql('\n'.join(self._body)):
+            self.done = True
+        return self.done
+
+    def _feed_line(self, line: str) -> bool:
+        lowered = line.lower()
+        if self._in_think:
+            self._in_think = '</think>' not in lowered
+            return False
+        if '<think>' in lowered and '</think>' not in lowered:
+            self._in_think = True
+            return False
+
+        if self._fence is not None:
+            if line.strip() == self._fence:
+                if _looks_like_sql('\n'.join(self._body)):
+                    return True
+                # Блок без SQL (например, пример данных) - ждем следующий
+                self._fence, self._body = None, []
+                return False
+            self._body.append(line)
+            return False
+
+        match = FENCE_LINE.match(line)
+        if match is not None:
+            marker, language, rest = match.groups()
+            if language and language.lower() not in SQL_LANGUAGES:
+                rest = language + rest
+            if marker in rest:
+                return _looks_like_sql(rest[:rest.index(marker)])
+            self._fence, self._body, self._bare = marker, [rest] if rest.strip() else [], False
+            return False
+
+        if self._bare:
+            return _is_prose(line) or _ends_statement(line)
+        if SQL_START.match(line):
+            self._bare = True
+            return _ends_statement(line)
+        return False
@@ -0,0 +1,138 @@
+import hashlib
+import re
+from decimal import Decimal
+from typing import Optional, List, Any
+
+
+TOKEN = re.compile(r"""
+     (?P<comment>--[^\n]*|/\*.*?\*/)
+    |(?P<escaped>(?<!\w)[eE]'(?:[^'\\]|''|\\.)*')
+    |(?P<string>'(?:[^']|'')*')
+    |(?P<dollar>\$(?P<tag>[A-Za-z_]\w*)?\$.*?\$(?P=tag)?\$)
+    |(?P<quoted>"(?:[^"]|"")*")
+    |(?P<placeholder>%s)
+    |(?P<percent>%%)
+    |(?P<number>(?<![\w.])(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?(?![\w.]))
+    |(?P<word>[A-Za-z_][\w$]*)
+    |(?P<operator>::|[-+*/<>=~!@#^&|`?]+)
+    |(?P<space>\s+)
+    |(?P<other>.)
+""", re.S | re.X)
+
+NAMED_PLACEHOLDER = re.compile(r'%\(\w+\)s')
+
+# Вокруг этих знаков пробелы не ставятся: t.id, count(*), x::int, a, b
+NO_SPACE_BEFORE = {',', ')', '.', '::', '(', '[', ']'}
+NO_SPACE_AFTER = {'(', '.', '::', '['}
+
+# После этих слов строка - часть записи константы (INTERVAL '7 days'), параметром ее не заменить
+TYPED_LITERAL_WORDS = {'interval', 'date', 'time', 'timestamp', 'timestamptz'}
+
+# Числа в скобках после этих слов - модификаторы типа (numeric(10, 2)), а не значения
+TYPE_MODIFIER_WORDS = {'numeric', 'decimal', 'varchar', 'char', 'character', 'varying', 'bit', 'time',
+                       'timestamp', 'interval', 'float'}
+
+# Слова, которыми заканчивается ORDER BY / GROUP BY: числа в этих списках - номера колонок
+CLAUSE_WORDS = {'select', 'from', 'where', 'having', 'limit', 'offset', 'fetch', 'union', 'except',
+                'intersect', 'window', 'for', 'order', 'group'}
+
+
+class Fingerprint:
+    """
+    Форма запроса без значений: SQL с %s вместо литералов и сами значения
+
+    sql следует соглашению psycopg2: если params не пустые, символ % в тексте
+    удвоен. key - хэш формы, одинаковый у запросов, различающихся только
+    значениями, регистром ключевых слов, пробелами и комментариями.
+    """
+
+    __slots__ = ('sql', 'params', 'key')
+
+    def __init__(self, sql: str, params: tuple):
+        self.sql = sql
+        self.params = params
+        self.key = hashlib.sha1(sql.encode('utf-8')).hexdigest()
+
+
+def _literal_value(token: str) -> Any:
+    if token.startswith("'"):
+        return token[1:-1].replace("''", "'")
+    if re.fullmatch(r'\d+', token):
+        return int(token)
+    return Decimal(token)
+
+
+def fingerprint(sql: str, params: Optional[tuple] = None) -> Fingerprint:
+    '''
+        заменяет строковые и числовые литералы на %s и собирает их значения в params
+        (имеющиеся %s и их params сохраняются на своих местах); комментарии убираются,
+        пробелы схлопываются, слова вне кавычек приводятся к нижнему регистру.
+        Не трогаются константы с типом (INTERVAL '1 day'), модификаторы типов
+        и номера колонок в ORDER BY / GROUP BY; запрос с именованными параметрами
+        возвращается как есть
+    '''
+    sql = sql.strip()
+    if isinstance(params, dict) or NAMED_PLACEHOLDER.search(sql):
+        return Fingerprint(sql.rstrip(';').strip(), params)
+
+    given = list(params or ())
+    has_params = bool(params)
+    pieces: List[Any] = []     # строки текста и None на месте параметра
+    values: List[Any] = []
+
+    previous = ''              # последнее значимое слово или символ
+    parens: List[bool] = []    # для каждой открытой скобки: модификаторы ли это типа
+    by_depth: Optional[int] = None
+
+    for match in TOKEN.finditer(sql):
+        kind, token = match.lastgroup, match.group()
+        if kind in ('comment', 'space'):
+            continue
+
+        # Пробелы расставляются заново, чтобы форма не зависела от оформления запроса
+        if pieces and token not in NO_SPACE_BEFORE and previous not in NO_SPACE_AFTER:
+            pieces.append(' ')
+
+        if kind == 'placeholder':
+            pieces.append(None)
+            values.append(given.pop(0) if given else None)
+        elif kind == 'percent':
+            pieces.append('%' if has_params else '%%')
+        elif kind == 'string' and previous not in TYPED_LITERAL_WORDS:
+            value = _literal_value(token)
+            pieces.append(None)
+            values.append(value.replace('%%', '%') if has_params else value)
+        elif kind == 'number' and by_depth is None and not (parens and parens[-1]):
+            pieces.append(None)
+            values.append(_literal_value(token))
+        elif kind == 'word':
+            word = token.lower()
+            if word == 'by' and previous in ('order', 'group'):
+                by_depth = len(parens)
+            elif word in CLAUSE_WORDS and by_depth is not None and len(parens) <= by_depth:
+                by_depth = None
+            pieces.append(word)
+        elif kind in ('string', 'escaped', 'dollar', 'quoted'):
+            # Текст в кавычках сохраняется как есть (в шаблоне psycopg2 - без удвоенных %)
+            pieces.append(token.replace('%%', '%') if has_params else token)
+        else:
+            if token == '(':
+                parens.append(previous in TYPE_MODIFIER_WORDS)
+            elif token == ')' and parens:
+                parens.pop()
+                if by_depth is not None and len(parens) < by_depth:
+                    by_depth = None
+            pieces.append(token)
+
+        previous = token.lower() if kind == 'word' else token
+
+    # Завершающая ; убирается после токенизации: за ней может идти комментарий
+    while pieces and pieces[-1] in (';', ' '):
+        pieces.pop()
+
+    if not values:
+        return Fingerprint(''.join(pieces), None if params is None else tuple(params))
+
+    # С параметрами текст - шаблон psycopg2: одиночные % удваиваются
+    text = ''.join('%s' if piece is None else piece.replace('%', '%%') for piece in pieces)
+    return Fingerprint(text, tuple(values))
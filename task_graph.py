@@ -0,0 +1,498 @@
+import logging
+import re
+import threading
+import time
+import uuid
+from array import array
+from bisect import bisect_left
+from collections import deque
+from typing import Optional, Dict, List, Tuple, Iterable
+
+import psycopg2.errors
+
+from database import DatabaseManager
+from intents import TASK_COLUMNS
+
+
+# task_id_1 зависит от task_id_2: task_id_2 блокирует task_id_1 и должна быть выполнена раньше
+EDGES_QUERY = '''
+    SELECT id, task_id_1, task_id_2, COALESCE(created_at, '-infinity') AS created_at
+    FROM task_dependencies
+    WHERE (COALESCE(created_at, '-infinity'), id) > (%s, %s)
+      AND task_id_1 IS NOT NULL AND task_id_2 IS NOT NULL
+    ORDER BY 4, id
+'''
+
+EDGES_COUNT_QUERY = '''
+    SELECT count(*) AS edges
+    FROM task_dependencies
+    WHERE task_id_1 IS NOT NULL AND task_id_2 IS NOT NULL
+'''
+
+DURATIONS_QUERY = '''
+    SELECT id, status, start_date, due_date
+    FROM tasks
+    WHERE id = ANY(%s)
+'''
+
+# Порядок выполнения записывается один раз (migrations/007_task_graph_orders.sql),
+# и страницы читаются по ключу, а не передают весь список задач в каждом запросе
+ORDER_INSERT = '''
+    INSERT INTO task_graph_orders (order_key, position, task_id)
+    SELECT %s, g.position::int, g.task_id FROM unnest(%s::int[]) WITH ORDINALITY AS g(task_id, position)
+'''
+
+ORDER_CLEANUP = "DELETE FROM task_graph_orders WHERE created_at < now() - %s * INTERVAL '1 second'"
+
+ORDER_ROWS_SQL = (f"SELECT o.position, {TASK_COLUMNS} "
+                  f"FROM task_graph_orders o JOIN tasks t ON t.id = o.task_id "
+                  f"WHERE o.order_key = %s ORDER BY o.position")
+
+CLOSED_STATUSES = ('completed', 'cancelled')
+
+# Вопросы о зависимостях: (вид запроса, регулярка); порядок важен - более конкретные раньше.
+# "что блокирует задачУ 42" - блокеры задачи, "что блокирует задачА 42" - задачи, которые она держит
+GRAPH_PATTERNS = [
+    ('critical_path', r'критическ\w*\s+пут\w*|critical\s+path'),
+    ('cycles', r'цикл\w*|cycl\w*|circular'),
+    ('order', r'поряд\w*\s+(выполнени\w*|работ\w*)|в\s+каком\s+порядке|топологическ\w*|execution\s+order|topological'),
+    ('dependents', r'зависят\s+от|блокирует\s+задача\b|задача\s*(№|#)?\s*\d+\s+блокирует|ждут\s+задач\w*'
+                   r'|blocked\s+by\s+task|depend\w*\s+on\s+task|waiting\s+(for|on)\s+task'
+                   r'|task\s*#?\d+\s+blocks|does\s+task\s*#?\d+\s+block'),
+    ('blockers', r'блокиру\w*|блокер\w*|мешает|зависит|block\w*|depends|waits?\b'),
+]
+
+DEPENDENCY_CONTEXT = r'завис\w*|блокир\w*|depend\w*|block\w*'
+TASK_ID_PATTERN = r'(?:задач\w*|task)\s*(?:№|#|номер|number)?\s*(\d+)|#(\d+)'
+DIRECT_PATTERN = r'непосредственн\w*|напрямую|прям\w+|direct\w*|immediate\w*'
+
+
+class GraphCycleError(Exception):
+    """В графе зависимостей есть цикл, поэтому порядок выполнения не определен"""
+
+    def __init__(self, cycle: List[int]):
+        super().__init__(f"Dependency cycle: {' -> '.join(map(str, cycle))}")
+        self.cycle = cycle
+
+
+class GraphQuery:
+    """Распознанный вопрос о зависимостях: вид, задача и нужна ли транзитивность"""
+
+    def __init__(self, kind: str, task_id: Optional[int], transitive: bool = True):
+        self.kind = kind
+        self.task_id = task_id
+        self.transitive = transitive
+
+    def __repr__(self):
+        return f"GraphQuery({self.kind!r}, task_id={self.task_id}, transitive={self.transitive})"
+
+
+def match_graph_prompt(prompt: str) -> Optional[GraphQuery]:
+    '''
+        распознает вопросы о зависимостях задач, на которые отвечает граф, а не SQL:
+        что блокирует задачу N, что ждет задачу N, порядок выполнения, критический путь, циклы
+    '''
+    text = prompt.lower().replace('ё', 'е')
+
+    kind = next((kind for kind, pattern in GRAPH_PATTERNS if re.search(pattern, text)), None)
+    if kind is None:
+        return None
+
+    task_match = re.search(TASK_ID_PATTERN, text)
+    task_id = int(task_match.group(1) or task_match.group(2)) if task_match else None
+
+    if task_id is None:
+        # Без номера задачи - только вопросы про весь граф, и только если речь о зависимостях
+        if kind not in ('cycles', 'order') or not re.search(DEPENDENCY_CONTEXT, text):
+            return None
+    elif kind == 'cycles' and not re.search(DEPENDENCY_CONTEXT, text):
+        return None
+
+    return GraphQuery(kind, task_id, transitive=re.search(DIRECT_PATTERN, text) is None)
+
+
+class _CSR:
+    """Сжатые списки смежности: соседи вершины nodes[i] - targets[offsets[i]:offsets[i + 1]]"""
+
+    def __init__(self, nodes: array, sources: array, destinations: array):
+        self.nodes = nodes
+        self.offsets = array('l', [0]) * (len(nodes) + 1)
+        self.targets = array('i', [0]) * len(sources)
+
+        index = {node: position for position, node in enumerate(nodes)}
+        for source in sources:
+            self.offsets[index[source] + 1] += 1
+        for position in range(len(nodes)):
+            self.offsets[position + 1] += self.offsets[position]
+
+        cursor = array('l', self.offsets[:-1])
+        for source, destination in zip(sources, destinations):
+            position = index[source]
+            self.targets[cursor[position]] = destination
+            cursor[position] += 1
+
+    def neighbours(self, node: int) -> array:
+        position = bisect_left(self.nodes, node)
+        if position == len(self.nodes) or self.nodes[position] != node:
+            return array('i')
+        return self.targets[self.offsets[position]:self.offsets[position + 1]]
+
+
+class TaskGraph:
+    """
+    Граф зависимостей задач в памяти
+
+    Ребра task_dependencies хранятся в массивах: прямые (задача -> ее блокеры)
+    и обратные (задача -> кто ее ждет) списки смежности в формате CSR.
+    Новые ребра дочитываются по (created_at, id) и копятся в небольшой
+    добавке; когда добавка становится большой, CSR перестраивается целиком.
+    Если число ребер в БД не сходится (ребра удаляли), граф читается заново.
+    """
+
+    def __init__(self, db_manager: DatabaseManager, compact_ratio: float = 0.1, min_refresh_interval: float = 1.0,
+                 order_ttl: float = 3600.0):
+        """
+        Args:
+            db_manager: Менеджер БД, из которой читаются зависимости
+            compact_ratio: Доля новых ребер, после которой CSR перестраивается
+            min_refresh_interval: Не проверять БД на новые ребра чаще, чем раз в столько секунд
+            order_ttl: Сколько хранить записанный порядок выполнения в task_graph_orders, сек
+        """
+        self.db_manager = db_manager
+        self.compact_ratio = compact_ratio
+        self.min_refresh_interval = min_refresh_interval
+        self.order_ttl = order_ttl
+
+        self._sources = array('i')
+        self._destinations = array('i')
+        self._forward: Optional[_CSR] = None
+        self._reverse: Optional[_CSR] = None
+        self._delta_forward: Dict[int, List[int]] = {}
+        self._delta_reverse: Dict[int, List[int]] = {}
+        self._delta_edges = 0
+        self._watermark = ('-infinity', 0)
+        self._refreshed_at = 0.0
+        # task_id (None - весь граф) -> (состояние графа, ключ в task_graph_orders, когда записан)
+        self._orders: Dict[Optional[int], Tuple[tuple, str, float]] = {}
+        self._orders_table = True
+
+        self._lock = threading.RLock()
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self._sources)
+
+    def refresh(self, force: bool = False):
+        """Дочитывание новых ребер; полная перезагрузка, если ребра удалялись"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._forward is not None and now - self._refreshed_at < self.min_refresh_interval:
+                return
+            self._refreshed_at = now
+
+            self._read_new_edges()
+            total = self.db_manager.execute_query(EDGES_COUNT_QUERY)[0]['edges']
+            if total != len(self._sources):
+                self.logger.info(f"Dependency edges changed outside of inserts ({total} != {len(self._sources)}), "
+                                 f"reloading graph")
+                self._reset()
+                self._read_new_edges()
+
+            if self._forward is None or self._delta_edges > self.compact_ratio * max(len(self._sources), 1):
+                self._compact()
+
+    def _read_new_edges(self):
+        rows = self.db_manager.execute_query(EDGES_QUERY, self._watermark)
+        if self._forward is None:
+            # Первая загрузка сразу идет в CSR, добавка не нужна
+            self._sources.extend(row['task_id_1'] for row in rows)
+            self._destinations.extend(row['task_id_2'] for row in rows)
+        else:
+            for row in rows:
+                self._add_edge(row['task_id_1'], row['task_id_2'])
+        if rows:
+            self._watermark = (rows[-1]['created_at'], rows[-1]['id'])
+
+    def _reset(self):
+        self._sources = array('i')
+        self._destinations = array('i')
+        self._forward = None
+        self._reverse = None
+        self._delta_forward = {}
+        self._delta_reverse = {}
+        self._delta_edges = 0
+        self._watermark = ('-infinity', 0)
+
+    def _add_edge(self, task_id: int, blocker_id: int):
+        self._sources.append(task_id)
+        self._destinations.append(blocker_id)
+        self._delta_forward.setdefault(task_id, []).append(blocker_id)
+        self._delta_reverse.setdefault(blocker_id, []).append(task_id)
+        self._delta_edges += 1
+
+    def _compact(self):
+        """Перестроение CSR по всем ребрам, добавка очищается"""
+        started = time.monotonic()
+        nodes = array('i', sorted(set(self._sources) | set(self._destinations)))
+        self._forward = _CSR(nodes, self._sources, self._destinations)
+        self._reverse = _CSR(nodes, self._destinations, self._sources)
+        self._delta_forward = {}
+        self._delta_reverse = {}
+        self._delta_edges = 0
+        self.logger.info(f"Dependency graph compacted: {len(nodes)} tasks, {len(self._sources)} edges "
+                         f"in {time.monotonic() - started:.2f}s")
+
+    def _blockers_of(self, task_id: int) -> Iterable[int]:
+        extra = self._delta_forward.get(task_id)
+        neighbours = self._forward.neighbours(task_id)
+        return neighbours if not extra else list(neighbours) + extra
+
+    def _dependents_of(self, task_id: int) -> Iterable[int]:
+        extra = self._delta_reverse.get(task_id)
+        neighbours = self._reverse.neighbours(task_id)
+        return neighbours if not extra else list(neighbours) + extra
+
+    def _nodes(self) -> Iterable[int]:
+        known = set(self._forward.nodes)
+        return list(self._forward.nodes) + [node for node in
+                                            set(self._delta_forward) | set(self._delta_reverse) if node not in known]
+
+    def blockers(self, task_id: int, transitive: bool = True) -> List[Tuple[int, int]]:
+        """Задачи, которые блокируют task_id: (задача, расстояние), ближайшие первыми"""
+        with self._lock:
+            self.refresh()
+            return self._walk(task_id, self._blockers_of, transitive)
+
+    def dependents(self, task_id: int, transitive: bool = True) -> List[Tuple[int, int]]:
+        """Задачи, которые ждут task_id: (задача, расстояние), ближайшие первыми"""
+        with self._lock:
+            self.refresh()
+            return self._walk(task_id, self._dependents_of, transitive)
+
+    @staticmethod
+    def _walk(task_id: int, neighbours, transitive: bool) -> List[Tuple[int, int]]:
+        depth = {task_id: 0}
+        queue = deque([task_id])
+        result = []
+        while queue:
+            node = queue.popleft()
+            if not transitive and depth[node] == 1:
+                continue
+            for neighbour in neighbours(node):
+                if neighbour not in depth:
+                    depth[neighbour] = depth[node] + 1
+                    result.append((neighbour, depth[neighbour]))
+                    queue.append(neighbour)
+        return result
+
+    def topological_order(self, task_id: Optional[int] = None) -> List[int]:
+        """
+        Порядок выполнения: каждая задача после всех своих блокеров
+
+        Args:
+            task_id: Только задача и все ее блокеры; без него - весь граф
+
+        Raises:
+            GraphCycleError: среди задач есть циклическая зависимость
+        """
+        with self._lock:
+            self.refresh()
+            if task_id is None:
+                nodes = set(self._nodes())
+            else:
+                nodes = {task_id} | {node for node, _ in self._walk(task_id, self._blockers_of, True)}
+
+            remaining = {node: sum(1 for blocker in self._blockers_of(node) if blocker in nodes) for node in nodes}
+            queue = deque(sorted(node for node, count in remaining.items() if count == 0))
+            order = []
+            while queue:
+                node = queue.popleft()
+                order.append(node)
+                for dependent in self._dependents_of(node):
+                    if dependent in remaining:
+                        remaining[dependent] -= 1
+                        if remaining[dependent] == 0:
+                            queue.append(dependent)
+
+            if len(order) != len(nodes):
+                stuck = {node for node, count in remaining.items() if count > 0}
+                raise GraphCycleError(self._cycle_within(stuck))
+            return order
+
+    def cycles(self, limit: int = 100) -> List[List[int]]:
+        """Циклические зависимости: компоненты сильной связности (алгоритм Тарьяна без рекурсии)"""
+        with self._lock:
+            self.refresh()
+            index: Dict[int, int] = {}
+            low: Dict[int, int] = {}
+            on_stack = set()
+            stack: List[int] = []
+            found: List[List[int]] = []
+
+            for root in self._nodes():
+                if root in index:
+                    continue
+                work = [(root, iter(self._blockers_of(root)))]
+                index[root] = low[root] = len(index)
+                stack.append(root)
+                on_stack.add(root)
+
+                while work:
+                    node, neighbours = work[-1]
+                    advanced = False
+                    for neighbour in neighbours:
+                        if neighbour not in index:
+                            index[neighbour] = low[neighbour] = len(index)
+                            stack.append(neighbour)
+                            on_stack.add(neighbour)
+                            work.append((neighbour, iter(self._blockers_of(neighbour))))
+                            advanced = True
+                            break
+                        if neighbour in on_stack:
+                            low[node] = min(low[node], index[neighbour])
+                    if advanced:
+                        continue
+
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        if len(component) > 1 or node in self._blockers_of(node):
+                            found.append(sorted(component))
+                            if len(found) >= limit:
+                                return found
+            return found
+
+    def _cycle_within(self, nodes: set) -> List[int]:
+        """Один конкретный цикл среди вершин, которые не удалось упорядочить"""
+        node = min(nodes)
+        seen = []
+        while node not in seen:
+            seen.append(node)
+            node = next(blocker for blocker in self._blockers_of(node) if blocker in nodes)
+        return seen[seen.index(node):] + [node]
+
+    def critical_path(self, task_id: int) -> Tuple[List[int], Dict[int, int]]:
+        """
+        Самая длинная по срокам цепочка блокеров, которая заканчивается задачей task_id
+
+        Длительность задачи - дни от start_date до due_date (минимум 1, без дат - 1),
+        завершенные и отмененные задачи не занимают времени.
+
+        Returns:
+            Цепочка задач от первой к task_id и длительность каждой задачи в днях
+
+        Raises:
+            GraphCycleError: среди блокеров задачи есть цикл
+        """
+        with self._lock:
+            order = self.topological_order(task_id)
+            durations = self._durations(order)
+
+            total: Dict[int, int] = {}
+            previous: Dict[int, Optional[int]] = {}
+            nodes = set(order)
+            for node in order:
+                best = None
+                for blocker in self._blockers_of(node):
+                    if blocker in nodes and (best is None or total[blocker] > total[best]):
+                        best = blocker
+                previous[node] = best
+                total[node] = durations[node] + (total[best] if best is not None else 0)
+
+            path = []
+            node = task_id
+            while node is not None:
+                path.append(node)
+                node = previous[node]
+            path.reverse()
+            return path, {node: durations[node] for node in path}
+
+    def _order_key(self, task_id: Optional[int]) -> Optional[str]:
+        '''
+            ключ порядка выполнения в task_graph_orders: пока граф не менялся, записанный порядок
+            переиспользуется; None - таблицы нет (миграция 007 не применена)
+        '''
+        with self._lock:
+            if not self._orders_table:
+                return None
+            self.refresh()
+            state = (len(self._sources), self._watermark)
+            now = time.monotonic()
+            # Ключ отдается, только если строк хватит на досмотр страниц: половина order_ttl в запасе
+            self._orders = {key: entry for key, entry in self._orders.items() if now - entry[2] < self.order_ttl / 2}
+            entry = self._orders.get(task_id)
+            if entry is not None and entry[0] == state:
+                return entry[1]
+            order = self.topological_order(task_id)
+
+        order_key = uuid.uuid4().hex
+        try:
+            self.db_manager.execute_query(ORDER_CLEANUP, (self.order_ttl,))
+            self.db_manager.execute_query(ORDER_INSERT, (order_key, order))
+        except psycopg2.errors.UndefinedTable:
+            self.logger.warning("task_graph_orders is missing (migrations/007_task_graph_orders.sql), "
+                                "passing the execution order as an array")
+            self._orders_table = False
+            return None
+
+        with self._lock:
+            self._orders[task_id] = (state, order_key, now)
+        return order_key
+
+    def _durations(self, task_ids: List[int]) -> Dict[int, int]:
+        durations = {task_id: 1 for task_id in task_ids}
+        for row in self.db_manager.execute_query(DURATIONS_QUERY, (list(task_ids),)):
+            if row['status'] in CLOSED_STATUSES:
+                durations[row['id']] = 0
+            elif row['start_date'] and row['due_date']:
+                durations[row['id']] = max(1, (row['due_date'] - row['start_date']).days)
+        return durations
+
+    def to_sql(self, query: GraphQuery) -> Tuple[str, tuple]:
+        """
+        Ответ графа в виде SQL по задачам с готовым списком id, чтобы результат
+        проходил обычный путь: проверка плана, постраничный вывод, выгрузка в CSV
+        """
+        if query.kind == 'cycles':
+            cycles = self.cycles()
+            ids = [task_id for cycle in cycles for task_id in cycle]
+            numbers = [number for number, cycle in enumerate(cycles, start=1) for _ in cycle]
+            return self._rows_sql(('cycle',)), (ids, numbers)
+
+        if query.kind == 'order':
+            order_key = self._order_key(query.task_id)
+            if order_key is not None:
+                return ORDER_ROWS_SQL, (order_key,)
+            return self._rows_sql(()), (self.topological_order(query.task_id),)
+
+        if query.kind == 'critical_path':
+            path, durations = self.critical_path(query.task_id)
+            elapsed, finish = 0, []
+            for task_id in path:
+                elapsed += durations[task_id]
+                finish.append(elapsed)
+            return (self._rows_sql(('duration_days', 'finish_day')),
+                    (path, [durations[task_id] for task_id in path], finish))
+
+        walk = self.blockers if query.kind == 'blockers' else self.dependents
+        found = walk(query.task_id, query.transitive)
+        return self._rows_sql(('depth',)), ([task_id for task_id, _ in found], [depth for _, depth in found])
+
+    @staticmethod
+    def _rows_sql(extra_columns: Tuple[str, ...]) -> str:
+        arrays = ', '.join(['%s::int[]'] * (len(extra_columns) + 1))
+        names = ', '.join(('id',) + extra_columns)
+        extra = ''.join(f"g.{column}, " for column in extra_columns)
+        return (f"SELECT g.position, {extra}{TASK_COLUMNS} "
+                f"FROM unnest({arrays}) WITH ORDINALITY AS g({names}, position) "
+                f"JOIN tasks t ON t.id = g.id ORDER BY g.position")
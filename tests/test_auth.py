@@ -0,0 +1,59 @@
+import pytest
+
+from auth import User, SessionTokens, UserDirectory
+
+USER = User({'id': 7, 'first_name': 'Иван', 'last_name': 'Петров', 'username': 'ipetrov',
+             'email': 'ipetrov@example.com', 'department_id': 3})
+
+
+@pytest.fixture
+def tokens():
+    return SessionTokens(secret=b'test', ttl=60)
+
+
+def test_issued_token_is_verified(tokens):
+    assert tokens.verify(tokens.issue(USER)) == 7
+
+
+@pytest.mark.parametrize('token', ["abc.дд", "бб.abc", "", ".", "abc", "abc.def"])
+def test_malformed_token_is_rejected(tokens, token):
+    assert tokens.verify(token) is None
+
+
+def test_revoked_token_is_rejected(tokens):
+    token = tokens.issue(USER)
+    tokens.revoke(token)
+    assert tokens.verify(token) is None
+
+
+class FakeUsers:
+    """users в памяти: запросы справочника разбираются по началу текста"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.version = 0
+
+    def execute_query(self, query, params=None):
+        if query.startswith('SELECT max(updated_at)'):
+            return [{'updated_at': self.version, 'n': len(self.rows), 'id_sum': sum(row['id'] for row in self.rows)}]
+        # Окно дочитывания: строки с updated_at не старше границы
+        since = params[0] - params[1] if params else None
+        return [row for row in self.rows if since is None or row['updated_at'] >= since]
+
+
+def user_row(user_id: int, username: str, version: int) -> dict:
+    return {'id': user_id, 'first_name': 'Имя', 'last_name': 'Фамилия', 'username': username,
+            'email': f'{username}@example.com', 'updated_at': version}
+
+
+def test_deleted_user_disappears_when_count_is_unchanged():
+    users = FakeUsers([user_row(1, 'first', 0), user_row(2, 'second', 0)])
+    directory = UserDirectory(users, ttl=0, window=0)
+    assert directory.get(1) is not None
+
+    # Один удален, другой добавлен за один ttl: число строк то же
+    users.rows = [user_row(2, 'second', 0), user_row(3, 'third', 1)]
+    users.version = 1
+    assert directory.get(1) is None
+    assert directory.get(3) is not None
+    assert directory.find('Имя', 'Фамилия', 'first@example.com', 'first') is None
@@ -0,0 +1,83 @@
+import pytest
+
+from auth import User
+from intents import IntentMatcher
+
+OPEN_CONDITION = "t.status NOT IN ('completed', 'cancelled')"
+
+USER = User({'id': 7, 'first_name': 'Иван', 'last_name': 'Петров', 'username': 'ipetrov',
+             'email': 'ipetrov@example.com', 'department_id': 3})
+
+
+@pytest.fixture
+def matcher():
+    return IntentMatcher()
+
+
+@pytest.mark.parametrize('prompt', [
+    "мои невыполненные задачи",
+    "мои незавершенные задачи",
+    "мои незавершённые задачи",
+    "мои не выполненные задачи",
+    "мои не закрытые задачи",
+    "my undone tasks",
+    "my unfinished tasks",
+    "my tasks not done",
+])
+def test_negated_completion_means_open(matcher, prompt):
+    match = matcher.match(prompt, USER)
+    assert match is not None
+    assert match.name == 'mine.open'
+    assert OPEN_CONDITION in match.sql
+    assert 'completed' not in match.params
+
+
+@pytest.mark.parametrize('prompt', [
+    "мои завершенные задачи",
+    "мои выполненные задачи",
+    "мои закрытые задачи",
+    "my done tasks",
+    "my completed tasks",
+])
+def test_completed(matcher, prompt):
+    match = matcher.match(prompt, USER)
+    assert match is not None
+    assert match.name == 'mine.completed'
+    assert match.params == (7, 'completed')
+    assert OPEN_CONDITION not in match.sql
+
+
+@pytest.mark.parametrize('prompt', ["мои непросроченные задачи", "мои неважные задачи", "мои неотмененные задачи"])
+def test_negated_filters_are_not_matched(matcher, prompt):
+    match = matcher.match(prompt, USER)
+    assert match is None or not any(part in match.name for part in ('overdue', 'high', 'cancelled'))
+
+
+def test_status_and_grouping(matcher):
+    match = matcher.match("мои новые задачи по статусу", USER)
+    assert match.name == 'mine.new.grouped'
+    assert match.params == (7, 'new')
+
+
+def test_unrecognized_condition_goes_to_llm(matcher):
+    assert matcher.match("мои задачи, где исполнитель сменился дважды", USER) is None
+
+
+@pytest.mark.parametrize('prompt', [
+    "my tasks not in progress",
+    "мои задачи не в работе",
+    "мои задачи не на паузе",
+    "мои задачи не высокого приоритета",
+    "мои не новые задачи",
+    "мои не срочные задачи",
+    "my tasks not on hold",
+    "мои задачи не про отпуск",
+])
+def test_negated_status_or_priority_goes_to_llm(matcher, prompt):
+    assert matcher.match(prompt, USER) is None
+
+
+@pytest.mark.parametrize('prompt', ["покажи мне просроченные задачи", "show me overdue tasks"])
+def test_me_is_not_mine(matcher, prompt):
+    # "мне" / "me" - обращение к сервису, а не фильтр по исполнителю
+    assert matcher.match(prompt, USER) is None
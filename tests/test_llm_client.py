@@ -0,0 +1,137 @@
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from benchmarks.stub_llm import StubLLMServer
+from llm_client import LLMClient, LLMError
+
+
+@pytest.fixture
+def make_stub():
+    stubs = []
+
+    def make(**kwargs):
+        stub = StubLLMServer(**{'latency': 0.0, 'jitter': 0.0, **kwargs})
+        stub.start()
+        stubs.append(stub)
+        return stub
+
+    yield make
+    for stub in stubs:
+        stub.stop()
+
+
+def make_client(url: str, **kwargs) -> LLMClient:
+    return LLMClient(api_url=url, api_key='test', **{'backoff_base': 0.01, 'backoff_max': 5.0, **kwargs})
+
+
+def test_retries_429_until_success(make_stub):
+    stub = make_stub(fail_first=2, retry_after='0.05')
+    client = make_client(stub.url, max_retries=3)
+
+    assert 'SELECT' in client.complete("Найти: задачи", max_tokens=100)
+    assert stub.requests == 3
+
+
+def test_gives_up_after_max_retries(make_stub):
+    stub = make_stub(fail_first=10, retry_after='0')
+    client = make_client(stub.url, max_retries=2)
+
+    with pytest.raises(LLMError) as error:
+        client.complete("Найти: задачи", max_tokens=100)
+    assert error.value.status_code == 429
+    assert stub.requests == 3
+
+
+def test_waits_for_retry_after(make_stub):
+    stub = make_stub(fail_first=1, retry_after='0.4')
+    client = make_client(stub.url, max_retries=1)
+
+    client.complete("Найти: задачи", max_tokens=100)
+    assert stub.request_times[1] - stub.request_times[0] >= 0.35
+
+
+def test_retry_after_is_capped_by_backoff_max(make_stub):
+    stub = make_stub(fail_first=1, retry_after='3600')
+    client = make_client(stub.url, max_retries=1, backoff_max=0.2)
+
+    started = time.monotonic()
+    client.complete("Найти: задачи", max_tokens=100)
+    assert time.monotonic() - started < 2
+
+
+def test_concurrency_cap(make_stub):
+    stub = make_stub(latency=0.2)
+    client = make_client(stub.url, max_concurrency=2)
+
+    threads = [threading.Thread(target=client.complete, args=("Найти: задачи", 100)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stub.requests == 6
+    assert stub.peak_in_flight == 2
+
+
+def test_backoff_does_not_hold_a_slot(make_stub):
+    # Первый запрос получает 429 и ждет 1 с; единственный слот в это время свободен для второго
+    stub = make_stub(fail_first=1, retry_after='1')
+    client = make_client(stub.url, max_concurrency=1, max_retries=1)
+    finished = {}
+
+    def call(name):
+        client.complete("Найти: задачи", max_tokens=100)
+        finished[name] = time.monotonic()
+
+    first = threading.Thread(target=call, args=('first',))
+    first.start()
+    time.sleep(0.2)
+    second = threading.Thread(target=call, args=('second',))
+    second.start()
+    first.join()
+    second.join()
+    assert finished['second'] < finished['first']
+
+
+class MalformedHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        type(self).requests += 1
+        body = b'{"choices": [{"message"'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_malformed_body_is_llm_error():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MalformedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        host, port = server.server_address[:2]
+        client = make_client(f"http://{host}:{port}/v1/chat/completions", max_retries=1)
+        with pytest.raises(LLMError) as error:
+            client.complete("Найти: задачи", max_tokens=100)
+        assert error.value.status_code == 200
+        assert MalformedHandler.requests == 2
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_stream_stops_early(make_stub):
+    stub = make_stub(token_delay=0.01)
+    client = make_client(stub.url)
+
+    text = client.complete("Найти: задачи", max_tokens=100, stream=True, until=lambda text: '```sql' in text)
+    assert text.startswith('```sql')
+    assert 'SELECT' not in text
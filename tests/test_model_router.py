@@ -0,0 +1,150 @@
+import time
+
+import pytest
+
+from benchmarks.stub_llm import StubLLMServer
+from llm_client import LLMError
+from model_router import ModelRouter
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch):
+    # Ключ отдельных клиентов берется у общего клиента
+    monkeypatch.setenv('LLAMA_API_KEY', 'test')
+
+
+@pytest.fixture
+def make_stub():
+    stubs = []
+
+    def make(**kwargs):
+        stub = StubLLMServer(**{'latency': 0.0, 'jitter': 0.0, 'retry_after': None, **kwargs})
+        stub.start()
+        stubs.append(stub)
+        return stub
+
+    yield make
+    for stub in stubs:
+        stub.stop()
+
+
+@pytest.fixture
+def make_router():
+    routers = []
+
+    def make(stubs, **kwargs):
+        models = [(f"model-{i}", stub.url) for i, stub in enumerate(stubs)]
+        router = ModelRouter(models, **{'max_retries': 0, 'min_hedge_delay': 0.05, **kwargs})
+        routers.append(router)
+        return router
+
+    yield make
+    for router in routers:
+        router.close()
+
+
+def test_hedges_after_p95_of_primary(make_stub, make_router):
+    primary, secondary = make_stub(latency=0.1), make_stub()
+    router = make_router([primary, secondary], hedge_delay=10.0, min_samples=3)
+    for _ in range(3):
+        router.complete("Найти: задачи", max_tokens=100)
+    assert secondary.requests == 0
+    assert router._hedge_delay(router.models[0]) < 0.5
+
+    # Основная модель "зависла": ответ приходит от второй через p95, а не через hedge_delay
+    primary.latency = 3.0
+    started = time.monotonic()
+    assert 'SELECT' in router.complete("Найти: задачи", max_tokens=100)
+    assert time.monotonic() - started < 1.5
+    assert secondary.requests == 1
+    assert router.stats()['model-1']['wins'] == 1
+
+
+def test_hedge_delay_is_used_until_enough_samples(make_stub, make_router):
+    primary, secondary = make_stub(latency=1.0), make_stub()
+    router = make_router([primary, secondary], hedge_delay=0.2, min_samples=5)
+
+    started = time.monotonic()
+    router.complete("Найти: задачи", max_tokens=100)
+    assert 0.15 <= time.monotonic() - started < 0.9
+    assert secondary.requests == 1
+
+
+def test_fails_over_on_error(make_stub, make_router):
+    primary, secondary = make_stub(error_rate=1.0), make_stub()
+    router = make_router([primary, secondary], hedge_delay=10.0)
+
+    started = time.monotonic()
+    assert 'SELECT' in router.complete("Найти: задачи", max_tokens=100)
+    # Следующая модель вызывается сразу после ошибки, без задержки хеджирования
+    assert time.monotonic() - started < 1.0
+    stats = router.stats()
+    assert stats['model-0']['errors'] == 1
+    assert stats['model-1']['wins'] == 1
+
+
+def test_fails_over_on_unusable_answer(make_stub, make_router):
+    primary = make_stub(canned=[(r'.', 'не знаю')])
+    secondary = make_stub()
+    router = make_router([primary, secondary], hedge_delay=10.0)
+
+    text = router.complete("Найти: задачи", max_tokens=100, valid=lambda text: 'SELECT' in text)
+    assert 'SELECT' in text
+    assert router.stats()['model-0']['errors'] == 1
+
+
+def test_raises_when_all_models_fail(make_stub, make_router):
+    router = make_router([make_stub(error_rate=1.0), make_stub(error_rate=1.0)], hedge_delay=10.0)
+
+    with pytest.raises(LLMError) as error:
+        router.complete("Найти: задачи", max_tokens=100)
+    assert error.value.status_code == 429
+
+
+def test_ejects_model_after_consecutive_failures(make_stub, make_router):
+    primary, secondary = make_stub(error_rate=1.0), make_stub()
+    router = make_router([primary, secondary], hedge_delay=10.0, eject_after=2, eject_seconds=60.0)
+
+    router.complete("Найти: задачи", max_tokens=100)
+    assert not router.stats()['model-0']['ejected']
+    router.complete("Найти: задачи", max_tokens=100)
+    assert router.stats()['model-0']['ejected']
+
+    # Исключенную модель больше не спрашивают
+    router.complete("Найти: задачи", max_tokens=100)
+    assert primary.requests == 2
+    assert secondary.requests == 3
+
+
+def test_cancels_losing_stream(make_stub, make_router):
+    primary, secondary = make_stub(token_delay=0.05), make_stub()
+    router = make_router([primary, secondary], hedge_delay=0.2)
+
+    assert 'SELECT' in router.complete("Найти: задачи", max_tokens=100, stream=True)
+
+    # Проигравший поток обрывается на следующем фрагменте, а не дочитывается до конца
+    deadline = time.monotonic() + 2.0
+    while primary.cancelled == 0 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert primary.cancelled == 1
+    stats = router.stats()
+    assert stats['model-0']['errors'] == 0
+    assert stats['model-0']['p95_ms'] is None
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_cancels_loser_waiting_for_response(make_stub, make_router, stream):
+    primary, secondary = make_stub(latency=3.0), make_stub()
+    router = make_router([primary, secondary], hedge_delay=0.2)
+
+    assert 'SELECT' in router.complete("Найти: задачи", max_tokens=100, stream=stream)
+
+    # Проигравший еще ждет ответа: его соединение закрывается сразу, и слот клиента освобождается
+    # задолго до того, как основная модель ответила бы
+    client = router._clients[primary.url]
+    free = client._slots._initial_value
+    deadline = time.monotonic() + 1.0
+    while client._slots._value < free and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert client._slots._value == free
+    assert router.stats()['model-0']['errors'] == 0
@@ -0,0 +1,23 @@
+import pytest
+
+from query_guard import QueryGuard
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT id, title FROM tasks",
+    "SELECT t.id, t.title FROM tasks t WHERE t.status = 'new' LIMIT 10",
+    "SELECT id FROM public.tasks AS t WHERE id IN (SELECT task_id FROM task_history)",
+])
+def test_single_table(sql):
+    assert QueryGuard._single_table(sql)
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT t.id, h.field_name FROM tasks t JOIN task_history h ON h.task_id = t.id",
+    "SELECT t.id FROM tasks t, users u WHERE u.id = t.assigned_user_id",
+    "SELECT id, unnest(tags) AS tag FROM tasks",
+    "SELECT id FROM tasks UNION ALL SELECT id FROM tasks",
+    "WITH x AS (SELECT id FROM tasks) SELECT id FROM x",
+])
+def test_not_single_table(sql):
+    assert not QueryGuard._single_table(sql)
@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+from database import DatabaseManager, close_all_pools
+
+# Нужны два Postgres: основной и реплика (pg_basebackup -R), например
+# TEST_DB_HOST=/tmp TEST_DB_PORT=5434 TEST_REPLICA_PORT=5435 python -m pytest tests/test_replicas.py
+pytestmark = pytest.mark.skipif(not (os.environ.get('TEST_DB_PORT') and os.environ.get('TEST_REPLICA_PORT')),
+                                reason="TEST_DB_PORT and TEST_REPLICA_PORT are not set")
+
+RECOVERY_QUERY = "SELECT pg_is_in_recovery() AS replica"
+
+
+def db_config(port) -> dict:
+    return {
+        'host': os.environ.get('TEST_DB_HOST', 'localhost'),
+        'port': int(port),
+        'database': os.environ.get('TEST_DB_NAME', 'task_db'),
+        'user': os.environ.get('TEST_DB_USER', 'postgres'),
+        'password': os.environ.get('TEST_DB_PASSWORD', 'postgres'),
+    }
+
+
+@pytest.fixture
+def make_manager():
+    def make(replica_ports=None, result_cache=None, **replica_config):
+        ports = replica_ports or [os.environ['TEST_REPLICA_PORT']]
+        return DatabaseManager(db_config(os.environ['TEST_DB_PORT']), use_sqlalchemy=False, pooled=True,
+                               replicas=[db_config(port) for port in ports], result_cache=result_cache,
+                               replica_config={'check_interval': 60.0, 'connect_timeout': 1, **replica_config})
+
+    yield make
+    # Наборы реплик общие на процесс: каждый тест начинает с новой проверки
+    close_all_pools()
+
+
+def served_by_replica(manager: DatabaseManager, query: str = RECOVERY_QUERY) -> bool:
+    return manager.execute_query(query)[0]['replica']
+
+
+def test_read_goes_to_replica(make_manager):
+    manager = make_manager()
+
+    assert served_by_replica(manager)
+    replica = next(iter(manager.replica_stats()['replicas'].values()))
+    assert replica['healthy'] and replica['queries'] == 1
+
+
+def test_write_stays_on_primary(make_manager):
+    manager = make_manager()
+
+    assert not served_by_replica(manager, RECOVERY_QUERY + ", pg_advisory_unlock_all()")
+    assert not served_by_replica(manager, RECOVERY_QUERY + " FROM users LIMIT 1 FOR UPDATE")
+
+
+def test_lagging_replica_is_skipped(make_manager):
+    # Даже отставание 0 больше отрицательного порога
+    manager = make_manager(max_lag_seconds=-1.0)
+
+    assert not served_by_replica(manager)
+    assert manager.replica_stats()['primary_fallbacks'] == 1
+
+
+def test_unreachable_replica_falls_back_to_primary(make_manager):
+    manager = make_manager(replica_ports=[1])
+
+    assert not served_by_replica(manager)
+    stats = manager.replica_stats()
+    replica = next(iter(stats['replicas'].values()))
+    assert not replica['healthy'] and replica['error']
+    assert stats['primary_fallbacks'] == 1
+
+
+def test_primary_listed_as_replica_is_rejected(make_manager):
+    manager = make_manager(replica_ports=[os.environ['TEST_DB_PORT']])
+
+    assert not served_by_replica(manager)
+    replica = next(iter(manager.replica_stats()['replicas'].values()))
+    assert not replica['healthy'] and 'not in recovery' in replica['error']
+
+
+class RecordingCache:
+    """Кэш, который всегда промахивается и запоминает, какой функцией выполнен запрос"""
+
+    def __init__(self, cacheable: bool):
+        self.cacheable = cacheable
+
+    def fetch(self, query, params, execute, uncached=None):
+        return execute() if self.cacheable else (uncached or execute)()
+
+
+def test_cache_is_filled_from_primary(make_manager):
+    # Свежесть кэша сверяется по основной БД: ответ реплики мог бы отставать от нее
+    assert not served_by_replica(make_manager(result_cache=RecordingCache(cacheable=True)))
+
+
+def test_uncached_read_still_goes_to_replica(make_manager):
+    assert served_by_replica(make_manager(result_cache=RecordingCache(cacheable=False)))
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from auth import User
+from service import HTTPError, QueryService, Session
+
+
+def read_request(raw: bytes):
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await QueryService._read_request(reader)
+    return asyncio.run(main())
+
+
+def test_body_is_read_by_content_length():
+    method, path, headers, body = read_request(b'POST /ask?x=1 HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}')
+    assert (method, path, body) == ('POST', '/ask', b'{}')
+
+
+@pytest.mark.parametrize('value', [b'abc', b'-1', b'1.5'])
+def test_malformed_content_length_is_bad_request(value):
+    with pytest.raises(HTTPError) as e:
+        read_request(b'POST /ask HTTP/1.1\r\nContent-Length: ' + value + b'\r\n\r\n')
+    assert e.value.status == 400
+
+
+@pytest.fixture
+def service():
+    # Без сервера и БД: сессия подставляется напрямую
+    service = QueryService.__new__(QueryService)
+    session = Session(User({'id': 7, 'first_name': 'Иван', 'last_name': 'Петров', 'username': 'ipetrov',
+                            'email': 'ipetrov@example.com'}))
+
+    async def get_session(headers):
+        return session
+
+    service._session = get_session
+    return service
+
+
+@pytest.mark.parametrize('payload, status', [
+    ({'next': ['abc']}, 400),
+    ({'next': {'id': 'abc'}}, 400),
+    ({}, 400),
+    ({'next': 'abc'}, 404),
+])
+def test_next_validates_page_token(service, payload, status):
+    with pytest.raises(HTTPError) as e:
+        asyncio.run(service._next(payload, {}))
+    assert e.value.status == status
+
+
+def test_ask_rejects_non_string_format(service):
+    service.per_user = 1
+    with pytest.raises(HTTPError) as e:
+        asyncio.run(service._ask({'prompt': 'мои задачи', 'format': ['csv']}, {}))
+    assert e.value.status == 400
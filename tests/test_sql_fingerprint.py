@@ -0,0 +1,31 @@
+import pytest
+
+from sql_fingerprint import fingerprint
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT id FROM tasks WHERE status = 'open'",
+    "SELECT id FROM tasks WHERE status = 'open';",
+    "select id  from tasks\nwhere status = 'open' ;",
+    "SELECT id FROM tasks WHERE status = 'open'; -- открытые",
+    "SELECT id FROM tasks WHERE status = 'open' /* открытые */ ;",
+    "-- открытые\nSELECT id FROM tasks WHERE status = 'open';;",
+])
+def test_trailing_semicolon_and_comments_do_not_change_key(sql):
+    reference = fingerprint("SELECT id FROM tasks WHERE status = 'open'")
+    shape = fingerprint(sql)
+    assert shape.sql == 'select id from tasks where status = %s'
+    assert shape.params == ('open',)
+    assert shape.key == reference.key
+
+
+def test_literals_become_params():
+    shape = fingerprint("SELECT * FROM tasks WHERE id = 7 AND title LIKE '50%' ORDER BY 1 LIMIT 10")
+    assert shape.sql == 'select * from tasks where id = %s and title like %s order by 1 limit %s'
+    assert shape.params == (7, '50%', 10)
+
+
+def test_semicolon_inside_string_is_kept():
+    shape = fingerprint("SELECT 'a;' ; -- x")
+    assert shape.sql == 'select %s'
+    assert shape.params == ('a;',)
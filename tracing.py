@@ -0,0 +1,348 @@
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, Dict, Any, List, Tuple
+
+
+# Границы корзин гистограммы длительностей, сек: от шаблонов и кэша до долгих ответов LLM
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Числовые атрибуты span, которые суммируются в счетчики: атрибут -> (метрика, доп. метка)
+COUNTERS = {
+    'prompt_tokens': ('smart_line_llm_tokens_total', ('kind', 'prompt')),
+    'completion_tokens': ('smart_line_llm_tokens_total', ('kind', 'completion')),
+    'rows': ('smart_line_rows_total', None),
+    'bytes': ('smart_line_bytes_written_total', None),
+    'coalesced': ('smart_line_coalesced_total', None),
+}
+
+METRIC_HELP = {
+    'smart_line_span_duration_seconds': ('histogram', "Duration of pipeline stages"),
+    'smart_line_span_errors_total': ('counter', "Pipeline stages that raised an exception"),
+    'smart_line_llm_tokens_total': ('counter', "LLM tokens reported by the API"),
+    'smart_line_rows_total': ('counter', "Rows returned or exported"),
+    'smart_line_bytes_written_total': ('counter', "Bytes written to output files"),
+    'smart_line_cache_total': ('counter', "Cache lookups by result"),
+    'smart_line_coalesced_total': ('counter', "Calls answered by an identical call already in flight"),
+}
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """
+    Один этап обработки промпта: длительность, атрибуты и место в дереве вызовов
+
+    Вложенность определяется через contextvars, поэтому span внутри asyncio.to_thread
+    (batch.py) попадает в трассу промпта, который его запустил.
+    """
+
+    __slots__ = ('tracer', 'name', 'attributes', 'trace_id', 'span_id', 'parent_id',
+                 'started_at', 'started', 'duration', 'error', '_token')
+
+    def __init__(self, tracer: 'Tracer', name: str, attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> 'Span':
+        parent = _current_span.get()
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        self.span_id = f"{random.getrandbits(32):08x}"
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.duration = time.perf_counter() - self.started
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self.tracer.finish(self)
+        return False
+
+
+class _NoopSpan:
+    """Span выключенной трассировки: ничего не замеряет и не хранит"""
+
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Metrics:
+    """Счетчики и гистограммы в памяти с выводом в текстовом формате Prometheus"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        # метки -> [счетчики корзин..., сумма, количество]
+        self._histograms: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, labels: Tuple[Tuple[str, str], ...], value: float = 1.0):
+        with self._lock:
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, labels: Tuple[Tuple[str, str], ...], seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(labels)
+            if histogram is None:
+                histogram = self._histograms[labels] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def render(self) -> str:
+        """Все метрики в формате text/plain; version=0.0.4"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+
+        lines = []
+        name = 'smart_line_span_duration_seconds'
+        lines.extend(self._header(name))
+        for labels, histogram in histograms:
+            for bound, count in zip(self.buckets, histogram):
+                lines.append(f"{name}_bucket{self._labels(labels + (('le', repr(bound)),))} {count:g}")
+            lines.append(f"{name}_bucket{self._labels(labels + (('le', '+Inf'),))} {histogram[-1]:g}")
+            lines.append(f"{name}_sum{self._labels(labels)} {histogram[-2]:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {histogram[-1]:g}")
+
+        written = set()
+        for (name, labels), value in counters:
+            if name not in written:
+                lines.extend(self._header(name))
+                written.add(name)
+            lines.append(f"{name}{self._labels(labels)} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _header(name: str) -> List[str]:
+        kind, help_text = METRIC_HELP[name]
+        return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+
+    @staticmethod
+    def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+        if not labels:
+            return ''
+        escaped = (key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+                   for key, value in labels)
+        return '{' + ','.join(escaped) + '}'
+
+
+class Tracer:
+    """
+    Трассировка этапов обработки промпта с выгрузкой метрик и JSON-логов
+
+    Каждый завершенный span обновляет метрики (длительность, токены, строки,
+    байты, попадания в кэш, ошибки) и, если задан log_path, пишется одной
+    JSON-строкой. Метрики отдаются по HTTP (/metrics) и/или периодически
+    сохраняются в файл для textfile-коллектора node_exporter.
+    """
+
+    def __init__(self, metrics_file: Optional[str] = None, metrics_port: Optional[int] = None,
+                 log_path: Optional[str] = None, flush_interval: float = 10.0):
+        """
+        Args:
+            metrics_file: Файл с метриками в формате Prometheus (None - не писать)
+            metrics_port: Порт HTTP-сервера с /metrics (None - не поднимать)
+            log_path: JSONL со span-ами; '-' - stderr, None - без логов
+            flush_interval: Как часто переписывать metrics_file, сек
+        """
+        self.metrics = Metrics()
+        self.metrics_file = metrics_file
+        self.flush_interval = flush_interval
+        self._flushed_at = 0.0
+        self._flush_lock = threading.Lock()
+        self._server = None
+        self.logger = logging.getLogger(__name__)
+
+        self.span_logger = None
+        if log_path:
+            self.span_logger = logging.getLogger(f"{__name__}.spans")
+            self.span_logger.propagate = False
+            self.span_logger.setLevel(logging.INFO)
+            handler = logging.StreamHandler() if log_path == '-' else logging.FileHandler(log_path, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.span_logger.handlers = [handler]
+
+        if metrics_port is not None:
+            self._serve(metrics_port)
+        if metrics_file:
+            atexit.register(self.flush)
+
+    def span(self, name: str, attributes: Dict[str, Any]) -> Span:
+        return Span(self, name, attributes)
+
+    def finish(self, span: Span):
+        labels = (('span', span.name),)
+        self.metrics.observe(labels, span.duration)
+        if span.error is not None:
+            self.metrics.inc('smart_line_span_errors_total', labels + (('error', span.error),))
+
+        for attribute, value in span.attributes.items():
+            if attribute in COUNTERS and isinstance(value, (int, float)):
+                name, extra = COUNTERS[attribute]
+                self.metrics.inc(name, labels + ((extra,) if extra else ()), value)
+            elif attribute == 'cache_hit':
+                self.metrics.inc('smart_line_cache_total', labels + (('result', 'hit' if value else 'miss'),))
+
+        if self.span_logger is not None:
+            record = {'ts': round(span.started_at, 6), 'trace_id': span.trace_id, 'span_id': span.span_id,
+                      'parent_id': span.parent_id, 'name': span.name,
+                      'duration_ms': round(span.duration * 1000, 3),
+                      'status': 'error' if span.error else 'ok', **span.attributes}
+            if span.error:
+                record['error'] = span.error
+            self.span_logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+        if self.metrics_file and time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Атомарная перезапись metrics_file текущими значениями"""
+        if not self.metrics_file:
+            return
+        with self._flush_lock:
+            self._flushed_at = time.monotonic()
+            tmp_path = f"{self.metrics_file}.tmp"
+            try:
+                directory = os.path.dirname(self.metrics_file)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(self.metrics.render())
+                os.replace(tmp_path, self.metrics_file)
+            except OSError as e:
+                self.logger.error(f"Could not write metrics file {self.metrics_file}: {e}")
+
+    def _serve(self, port: int):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+        self.logger.info(f"Serving metrics on :{port}/metrics")
+
+    def close(self):
+        self.flush()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def _tracer_from_env() -> Optional[Tracer]:
+    '''
+        TRACING=1 включает трассировку; TRACE_METRICS_FILE - файл метрик, TRACE_METRICS_PORT - порт /metrics,
+        TRACE_LOG - JSONL со span-ами ('-' - stderr)
+    '''
+    if os.environ.get('TRACING', '0') == '0':
+        return None
+    port = os.environ.get('TRACE_METRICS_PORT')
+    return Tracer(
+        metrics_file=os.environ.get('TRACE_METRICS_FILE') or None,
+        metrics_port=int(port) if port else None,
+        log_path=os.environ.get('TRACE_LOG') or None,
+        flush_interval=float(os.environ.get('TRACE_METRICS_FLUSH_SECONDS', 10.0)),
+    )
+
+
+# Трассировка выключена, пока не задан TRACING=1 или не вызван configure_tracing
+_tracer = _tracer_from_env()
+
+
+def configure_tracing(**kwargs) -> Tracer:
+    """Включение трассировки с заданными параметрами (см. Tracer)"""
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = Tracer(**kwargs)
+    return _tracer
+
+
+def disable_tracing():
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = None
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def span(name: str, **attributes):
+    """
+    Контекстный менеджер этапа: with span('llm.plan') as s: ...; s.set(rows=10)
+
+    При выключенной трассировке возвращает общий пустой span без замеров.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return NOOP_SPAN
+    return tracer.span(name, attributes)
+
+
+def annotate(**attributes):
+    """Добавление атрибутов к текущему span (например, токенов из ответа LLM)"""
+    if _tracer is None:
+        return
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def traced(name: str):
+    """Декоратор: вызов функции целиком становится span с именем name"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return function(*args, **kwargs)
+            with tracer.span(name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator